@@ -0,0 +1,122 @@
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from app import config
+from app.exceptions import DataSourceException
+from app.metrics import ACCOUNT_SESSIONS, ACCOUNT_HEALTH, ACCOUNT_COOLDOWNS
+from app.singleton import Singleton
+
+# Weight of the most recent outcome in an account's health score
+HEALTH_SCORE_WEIGHT = 0.1
+
+
+@dataclass(eq=False)
+class Account:
+    """FESL credentials along with the account's current load and health"""
+
+    username: str = field(repr=False)
+    password: str = field(repr=False)
+    # Identifies the account in metrics/logs without revealing the username ("default" or position in CLIENT_ACCOUNTS)
+    label: str
+    # Number of (FESL and Theater) sessions currently open using the account
+    sessions: int = 0
+    # Weighted share of recent requests (by any of the account's sessions) which succeeded in time
+    health: float = 1.0
+    # Account is out of rotation until then (time.monotonic)
+    cooldown_until: float = 0.0
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self.cooldown_until
+
+
+def parse_accounts(
+    accounts: Optional[str], username: Optional[str], password: Optional[str]
+) -> List[Account]:
+    """Parse comma-separated username:password pairs, adding the default credentials as the first account"""
+    parsed = []
+    if username is not None:
+        parsed.append(Account(username, password or "", "default"))
+    entries = [entry.strip() for entry in (accounts or "").split(",")]
+    for position, entry in enumerate(e for e in entries if e != ""):
+        entry_username, separator, entry_password = entry.partition(":")
+        if separator == "":
+            raise ValueError(
+                f"Invalid account (expected username:password) at position {position}"
+            )
+        parsed.append(Account(entry_username, entry_password, str(position)))
+    return parsed
+
+
+class AccountPool(metaclass=Singleton):
+    """
+    Spreads upstream sessions across all configured accounts, taking accounts out of rotation for a while
+    if their credentials are rejected or requests using them keep failing
+    """
+
+    accounts: List[Account]
+    logger: logging.Logger
+
+    def __init__(self, accounts: Optional[List[Account]] = None):
+        if accounts is None:
+            accounts = parse_accounts(
+                config.CLIENT_ACCOUNTS, config.CLIENT_USERNAME, config.CLIENT_PASSWORD
+            )
+        self.accounts = accounts
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def acquire(self) -> Account:
+        """Get account to open a new session with (the least loaded one which is in rotation)"""
+        if len(self.accounts) == 0:
+            raise DataSourceException("No accounts are configured")
+        candidates = [
+            a
+            for a in self.accounts
+            if config.CLIENT_ACCOUNT_MAX_SESSIONS <= 0
+            or a.sessions < config.CLIENT_ACCOUNT_MAX_SESSIONS
+        ]
+        if len(candidates) == 0:
+            raise DataSourceException("All accounts are at their session limit")
+
+        available = [a for a in candidates if a.available]
+        if len(available) > 0:
+            account = min(available, key=lambda a: a.sessions)
+        else:
+            # Better to try an account which is cooling down than to not try at all
+            account = min(candidates, key=lambda a: a.cooldown_until)
+
+        account.sessions += 1
+        ACCOUNT_SESSIONS.labels(account.label).set(account.sessions)
+        return account
+
+    def should_move(self, account: Account) -> bool:
+        """Whether sessions should be moved off the given account (only if there is an account to move them to)"""
+        return not account.available and any(a.available for a in self.accounts)
+
+    def release(self, account: Account) -> None:
+        account.sessions -= 1
+        ACCOUNT_SESSIONS.labels(account.label).set(account.sessions)
+
+    def record_outcome(self, account: Account, succeeded: bool) -> None:
+        account.health += HEALTH_SCORE_WEIGHT * (float(succeeded) - account.health)
+        ACCOUNT_HEALTH.labels(account.label).set(account.health)
+        if account.available and account.health < config.CLIENT_MIN_HEALTH:
+            self.cool_down(account, "health")
+
+    def record_auth_error(self, account: Account) -> None:
+        # Credentials were rejected (or the account is throttled), no point in trying again right away
+        if account.available:
+            self.cool_down(account, "auth")
+
+    def cool_down(self, account: Account, reason: str) -> None:
+        self.logger.warning(
+            f"Taking account {account.label} out of rotation for "
+            f"{config.CLIENT_ACCOUNT_COOLDOWN} seconds ({reason})"
+        )
+        ACCOUNT_COOLDOWNS.labels(account.label, reason).inc()
+        account.cooldown_until = time.monotonic() + config.CLIENT_ACCOUNT_COOLDOWN
+        # Give the account a clean slate once it is back in rotation
+        account.health = 1.0
+        ACCOUNT_HEALTH.labels(account.label).set(account.health)
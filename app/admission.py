@@ -0,0 +1,32 @@
+from contextvars import ContextVar
+from typing import Optional
+
+from app import config
+from app.cache import RedisClient
+from app.exceptions import RateLimitedException
+from app.metrics import ADMISSION_REJECTED
+from app.scheduler import Priority, upstream_priority
+
+# Address of the client the current request is handled for
+client_address: ContextVar[Optional[str]] = ContextVar("client_address", default=None)
+
+
+async def admit_client() -> None:
+    """
+    Take a token from the current client's bucket before doing upstream work on its behalf, raising
+    RateLimitedException if the client exceeded its rate (does nothing unless per client limits are enabled)
+    """
+    address = client_address.get()
+    if (
+        config.CLIENT_RATE_LIMIT <= 0
+        or address is None
+        or upstream_priority.get() != Priority.interactive
+    ):
+        return
+
+    wait = await RedisClient().take_token(
+        f"ratelimit:{address}", config.CLIENT_RATE_LIMIT, config.CLIENT_RATE_LIMIT_BURST
+    )
+    if wait > 0:
+        ADMISSION_REJECTED.labels("rate_limited").inc()
+        raise RateLimitedException(f"Too many requests from {address}", wait)
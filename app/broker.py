@@ -0,0 +1,323 @@
+"""
+Optional session broker for multi-worker deployments: a single broker process owns all upstream FESL/Theater sessions
+(including pooling, maintenance and crawls), while HTTP worker processes send their upstream requests to it via a
+Unix socket. Caching stays in the workers, since redis is shared anyway.
+
+Run the broker with `python -m app.broker` and set SESSION_BROKER_SOCKET for both the broker and the workers.
+"""
+import asyncio
+import functools
+import itertools
+import logging
+import os
+import pickle
+import struct
+from contextvars import Context
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple, TypeVar
+
+from prometheus_client import start_http_server
+
+from app import config
+from app.admission import client_address
+from app.exceptions import DataSourceException, DeadlineExceededException
+from app.scheduler import Priority, upstream_priority
+from app.singleton import Singleton
+from app.timing import (
+    RequestTimings,
+    request_timings,
+    timed,
+    get_remaining_time,
+    create_background_task,
+)
+
+# payload length
+FRAME_HEADER = struct.Struct(">I")
+# Name of the pseudo-client used to check whether the broker is ready to serve requests
+BROKER_CLIENT_NAME = "SessionBroker"
+
+# Methods which (if enabled) are run by the broker instead of the calling process
+BROKERED_METHODS: Set[str] = set()
+# Whether the current process is the broker
+serving = False
+
+T = TypeVar("T")
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Any:
+    header = await reader.readexactly(FRAME_HEADER.size)
+    (length,) = FRAME_HEADER.unpack(header)
+    return pickle.loads(await reader.readexactly(length))
+
+
+def write_frame(writer: asyncio.StreamWriter, payload: Any) -> None:
+    # Frames are written in a single call, so concurrent writers cannot interleave them
+    data = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+    writer.write(FRAME_HEADER.pack(len(data)) + data)
+
+
+def brokered(method: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """Run the decorated client method via the session broker, if the broker is enabled"""
+    BROKERED_METHODS.add(method.__name__)
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs) -> T:
+        if config.SESSION_BROKER_SOCKET is None or serving:
+            return await method(self, *args, **kwargs)
+        return await SessionBrokerClient().call(
+            self.name, method.__name__, args, kwargs
+        )
+
+    return wrapper
+
+
+class SessionBrokerClient(metaclass=Singleton):
+    """Sends requests to the session broker, multiplexing them over a single connection"""
+
+    path: str
+    reader: Optional[asyncio.StreamReader]
+    writer: Optional[asyncio.StreamWriter]
+    receiver: Optional[asyncio.Task]
+    pending: Dict[int, asyncio.Future]
+    request_ids: itertools.count
+    connecting: asyncio.Lock
+
+    def __init__(self, path: str = config.SESSION_BROKER_SOCKET):
+        self.path = path
+        self.reader = None
+        self.writer = None
+        self.receiver = None
+        self.pending = {}
+        self.request_ids = itertools.count()
+        self.connecting = asyncio.Lock()
+
+    async def connect(self) -> asyncio.StreamWriter:
+        async with self.connecting:
+            if self.writer is None or self.writer.is_closing():
+                try:
+                    self.reader, self.writer = await asyncio.open_unix_connection(
+                        self.path
+                    )
+                except OSError as e:
+                    raise DataSourceException(
+                        f"Session broker is unavailable: {e}"
+                    ) from None
+                self.receiver = create_background_task(
+                    self.receive(self.reader, self.writer)
+                )
+            return self.writer
+
+    async def receive(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                request_id, error, result = await read_frame(reader)
+                future = self.pending.get(request_id)
+                if future is None or future.done():
+                    # Caller gave up (e.g. request was cancelled)
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+        finally:
+            writer.close()
+            # Fail any requests sent via this connection
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(
+                        DataSourceException("Connection to session broker was lost")
+                    )
+
+    async def call(
+        self, client: str, method: str, args: Tuple = (), kwargs: Dict = None
+    ) -> Any:
+        remaining = get_remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceededException("Request deadline exceeded")
+
+        writer = await self.connect()
+        request_id = next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            with timed("broker"):
+                write_frame(
+                    writer,
+                    (
+                        request_id,
+                        client,
+                        method,
+                        args,
+                        kwargs or {},
+                        remaining,
+                        upstream_priority.get(),
+                        client_address.get(),
+                    ),
+                )
+                await writer.drain()
+                result, phases = await future
+        except OSError as e:
+            raise DataSourceException(
+                f"Failed to send request to session broker: {e}"
+            ) from None
+        finally:
+            self.pending.pop(request_id, None)
+
+        # Report time spent on the broker's side as part of the current request
+        timings = request_timings.get()
+        if timings is not None:
+            for phase, duration in phases.items():
+                timings.add(phase, duration)
+        return result
+
+    async def is_ready(self) -> bool:
+        try:
+            return await self.call(BROKER_CLIENT_NAME, "is_ready")
+        except DataSourceException:
+            return False
+
+
+class SessionBroker(metaclass=Singleton):
+    """Runs requests sent by worker processes using the broker's (upstream) clients"""
+
+    clients: Dict[str, Any]
+    warm_up: Optional[asyncio.Task]
+    logger: logging.Logger
+
+    def __init__(self, clients: Dict[str, Any]):
+        self.clients = clients
+        self.warm_up = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def is_ready(self) -> bool:
+        return (
+            self.warm_up is not None
+            and self.warm_up.done()
+            and not self.warm_up.cancelled()
+            and self.warm_up.exception() is None
+        )
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        tasks = set()
+        try:
+            while True:
+                request = await read_frame(reader)
+                # Handle every request in its own context, so timings/deadlines do not leak between requests
+                task = asyncio.create_task(
+                    self.handle_request(writer, *request), context=Context()
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+        finally:
+            # Worker went away, nobody is waiting for any results
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def handle_request(
+        self,
+        writer: asyncio.StreamWriter,
+        request_id: int,
+        client: str,
+        method: str,
+        args: Tuple,
+        kwargs: Dict,
+        remaining: Optional[float],
+        priority: Priority,
+        address: Optional[str],
+    ) -> None:
+        timings = RequestTimings()
+        if remaining is not None:
+            # Continue with the worker's deadline
+            timings.start -= config.REQUEST_DEADLINE - remaining
+        request_timings.set(timings)
+        upstream_priority.set(priority)
+        client_address.set(address)
+
+        error = result = None
+        try:
+            result = (await self.run(client, method, args, kwargs), timings.phases)
+        except Exception as e:
+            error = e
+
+        if writer.is_closing():
+            return
+        try:
+            write_frame(writer, (request_id, error, result))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            self.logger.error(f"Failed to serialize response to {client}.{method}")
+            write_frame(
+                writer,
+                (
+                    request_id,
+                    DataSourceException(f"Session broker error: {error}"),
+                    None,
+                ),
+            )
+        try:
+            await writer.drain()
+        except OSError:
+            pass
+
+    async def run(self, client: str, method: str, args: Tuple, kwargs: Dict) -> Any:
+        if client == BROKER_CLIENT_NAME and method == "is_ready":
+            return self.is_ready()
+        if client not in self.clients or method not in BROKERED_METHODS:
+            raise DataSourceException(
+                f"Session broker does not support {client}.{method}"
+            )
+        return await getattr(self.clients[client], method)(*args, **kwargs)
+
+
+async def serve() -> None:
+    global serving
+    serving = True
+
+    # Imported here, since the clients' methods use this module
+    from app.cache import RedisClient
+    from app.fetch import FeslApiClient, TheaterApiClient
+    from app.main import warm_up, crawl_server_details
+
+    broker = SessionBroker(
+        {
+            "FeslApiClient": FeslApiClient(config.CLIENT_TIMEOUT),
+            "TheaterApiClient": TheaterApiClient(config.CLIENT_TIMEOUT),
+        }
+    )
+    await RedisClient().redis_connect()
+
+    # Remove socket left behind by a previous broker process
+    if os.path.exists(config.SESSION_BROKER_SOCKET):
+        os.unlink(config.SESSION_BROKER_SOCKET)
+    # Only processes of the same user may send requests (requests are unpickled), so the socket needs to be created
+    # with restrictive permissions right away instead of changing them once anyone could have connected
+    umask = os.umask(0o077)
+    try:
+        server = await asyncio.start_unix_server(
+            broker.handle_connection, path=config.SESSION_BROKER_SOCKET
+        )
+    finally:
+        os.umask(umask)
+    broker.logger.info(f"Listening on {config.SESSION_BROKER_SOCKET}")
+
+    broker.warm_up = create_background_task(warm_up())
+    await crawl_server_details()
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(name)-16s %(levelname)-8s %(message)s"
+    )
+    if config.SESSION_BROKER_METRICS_PORT > 0:
+        # Upstream/pool metrics are only collected by the broker
+        start_http_server(config.SESSION_BROKER_METRICS_PORT)
+    asyncio.run(serve())
@@ -1,6 +1,7 @@
 import sys
+from contextvars import ContextVar
 from datetime import timedelta
-from typing import Any
+from typing import Any, List, Optional, Tuple
 
 import redis.asyncio.client
 import redis.asyncio
@@ -9,6 +10,40 @@ import redis
 
 from app.singleton import Singleton
 from app import config
+from app.metrics import count_cache_lookup
+from app.timing import timed
+
+STALE_KEY_PREFIX = "stale:"
+# Takes a token from a bucket refilled at a given rate (up to a burst), returning the number of seconds until a token
+# is available if the bucket is empty (using redis' clock, so all workers agree on refills)
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(now - updated, 0) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+# Keys of stale copies served while handling the current request
+stale_keys: ContextVar[Optional[List[str]]] = ContextVar("stale_keys", default=None)
+
+
+def mark_stale(key: str) -> None:
+    keys = stale_keys.get()
+    if keys is not None:
+        keys.append(key)
 
 
 class RedisClient(metaclass=Singleton):
@@ -45,37 +80,152 @@ class RedisClient(metaclass=Singleton):
         """Data from redis."""
         val = None
         try:
-            val = await self.client.get(key)
+            with timed("cache"):
+                val = await self.client.get(config.REDIS_KEY_PREFIX + key)
+        except Exception as e:
+            print(f"failed to get cache! {e}")
+        count_cache_lookup(key, val is not None)
+        return val
+
+    async def get_from_cache_with_ttl(self, key: str) -> Tuple[Any, Optional[float]]:
+        """Data from redis, along with its remaining ttl in seconds (None if unknown or no ttl is set)."""
+        val = ttl = None
+        try:
+            with timed("cache"):
+                async with self.client.pipeline(transaction=False) as pipe:
+                    pipe.get(config.REDIS_KEY_PREFIX + key)
+                    pipe.pttl(config.REDIS_KEY_PREFIX + key)
+                    val, pttl = await pipe.execute()
+            if val is not None and pttl >= 0:
+                ttl = pttl / 1000
         except Exception as e:
             print(f"failed to get cache! {e}")
+        count_cache_lookup(key, val is not None)
+        return val, ttl
+
+    async def get_from_cache_with_ttl_and_related(
+        self, key: str, related_key: str
+    ) -> Tuple[Any, Optional[float], Any]:
+        """Data from redis along with its remaining ttl (see get_from_cache_with_ttl) and the data of a related key."""
+        val = ttl = related_val = None
+        try:
+            with timed("cache"):
+                async with self.client.pipeline(transaction=False) as pipe:
+                    pipe.get(config.REDIS_KEY_PREFIX + key)
+                    pipe.pttl(config.REDIS_KEY_PREFIX + key)
+                    pipe.get(config.REDIS_KEY_PREFIX + related_key)
+                    val, pttl, related_val = await pipe.execute()
+            if val is not None and pttl >= 0:
+                ttl = pttl / 1000
+        except Exception as e:
+            print(f"failed to get cache! {e}")
+        count_cache_lookup(key, val is not None)
+        return val, ttl, related_val
+
+    async def get_stale_from_cache(self, key: str) -> Any:
+        """Stale copy of data from redis (retained beyond the data's ttl)."""
+        val = await self.get_from_cache(STALE_KEY_PREFIX + key)
+        if val is not None:
+            mark_stale(key)
         return val
 
     async def set_to_cache(
-        self, key: str, value: str, ttl: int = config.CACHE_TTL_DEFAULT
+        self,
+        key: str,
+        value: str,
+        ttl: int = config.CACHE_TTL_DEFAULT,
+        keep_stale: bool = False,
     ) -> bool:
-        """Data to redis."""
+        """Data to redis (optionally retaining a stale copy to fall back to once the data expired)."""
         try:
-            state = await self.client.setex(key, timedelta(seconds=ttl), value=value)
-            return state
+            if not keep_stale or config.CACHE_STALE_TTL <= 0:
+                state = await self.client.setex(
+                    config.REDIS_KEY_PREFIX + key, timedelta(seconds=ttl), value=value
+                )
+                return state
+
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.setex(
+                    config.REDIS_KEY_PREFIX + key, timedelta(seconds=ttl), value=value
+                )
+                pipe.setex(
+                    config.REDIS_KEY_PREFIX + STALE_KEY_PREFIX + key,
+                    timedelta(seconds=int(ttl) + config.CACHE_STALE_TTL),
+                    value=value,
+                )
+                states = await pipe.execute()
+            return all(states)
         except Exception as e:
             print(f"failed to set cache! {e}")
 
+    async def increment(self, key: str) -> Optional[int]:
+        """Increment counter in redis."""
+        try:
+            return await self.client.incr(config.REDIS_KEY_PREFIX + key)
+        except Exception as e:
+            print(f"failed to increment counter! {e}")
+
+    async def take_token(self, key: str, rate: float, burst: float) -> float:
+        """Take token from bucket in redis, returning seconds until a token is available if none is left (0 = taken)."""
+        try:
+            with timed("cache"):
+                wait = await self.client.eval(
+                    TOKEN_BUCKET_SCRIPT, 1, config.REDIS_KEY_PREFIX + key, rate, burst
+                )
+            return float(wait)
+        except Exception as e:
+            # Do not turn away requests just because redis is unavailable
+            print(f"failed to take token! {e}")
+            return 0.0
+
+    async def publish(self, channel: str, message: str) -> Optional[int]:
+        """Publish message to redis channel."""
+        try:
+            return await self.client.publish(config.REDIS_KEY_PREFIX + channel, message)
+        except Exception as e:
+            print(f"failed to publish message! {e}")
+
+    async def subscribe(self, *channels: str) -> redis.asyncio.client.PubSub:
+        """Subscribe to redis channels."""
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(
+            *[config.REDIS_KEY_PREFIX + channel for channel in channels]
+        )
+        return pubsub
+
     async def get_multiple_from_cache(self, keys: list[str]) -> Any:
+        """Data of multiple keys from redis (None for any key which is not cached or could not be retrieved)."""
         try:
             prefixed_keys = [config.REDIS_KEY_PREFIX + key for key in keys]
-            values = await self.client.mget(prefixed_keys)
+            with timed("cache"):
+                values = await self.client.mget(prefixed_keys)
+            for key, value in zip(keys, values):
+                count_cache_lookup(key, value is not None)
             return values
         except Exception as e:
             print(f"failed to get cache! {e}")
-            return []
+            # Treat every key as a miss, so callers fall back to the source instead of silently dropping keys
+            return [None] * len(keys)
+
+    async def get_multiple_stale_from_cache(self, keys: list[str]) -> Any:
+        values = await self.get_multiple_from_cache(
+            [STALE_KEY_PREFIX + key for key in keys]
+        )
+        for key, value in zip(keys, values):
+            if value is not None:
+                mark_stale(key)
+        return values
 
     async def set_multiple_to_cache(
-        self, mapping: dict, ttl: int = config.CACHE_TTL_DEFAULT
+        self,
+        mapping: dict,
+        ttl: int = config.CACHE_TTL_DEFAULT,
+        keep_stale: bool = False,
     ) -> bool:
         try:
             states = []
             for key, value in mapping.items():
-                state = await self.set_to_cache(key, value, ttl)
+                state = await self.set_to_cache(key, value, ttl, keep_stale)
                 states.append(state)
 
             return all(states)
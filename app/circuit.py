@@ -0,0 +1,332 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+import pybfbc2stats
+
+from app import config
+from app.exceptions import CircuitOpenException, DeadlineExceededException
+from app.metrics import (
+    CIRCUIT_STATE,
+    CIRCUIT_REJECTED,
+    UPSTREAM_TIMEOUT,
+    UPSTREAM_HEDGES,
+    observe_upstream,
+)
+from app.singleton import Singleton
+from app.timing import get_remaining_time
+
+CIRCUIT_CLOSED = 0
+CIRCUIT_HALF_OPEN = 1
+CIRCUIT_OPEN = 2
+CIRCUIT_STATE_NAMES = {
+    CIRCUIT_CLOSED: "closed",
+    CIRCUIT_HALF_OPEN: "half-open",
+    CIRCUIT_OPEN: "open",
+}
+# Maximum number of hedges which can be sent in a row
+HEDGE_BURST = 5.0
+
+T = TypeVar("T")
+
+
+class LatencyWindow:
+    """Round trip times of the most recent successful upstream requests"""
+
+    samples: Deque[float]
+
+    def __init__(self, size: int = config.UPSTREAM_LATENCY_WINDOW):
+        self.samples = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, percentile: float) -> float:
+        ordered = sorted(self.samples)
+        position = math.ceil(len(ordered) * percentile / 100) - 1
+        return ordered[min(max(position, 0), len(ordered) - 1)]
+
+
+class CircuitBreaker:
+    """
+    Tracks health of a single upstream operation (e.g. FESL stats on pc). The circuit opens after a number of
+    consecutive failures, rejecting requests until a single trial request is let through after a cooldown.
+    """
+
+    labels: Tuple[str, str, str]
+    state: int
+    failures: int
+    opened_at: float
+    trial_in_flight: bool
+    latencies: LatencyWindow
+    logger: logging.Logger
+
+    def __init__(self, client: str, platform: str, operation: str):
+        self.labels = (client, platform, operation)
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.latencies = LatencyWindow()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def get_retry_after(self) -> float:
+        return max(self.opened_at + config.CIRCUIT_OPEN_DURATION - time.monotonic(), 0)
+
+    def get_timeout(self) -> Optional[float]:
+        """Get timeout for an entire operation based on recent round trip times (None = no timeout)"""
+        if (
+            config.UPSTREAM_TIMEOUT_MULTIPLIER <= 0
+            or len(self.latencies) < config.UPSTREAM_LATENCY_MIN_SAMPLES
+        ):
+            # Not enough data, rely on the client's read timeout
+            return None
+        return max(
+            self.latencies.percentile(config.UPSTREAM_TIMEOUT_PERCENTILE)
+            * config.UPSTREAM_TIMEOUT_MULTIPLIER,
+            config.UPSTREAM_TIMEOUT_MIN,
+        )
+
+    def get_hedge_delay(self) -> Optional[float]:
+        """Get time after which a duplicate request should be sent (None = do not hedge)"""
+        if (
+            config.UPSTREAM_HEDGE_PERCENTILE <= 0
+            or len(self.latencies) < config.UPSTREAM_LATENCY_MIN_SAMPLES
+        ):
+            return None
+        return max(
+            self.latencies.percentile(config.UPSTREAM_HEDGE_PERCENTILE),
+            config.UPSTREAM_HEDGE_MIN_DELAY,
+        )
+
+    def acquire(self) -> None:
+        if config.CIRCUIT_FAILURE_THRESHOLD <= 0 or self.state == CIRCUIT_CLOSED:
+            return
+
+        if self.state == CIRCUIT_OPEN and self.get_retry_after() <= 0:
+            self.set_state(CIRCUIT_HALF_OPEN)
+
+        # Only let a single trial request through while half-open
+        if self.state == CIRCUIT_HALF_OPEN and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return
+
+        raise self.reject()
+
+    def check(self) -> None:
+        """Raise CircuitOpenException if a request would be rejected right now (without taking the trial slot)"""
+        if config.CIRCUIT_FAILURE_THRESHOLD <= 0 or self.state == CIRCUIT_CLOSED:
+            return
+        if self.state == CIRCUIT_OPEN and self.get_retry_after() > 0:
+            raise self.reject()
+        if self.state == CIRCUIT_HALF_OPEN and self.trial_in_flight:
+            raise self.reject()
+
+    def reject(self) -> CircuitOpenException:
+        CIRCUIT_REJECTED.labels(*self.labels).inc()
+        return CircuitOpenException(
+            f"Source is unavailable ({' '.join(self.labels)})",
+            self.get_retry_after(),
+        )
+
+    def release(self) -> None:
+        """Release trial slot without a verdict on upstream health (e.g. request was cancelled)"""
+        self.trial_in_flight = False
+
+    def record_success(self, seconds: float) -> None:
+        self.latencies.add(seconds)
+        self.failures = 0
+        self.trial_in_flight = False
+        if self.state != CIRCUIT_CLOSED:
+            self.set_state(CIRCUIT_CLOSED)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.trial_in_flight = False
+        if config.CIRCUIT_FAILURE_THRESHOLD <= 0:
+            return
+        # A failed trial re-opens the circuit, restarting the cooldown
+        if self.state == CIRCUIT_HALF_OPEN or (
+            self.state == CIRCUIT_CLOSED
+            and self.failures >= config.CIRCUIT_FAILURE_THRESHOLD
+        ):
+            self.opened_at = time.monotonic()
+            self.set_state(CIRCUIT_OPEN)
+
+    def set_state(self, state: int) -> None:
+        self.logger.info(
+            f"Circuit for {' '.join(self.labels)} changed from "
+            f"{CIRCUIT_STATE_NAMES[self.state]} to {CIRCUIT_STATE_NAMES[state]}"
+        )
+        self.state = state
+        CIRCUIT_STATE.labels(*self.labels).set(state)
+
+
+class RequestBudget:
+    """
+    Limits additional requests (e.g. retries) to a share of requests per key, every request adds a fraction of a token
+    and every additional request costs one
+    """
+
+    ratio: float
+    burst: float
+    tokens: Dict[Tuple[str, str, str], float]
+
+    def __init__(self, ratio: float, burst: float):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = {}
+
+    def add_request(self, key: Tuple[str, str, str]) -> None:
+        # Start out with a full bucket
+        self.tokens[key] = min(
+            self.tokens.get(key, self.burst) + self.ratio, self.burst
+        )
+
+    def acquire(self, key: Tuple[str, str, str]) -> bool:
+        if self.tokens.get(key, self.burst) < 1:
+            return False
+        self.tokens[key] -= 1
+        return True
+
+
+class HedgeBudget(RequestBudget, metaclass=Singleton):
+    def __init__(self):
+        super().__init__(config.UPSTREAM_HEDGE_MAX_RATE, HEDGE_BURST)
+
+
+class CircuitBreakerRegistry(metaclass=Singleton):
+    breakers: Dict[Tuple[str, str, str], CircuitBreaker]
+
+    def __init__(self):
+        self.breakers = {}
+
+    def get(self, client: str, platform: str, operation: str) -> CircuitBreaker:
+        key = (client, platform, operation)
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = self.breakers[key] = CircuitBreaker(*key)
+        return breaker
+
+
+def check_upstream(client: str, platform: str, operation: str) -> None:
+    """
+    Fail fast (raising CircuitOpenException) if the operation's circuit is open, before taking up a client instance
+    (or opening a new connection) for a request which guard_upstream would reject anyway
+    """
+    CircuitBreakerRegistry().get(client, platform, operation).check()
+
+
+@asynccontextmanager
+async def guard_upstream(
+    client: str, platform: str, operation: str
+) -> AsyncIterator[None]:
+    """
+    Run an upstream request through the operation's circuit breaker (raising CircuitOpenException if the circuit
+    is open) and adaptive timeout (raising pybfbc2stats.TimeoutError if exceeded), observing it in metrics.
+    The operation is also cut short if it would run past the request's deadline (raising DeadlineExceededException).
+    """
+    breaker = CircuitBreakerRegistry().get(client, platform, operation)
+    breaker.acquire()
+
+    timeout = breaker.get_timeout()
+    UPSTREAM_TIMEOUT.labels(client, platform, operation).set(
+        timeout if timeout is not None else 0
+    )
+    # Don't let the operation run past the current request's deadline
+    remaining = get_remaining_time()
+    limited_by_deadline = remaining is not None and (
+        timeout is None or remaining < timeout
+    )
+    if limited_by_deadline:
+        timeout = max(remaining, 0)
+
+    start = time.perf_counter()
+    try:
+        with observe_upstream(client, platform, operation):
+            try:
+                async with asyncio.timeout(timeout):
+                    yield
+            except TimeoutError:
+                if limited_by_deadline:
+                    # Not the source's fault, so no verdict on its health
+                    raise DeadlineExceededException(
+                        "Request deadline exceeded"
+                    ) from None
+                # Count operations cut short as taking the full timeout, allowing the timeout to grow again
+                # if upstream latency increases for good
+                breaker.latencies.add(timeout)
+                raise pybfbc2stats.TimeoutError(
+                    f"Operation did not complete within {timeout:.2f} seconds"
+                ) from None
+    except (pybfbc2stats.ConnectionError, pybfbc2stats.TimeoutError):
+        breaker.record_failure()
+        raise
+    except pybfbc2stats.Error:
+        # Upstream responded (e.g. with player not found), so it is healthy
+        breaker.record_success(time.perf_counter() - start)
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+    else:
+        breaker.record_success(time.perf_counter() - start)
+
+
+async def hedge_upstream(
+    client: str, platform: str, operation: str, attempt: Callable[[], Awaitable[T]]
+) -> T:
+    """
+    Run an upstream request attempt, running a second one concurrently if the first is slow to complete (compared to
+    recent round trip times) and returning the result of whichever succeeds first. Attempts need to use their own
+    client instance and replace it if cancelled.
+    """
+    key = (client, platform, operation)
+    delay = CircuitBreakerRegistry().get(*key).get_hedge_delay()
+    if delay is None:
+        return await attempt()
+
+    budget = HedgeBudget()
+    budget.add_request(key)
+    original = asyncio.ensure_future(attempt())
+    pending = {original}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if len(done) > 0 or not budget.acquire(key):
+            return await original
+
+        hedge = asyncio.ensure_future(attempt())
+        pending.add(hedge)
+        while len(pending) > 0:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    winner = "original" if task is original else "hedge"
+                    UPSTREAM_HEDGES.labels(*key, winner).inc()
+                    return task.result()
+
+        # Neither attempt succeeded, report the original error
+        UPSTREAM_HEDGES.labels(*key, "none").inc()
+        hedge.exception()
+        return original.result()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -7,19 +7,128 @@ REDIS_PASS = os.getenv('REDIS_PASS', '')
 REDIS_KEY_PREFIX = os.getenv('REDIS_KEY_PREFIX', '')
 
 MULTI_LOOKUP_MAX_PERSONAS = os.getenv('MULTI_LOOKUP_MAX_PERSONAS', 30)
+MULTI_LOOKUP_MAX_SERVERS = int(os.getenv('MULTI_LOOKUP_MAX_SERVERS', 30))
 
 CLIENT_USERNAME = os.getenv('CLIENT_USERNAME')
 CLIENT_PASSWORD = os.getenv('CLIENT_PASSWORD')
+# additional accounts as comma-separated username:password pairs, sessions are spread across all accounts
+# (at most the given number of concurrent sessions per account, 0 = unlimited)
+CLIENT_ACCOUNTS = os.getenv('CLIENT_ACCOUNTS')
+CLIENT_ACCOUNT_MAX_SESSIONS = int(os.getenv('CLIENT_ACCOUNT_MAX_SESSIONS', 0))
+# take accounts out of rotation for the given number of seconds if their credentials are rejected
+# or their health score (see CLIENT_MIN_HEALTH) drops below minimum
+CLIENT_ACCOUNT_COOLDOWN = float(os.getenv('CLIENT_ACCOUNT_COOLDOWN', 300.0))
 CLIENT_TIMEOUT = float(os.getenv('CLIENT_TIMEOUT', 3.0))
 CLIENT_MAX_RETRIES = int(os.getenv('CLIENT_MAX_RETRIES', 2))
 CLIENT_PING_INTERVAL = float(os.getenv('CLIENT_PING_INTERVAL', 150.0))
+# replace permanent client instances (once idle) when their session reaches the given age in seconds (0 = never)
+# or their health score (weighted share of recent requests which succeeded within CLIENT_TIMEOUT) drops below minimum
+CLIENT_SESSION_MAX_AGE = float(os.getenv('CLIENT_SESSION_MAX_AGE', 3600.0))
+CLIENT_MIN_HEALTH = float(os.getenv('CLIENT_MIN_HEALTH', 0.5))
+# number of connected and authenticated theater sessions to keep ready per platform (replaced every CLIENT_PING_INTERVAL)
+THEATER_STANDBY_INSTANCES = int(os.getenv('THEATER_STANDBY_INSTANCES', 1))
+# wait a random time of up to base * 2^(retry - 1) seconds (but no more than max) before retrying a failed request,
+# retries are limited to the given share of requests (per platform and operation)
+CLIENT_RETRY_BACKOFF_BASE = float(os.getenv('CLIENT_RETRY_BACKOFF_BASE', 0.1))
+CLIENT_RETRY_BACKOFF_MAX = float(os.getenv('CLIENT_RETRY_BACKOFF_MAX', 2.0))
+CLIENT_RETRY_BUDGET_RATIO = float(os.getenv('CLIENT_RETRY_BUDGET_RATIO', 0.2))
+# time requests have to fetch data from the source, including persona resolution and retries (0 = unlimited)
+REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE', 10.0))
 
-CACHE_TTL_DEFAULT = os.getenv('CACHE_TTL_DEFAULT', 600)
-CACHE_TTL_PERSONA_SEARCH = os.getenv('CACHE_TTL_PERSONA_SEARCH', 1800)
-CACHE_TTL_PERSONAS_BY_NAME = os.getenv('CACHE_TTL_PERSONAS_BY_NAME', 28800)
-CACHE_TTL_PERSONAS_BY_ID = os.getenv('CACHE_TTL_PERSONAS_BY_ID', 14400)
-CACHE_TTL_SERVERS = os.getenv('CACHE_TTL_SERVERS', 60)
-CACHE_MAX_AGE_DEFAULT = os.getenv('CACHE_MAX_AGE_DEFAULT', 600)
-CACHE_MAX_AGE_PERSONA_SEARCH = os.getenv('CACHE_MAX_AGE_PERSONA_SEARCH', 1800)
-CACHE_MAX_AGE_PERSONAS = os.getenv('CACHE_MAX_AGE_PERSONAS', 28800)
-CACHE_MAX_AGE_SERVERS = os.getenv('CACHE_MAX_AGE_SERVERS', 60)
+# open circuit of an upstream operation (per platform) after given number of consecutive failures (0 = never),
+# rejecting requests until a trial request succeeds (the first trial is let through after the open duration)
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))
+CIRCUIT_OPEN_DURATION = float(os.getenv('CIRCUIT_OPEN_DURATION', 30.0))
+# time out upstream operations after a multiple of the given percentile of recent round trip times
+# (0 = only use CLIENT_TIMEOUT), the multiplier is applied once at least the minimum number of samples are available
+UPSTREAM_LATENCY_WINDOW = int(os.getenv('UPSTREAM_LATENCY_WINDOW', 200))
+UPSTREAM_LATENCY_MIN_SAMPLES = int(os.getenv('UPSTREAM_LATENCY_MIN_SAMPLES', 20))
+UPSTREAM_TIMEOUT_PERCENTILE = float(os.getenv('UPSTREAM_TIMEOUT_PERCENTILE', 99.0))
+UPSTREAM_TIMEOUT_MULTIPLIER = float(os.getenv('UPSTREAM_TIMEOUT_MULTIPLIER', 3.0))
+UPSTREAM_TIMEOUT_MIN = float(os.getenv('UPSTREAM_TIMEOUT_MIN', 1.0))
+# send a duplicate of FESL queries/stats and Theater gdat requests via another connection if the original did not
+# complete within the given percentile of recent round trip times (0 = never), using whichever response arrives first;
+# hedges are limited to the given share of requests
+UPSTREAM_HEDGE_PERCENTILE = float(os.getenv('UPSTREAM_HEDGE_PERCENTILE', 0.0))
+UPSTREAM_HEDGE_MIN_DELAY = float(os.getenv('UPSTREAM_HEDGE_MIN_DELAY', 0.05))
+UPSTREAM_HEDGE_MAX_RATE = float(os.getenv('UPSTREAM_HEDGE_MAX_RATE', 0.05))
+# run at most the given number of upstream operations (per client and platform) at a time (0 = unlimited), queueing
+# others by priority: batch work (crawls) and background work (keepalives, refreshes, standby sessions) is limited to
+# its own number of concurrent operations and only uses capacity beyond the share reserved for interactive requests
+UPSTREAM_CONCURRENCY = int(os.getenv('UPSTREAM_CONCURRENCY', 16))
+UPSTREAM_CONCURRENCY_RESERVED = int(os.getenv('UPSTREAM_CONCURRENCY_RESERVED', 4))
+UPSTREAM_CONCURRENCY_BATCH = int(os.getenv('UPSTREAM_CONCURRENCY_BATCH', 8))
+UPSTREAM_CONCURRENCY_BACKGROUND = int(os.getenv('UPSTREAM_CONCURRENCY_BACKGROUND', 2))
+# reject interactive upstream operations (503) instead of queueing them once the given number of them are waiting
+# (0 = unlimited) or once they waited for the given number of seconds (0 = until the request deadline)
+UPSTREAM_QUEUE_SIZE = int(os.getenv('UPSTREAM_QUEUE_SIZE', 32))
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv('UPSTREAM_QUEUE_TIMEOUT', 2.0))
+# limit upstream operations on behalf of a single client ip to the given rate per second and burst (0 = unlimited),
+# rejecting others (429) while cache hits are still served; tracked in redis, so limits apply across all workers
+# (run uvicorn with --proxy-headers and --forwarded-allow-ips when behind a proxy/CDN)
+CLIENT_RATE_LIMIT = float(os.getenv('CLIENT_RATE_LIMIT', 0.0))
+CLIENT_RATE_LIMIT_BURST = float(os.getenv('CLIENT_RATE_LIMIT_BURST', 20.0))
+
+# have a separate process (started via `python -m app.broker`) own all upstream sessions, with workers sending
+# requests to it via the given unix socket (unset = every process uses its own sessions)
+SESSION_BROKER_SOCKET = os.getenv('SESSION_BROKER_SOCKET')
+# expose the broker's (upstream/pool) metrics on the given port (0 = disabled)
+SESSION_BROKER_METRICS_PORT = int(os.getenv('SESSION_BROKER_METRICS_PORT', 0))
+
+# override FESL backend address (e.g. to run against tests/fake_backend.py), Theater details are provided by FESL
+FESL_HOST = os.getenv('FESL_HOST')
+FESL_PORT = int(os.getenv('FESL_PORT', 18321))
+
+# record upstream traffic to/replay upstream traffic from capture file ('record' or 'replay')
+UPSTREAM_CAPTURE_MODE = os.getenv('UPSTREAM_CAPTURE_MODE')
+UPSTREAM_CAPTURE_FILE = os.getenv('UPSTREAM_CAPTURE_FILE', 'upstream-capture.bin.gz')
+# replay responses at given multiple of recorded speed (0 = without any delay)
+UPSTREAM_REPLAY_SPEED = float(os.getenv('UPSTREAM_REPLAY_SPEED', 0.0))
+
+# publish server list snapshots to the given directory (ideally on a tmpfs, e.g. /dev/shm/bfbc2-stats-api), letting
+# all worker processes on a host serve full server lists straight from memory-mapped files (unset = disabled)
+SERVER_SNAPSHOT_DIR = os.getenv('SERVER_SNAPSHOT_DIR')
+SERVER_CRAWL_INTERVAL = int(os.getenv('SERVER_CRAWL_INTERVAL', 60))
+SERVER_CRAWL_JITTER = float(os.getenv('SERVER_CRAWL_JITTER', 0.25))
+SERVER_DETAILS_CONCURRENCY = int(os.getenv('SERVER_DETAILS_CONCURRENCY', 4))
+# only report ready (see /ready) once the initial server details crawl has warmed the server caches
+STARTUP_WARM_CACHES = os.getenv('STARTUP_WARM_CACHES', '').lower() == 'true'
+
+SUBSCRIPTION_BUFFER_SIZE = int(os.getenv('SUBSCRIPTION_BUFFER_SIZE', 16))
+SUBSCRIPTION_KEEPALIVE_INTERVAL = float(os.getenv('SUBSCRIPTION_KEEPALIVE_INTERVAL', 15.0))
+
+SLOW_REQUEST_THRESHOLD = float(os.getenv('SLOW_REQUEST_THRESHOLD', 0.0))
+
+CACHE_TTL_DEFAULT = int(os.getenv('CACHE_TTL_DEFAULT', 600))
+CACHE_TTL_PERSONA_SEARCH = int(os.getenv('CACHE_TTL_PERSONA_SEARCH', 1800))
+CACHE_TTL_PERSONAS_BY_NAME = int(os.getenv('CACHE_TTL_PERSONAS_BY_NAME', 28800))
+CACHE_TTL_PERSONAS_BY_ID = int(os.getenv('CACHE_TTL_PERSONAS_BY_ID', 14400))
+CACHE_TTL_SERVERS = int(os.getenv('CACHE_TTL_SERVERS', 60))
+CACHE_TTL_SERVER_DETAILS = int(os.getenv('CACHE_TTL_SERVER_DETAILS', 180))
+CACHE_TTL_SERVER_HISTORY = int(os.getenv('CACHE_TTL_SERVER_HISTORY', 900))
+# adapt the ttl of cached stats to how often they change: whenever refetched stats show no new games/time played,
+# extend the ttl by the given factor (up to the max), use the online ttl for players seen on a server in the current
+# server details snapshot (max = CACHE_TTL_DEFAULT disables extending ttls)
+CACHE_TTL_STATS_MAX = int(os.getenv('CACHE_TTL_STATS_MAX', 86400))
+CACHE_TTL_STATS_GROWTH = float(os.getenv('CACHE_TTL_STATS_GROWTH', 2.0))
+CACHE_TTL_STATS_ONLINE = int(os.getenv('CACHE_TTL_STATS_ONLINE', 120))
+CACHE_MAX_AGE_DEFAULT = int(os.getenv('CACHE_MAX_AGE_DEFAULT', 600))
+CACHE_MAX_AGE_PERSONA_SEARCH = int(os.getenv('CACHE_MAX_AGE_PERSONA_SEARCH', 1800))
+CACHE_MAX_AGE_PERSONAS = int(os.getenv('CACHE_MAX_AGE_PERSONAS', 28800))
+CACHE_MAX_AGE_SERVERS = int(os.getenv('CACHE_MAX_AGE_SERVERS', 60))
+# retain copies of upstream data for given number of seconds beyond their ttl, serving them (with a warning)
+# if fetching the data from the source fails (0 = disabled)
+CACHE_STALE_TTL = int(os.getenv('CACHE_STALE_TTL', 86400))
+CACHE_MAX_AGE_STALE = int(os.getenv('CACHE_MAX_AGE_STALE', 30))
+# refresh cached stats, leaderboards and server lists in the background before they expire (at most the given number
+# of refreshes at a time and the given share of cache hits, 0 = disabled); keys with at least the given number of
+# (sampled) accesses per activity window are refreshed once in the last share of their ttl, others are refreshed
+# early with a probability that rises towards expiry (higher beta = earlier)
+REFRESH_AHEAD_CONCURRENCY = int(os.getenv('REFRESH_AHEAD_CONCURRENCY', 2))
+REFRESH_AHEAD_BUDGET_RATIO = float(os.getenv('REFRESH_AHEAD_BUDGET_RATIO', 0.1))
+REFRESH_AHEAD_SAMPLE_RATE = float(os.getenv('REFRESH_AHEAD_SAMPLE_RATE', 0.1))
+REFRESH_AHEAD_ACTIVITY_WINDOW = float(os.getenv('REFRESH_AHEAD_ACTIVITY_WINDOW', 60.0))
+REFRESH_AHEAD_HOT_ACCESSES = float(os.getenv('REFRESH_AHEAD_HOT_ACCESSES', 10.0))
+REFRESH_AHEAD_WINDOW = float(os.getenv('REFRESH_AHEAD_WINDOW', 0.1))
+REFRESH_AHEAD_BETA = float(os.getenv('REFRESH_AHEAD_BETA', 1.0))
+REFRESH_AHEAD_MAX_KEYS = int(os.getenv('REFRESH_AHEAD_MAX_KEYS', 10000))
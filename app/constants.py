@@ -72,6 +72,18 @@ class LeaderboardSortKey(StringEnum):
     deaths = 'deaths'
 
 
+class ServerSortKey(StringEnum):
+    name = 'name'
+    map = 'map'
+    mode = 'mode'
+    players = 'players'
+
+
+class SortOrder(StringEnum):
+    asc = 'asc'
+    desc = 'desc'
+
+
 DUMMY_TID = 0
 LEADERBOARD_PAGE_SIZE = 50
 STATS_KEY_SETS = {
@@ -275,4 +287,8 @@ MAINTAIN_PLAYER_IDS = {
     FeslPlatform.ps3: 273735378,
     FeslPlatform.xbox360: 201504424
 }
+THEATER_NAME_KEY = 'N'
+THEATER_MAP_KEY = 'B-U-level'
+THEATER_GAME_MODE_KEY = 'B-U-gamemode'
+THEATER_ACTIVE_PLAYERS_KEY = 'AP'
 THEATER_DIRTY_STR_KEYS = ['N', 'B-U-Time', 'B-U-PunkBusterVersion', 'D-BannerUrl', 'D-ServerDescription']
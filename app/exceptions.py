@@ -16,3 +16,39 @@ class NoPersonasException(ApiError):
 
 class TooManyPersonasException(ApiError):
     pass
+
+
+class NoServersException(ApiError):
+    pass
+
+
+class TooManyServersException(ApiError):
+    pass
+
+
+class CircuitOpenException(DataSourceException):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    def __reduce__(self):
+        # Allow exception to be pickled (e.g. to be sent by the session broker)
+        return self.__class__, (str(self), self.retry_after)
+
+
+class DeadlineExceededException(DataSourceException):
+    pass
+
+
+class OverloadedException(DataSourceException):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    def __reduce__(self):
+        # Allow exception to be pickled (e.g. to be sent by the session broker)
+        return self.__class__, (str(self), self.retry_after)
+
+
+class RateLimitedException(OverloadedException):
+    pass
@@ -2,9 +2,13 @@ import asyncio
 import hashlib
 import json
 import logging
-from dataclasses import dataclass
+import math
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import Awaitable, Callable, Deque, List, Dict, Optional, Set, Tuple, Union
 from urllib.parse import quote
 
 import pybfbc2stats
@@ -13,12 +17,12 @@ from pybfbc2stats.constants import LookupType
 from pybfbc2stats.packet import Packet
 
 from app import config
+from app.accounts import Account, AccountPool
 from app.cache import RedisClient
+from app.broker import brokered
+from app.circuit import check_upstream, guard_upstream
 from app.config import (
-    CLIENT_USERNAME,
-    CLIENT_PASSWORD,
     CACHE_TTL_PERSONAS_BY_NAME,
-    CLIENT_MAX_RETRIES,
     CACHE_TTL_PERSONAS_BY_ID,
 )
 from app.constants import (
@@ -40,16 +44,79 @@ from app.exceptions import (
     DataSourceException,
     NoPersonasException,
     TooManyPersonasException,
+    NoServersException,
+    TooManyServersException,
+    CircuitOpenException,
+    DeadlineExceededException,
 )
-from app.utility import clean_string_value, clean_server_details
+from app.metrics import (
+    POOL_BUSY_INSTANCES,
+    POOL_DEDICATED_INSTANCES,
+    POOL_INSTANCE_HEALTH,
+    POOL_INSTANCES_REPLACED,
+    POOL_STANDBY_INSTANCES,
+    POOL_WAITING,
+    POOL_TEMPORARY_INSTANCES,
+    POOL_TEMPORARY_INSTANCES_CREATED,
+)
+from app.servers import ServerListIndex, diff_server_lists
+from app.utility import (
+    clean_string_value,
+    clean_server_details,
+    format_leaderboard,
+    get_identifiers_to_lookup,
+    get_persona_cache_mappings,
+)
+from app.refresh import RefreshAhead
+from app.retry import call_upstream
+from app.scheduler import Priority, UpstreamScheduler, upstream_priority
 from app.singleton import Singleton
+from app.snapshots import ServerSnapshot, ServerSnapshotStore, publish_server_snapshot
+from app.stats_ttl import StatsTtl, get_activity, get_next_stats_ttl, get_stats_ttl_key
+from app.timing import timed, get_remaining_time, create_background_task
+from app.transport import setup_transport
 
 
-@dataclass
+# Errors indicating the source is (currently) unavailable, as opposed to errors such as a player not being found
+UPSTREAM_FAILURES = (
+    pybfbc2stats.ConnectionError,
+    pybfbc2stats.TimeoutError,
+    DataSourceException,
+)
+# Errors after which a client instance's connection cannot be used any further
+CONNECTION_BREAKING_ERRORS = (
+    pybfbc2stats.ConnectionError,
+    pybfbc2stats.TimeoutError,
+    DeadlineExceededException,
+    asyncio.CancelledError,
+)
+# Weight of the most recent outcome in a client instance's health score
+HEALTH_SCORE_WEIGHT = 0.2
+# Seconds for which players found on a server (or not) are considered online (or not) before looking again
+ONLINE_PLAYERS_LOOKUP_INTERVAL = 10.0
+
+
+@dataclass(eq=False)
 class ClientInstance:
     client: AsyncClient
+    platform: ApiPlatform
+    permanent: bool = False
     busy: bool = False
+    # Set once the connection must no longer be handed out (e.g. after an error), maintenance will replace it
+    retired: bool = False
+    # Weighted share of recent requests which succeeded within the client timeout (1.0 = all of them)
+    health: float = 1.0
+    created: datetime = field(default_factory=datetime.now)
     last_used: datetime = datetime.min
+    acquired: float = 0.0
+    # Account the session was opened with
+    account: Optional[Account] = None
+    # Priority of the scheduler slot held while the instance is in use
+    priority: Optional[Priority] = None
+
+    @property
+    def available(self) -> bool:
+        return not self.busy and not self.retired
 
 
 class FeslClientInstance(ClientInstance):
@@ -61,25 +128,63 @@ class TheaterClientInstance(ClientInstance):
 
 
 class EaApiClient(metaclass=Singleton):
+    name: str
     timeout: float
     platforms: List[ApiPlatform]
     instances: Dict[ApiPlatform, ClientInstance]
+    standby_size: int
+    standby: Dict[ApiPlatform, Deque[ClientInstance]]
+    schedulers: Dict[ApiPlatform, UpstreamScheduler]
+    instances_changed: asyncio.Condition
+    initialization: asyncio.Lock
+    maintenance: Dict[Tuple[ApiPlatform, str], asyncio.Task]
+    shutdowns: Set[asyncio.Task]
     logger: logging.Logger
 
     initialized: bool = False
 
-    def __init__(self, platforms: List[ApiPlatform], timeout: float = 3.0):
+    def __init__(
+        self, platforms: List[ApiPlatform], timeout: float = 3.0, standby_size: int = 0
+    ):
         self.platforms = platforms
         self.timeout = timeout
-        self.logger = logging.getLogger(self.__class__.__name__)
+        self.standby_size = standby_size
+        self.instances = {}
+        self.standby = {platform: deque() for platform in platforms}
+        self.instances_changed = asyncio.Condition()
+        self.initialization = asyncio.Lock()
+        self.maintenance = {}
+        self.shutdowns = set()
+        self.name = self.__class__.__name__
+        self.schedulers = {
+            platform: UpstreamScheduler(self.name, platform) for platform in platforms
+        }
+        self.logger = logging.getLogger(self.name)
 
     async def initialize(
         self,
     ) -> None:
-        self.instances = {}
-        for platform in self.platforms:
-            self.instances[platform] = await self.create_instance(platform)
-        self.initialized = True
+        # Requests and maintenance tasks may all try to initialize the client at the same time
+        async with self.initialization:
+            if self.initialized:
+                return
+            # Log in/connect on all platforms at once, so the first requests do not have to
+            results = await asyncio.gather(
+                *[self.create_warm_instance(platform) for platform in self.platforms],
+                return_exceptions=True,
+            )
+            errors = [r for r in results if isinstance(r, BaseException)]
+            if len(errors) > 0:
+                for result in results:
+                    if isinstance(result, ClientInstance):
+                        self.shutdown_instance_in_background(result)
+                raise errors[0]
+
+            self.instances = {}
+            for platform, instance in zip(self.platforms, results):
+                instance.permanent = True
+                self.instances[platform] = instance
+            self.initialized = True
 
     async def create_instance(self, platform: ApiPlatform) -> ClientInstance:
         pass
@@ -88,105 +193,351 @@ class EaApiClient(metaclass=Singleton):
         pass
 
     async def get_instance(
-        self, platform: ApiPlatform, replace_permanent: bool = False
+        self, platform: ApiPlatform, dedicated: bool = False
     ) -> ClientInstance:
+        """
+        Get client instance to send requests with, either the permanent one or a standby/temporary one if the permanent
+        one is busy (or a dedicated instance is requested, e.g. for work that would otherwise hold it for a long time)
+        """
         if not self.initialized:
             await self.initialize()
 
-        # Get default client or create temporary one
-        if replace_permanent:
-            self.logger.warning(
-                f"Creating new permanent {platform} client instance to replace existing one"
-            )
-            instance = await self.create_instance(platform)
-        elif self.instances[platform].busy:
-            self.logger.warning(
-                f"Clients exhausted, creating new (temporary) {platform} client instance"
-            )
-            instance = await self.create_instance(platform)
+        # Wait for the operation's turn, the slot is held until the instance is returned
+        priority = upstream_priority.get()
+        await self.schedulers[platform].acquire(priority)
+        try:
+            instance = await self.checkout_instance(platform, dedicated)
+        except BaseException:
+            self.schedulers[platform].release(priority)
+            raise
+        instance.priority = priority
+        return instance
+
+    async def checkout_instance(
+        self, platform: ApiPlatform, dedicated: bool = False
+    ) -> ClientInstance:
+        # Get default client or use a standby/create temporary one
+        instance = self.instances[platform]
+        if dedicated or not instance.available:
+            if dedicated:
+                POOL_DEDICATED_INSTANCES.labels(self.name, platform).inc()
+            else:
+                self.logger.warning(
+                    f"Clients exhausted, using new (temporary) {platform} client instance"
+                )
+            instance = await self.take_standby_instance(platform)
+            if instance is None:
+                with timed("pool"):
+                    instance = await self.create_instance(platform)
+                if not dedicated:
+                    POOL_TEMPORARY_INSTANCES_CREATED.labels(self.name, platform).inc()
+            POOL_TEMPORARY_INSTANCES.labels(self.name, platform).inc()
         else:
-            instance = self.instances[platform]
             # Mark client as busy
             instance.busy = True
+            POOL_BUSY_INSTANCES.labels(self.name, platform).inc()
 
+        instance.acquired = time.perf_counter()
         return instance
 
     async def return_instance(
         self, instance: ClientInstance, encountered_error: bool = False
     ) -> None:
-        shutdown_given_instance = False
-        if instance not in self.instances.values():
+        platform = instance.platform
+        if instance.priority is not None:
+            self.schedulers[platform].release(instance.priority)
+            instance.priority = None
+        self.record_outcome(instance, encountered_error)
+        if not instance.permanent:
             # Returned client instance is temporary, logoff and close connection (error flag safe to ignore)
-            shutdown_given_instance = True
-        else:
-            # Returned client instance is permanent, check renew on error
-            index = list(self.instances.values()).index(instance)
-            platform = list(self.instances.keys())[index]
-            if encountered_error:
-                # There was an error with the client instance => replace it
-                self.instances[platform] = await self.get_instance(platform, True)
-                shutdown_given_instance = True
-            # Mark permanent client as non-busy and update last used timestamp
-            instance.busy = False
-            instance.last_used = datetime.now()
-
-        if shutdown_given_instance:
-            # Attempt to shut down old client
-            try:
-                await self.shutdown_instance(instance)
-            except pybfbc2stats.Error:
-                pass
-
-    async def maintain_instances(self) -> None:
-        if not self.initialized:
-            await self.initialize()
-
-        self.logger.debug("Running client instance maintenance")
-        for platform, instance in self.instances.items():
-            if datetime.now() - instance.last_used < timedelta(
-                seconds=config.CLIENT_PING_INTERVAL
-            ):
-                self.logger.debug(
-                    f"Client instance for {platform} has been used recently, skipping maintenance"
-                )
-                continue
-
-            self.logger.debug(
-                f"Waiting for {platform} client instance to become available"
+            POOL_TEMPORARY_INSTANCES.labels(self.name, platform).dec()
+            self.shutdown_instance_in_background(instance)
+            return
+
+        # Mark permanent client as non-busy and update last used timestamp
+        instance.busy = False
+        POOL_BUSY_INSTANCES.labels(self.name, platform).dec()
+        instance.last_used = datetime.now()
+        if encountered_error:
+            # There was an error with the client instance => have it replaced by maintenance (instead of making the
+            # current request wait for it), requests will use temporary instances in the meantime
+            instance.retired = True
+
+        if self.instances[platform] is not instance:
+            # Client instance was replaced while in use
+            self.shutdown_instance_in_background(instance)
+
+        # Wake up maintenance, which may be waiting for the client instance to become available
+        async with self.instances_changed:
+            self.instances_changed.notify_all()
+
+    def record_outcome(self, instance: ClientInstance, encountered_error: bool) -> None:
+        succeeded = (
+            not encountered_error
+            and time.perf_counter() - instance.acquired <= self.timeout
+        )
+        instance.health += HEALTH_SCORE_WEIGHT * (float(succeeded) - instance.health)
+        if instance.account is not None:
+            # Requests via temporary instances count towards the account's health, too
+            AccountPool().record_outcome(instance.account, succeeded)
+        if self.instances[instance.platform] is instance:
+            POOL_INSTANCE_HEALTH.labels(self.name, instance.platform).set(
+                instance.health
             )
-            # Wait for client to become available
-            while instance.busy:
-                await asyncio.sleep(0.1)
 
-            # Mark client as busy
-            self.logger.debug(f"Marking {platform} client instance as busy")
-            instance.busy = True
+    @staticmethod
+    def record_auth_error(instance: ClientInstance) -> None:
+        if instance.account is not None:
+            AccountPool().record_auth_error(instance.account)
+
+    def shutdown_instance_in_background(self, instance: ClientInstance) -> None:
+        # Shut down client in the background, since logging off a broken connection only ends with a timeout
+        shutdown = create_background_task(self.attempt_shutdown_instance(instance))
+        self.shutdowns.add(shutdown)
+        shutdown.add_done_callback(self.shutdowns.discard)
+
+    async def attempt_shutdown_instance(self, instance: ClientInstance) -> None:
+        try:
+            await self.shutdown_instance(instance)
+        except pybfbc2stats.Error:
+            pass
+        finally:
+            if instance.account is not None:
+                AccountPool().release(instance.account)
+
+    def start_maintenance(self) -> None:
+        """
+        Start (or restart, if stopped) maintenance tasks for every platform's permanent client instance
+        and standby instances
+        """
+        for platform in self.platforms:
+            tasks = {"instances": self.maintain_instances}
+            if self.standby_size > 0:
+                tasks["standby"] = self.maintain_standby_instances
+            for kind, step in tasks.items():
+                task = self.maintenance.get((platform, kind))
+                if task is None or task.done():
+                    self.maintenance[(platform, kind)] = create_background_task(
+                        self.run_maintenance(platform, kind, step)
+                    )
 
-            # Run client's keepalive method
-            self.logger.debug(f"Running {platform} client instance's keepalive method")
-            encountered_error = False
+    async def run_maintenance(
+        self,
+        platform: ApiPlatform,
+        kind: str,
+        step: Callable[[ApiPlatform], Awaitable[None]],
+    ) -> None:
+        failures = 0
+        while True:
             try:
-                await self.instance_keepalive(instance, platform)
-            except pybfbc2stats.Error as e:
+                if not self.initialized:
+                    await self.initialize()
+                await step(platform)
+                failures = 0
+            except Exception as e:
+                failures += 1
+                delay = min(2**failures, config.CLIENT_PING_INTERVAL)
                 self.logger.warning(
-                    f"Encountered an error during {platform} client instance maintenance keepalive"
+                    f"Failed to maintain {platform} client {kind}, retrying in {delay} seconds"
                 )
                 self.logger.debug(e)
-                encountered_error = True
-            except Exception as e:
-                # Log to error since pybfbc2stats should handle all errors
-                self.logger.error(
-                    f"Encountered an error during {platform} client instance maintenance keepalive",
-                    e,
-                )
-                encountered_error = True
+                await asyncio.sleep(delay)
+
+    async def maintain_instances(self, platform: ApiPlatform) -> None:
+        instance = await self.wait_for_maintenance(platform)
+        await self.maintain_instance(platform, instance)
+
+    def get_maintenance_delay(self, instance: ClientInstance) -> float:
+        """Get number of seconds until the given client instance needs to be kept alive or replaced"""
+        if (
+            instance.retired
+            or instance.health < config.CLIENT_MIN_HEALTH
+            or self.is_account_out_of_rotation(instance)
+        ):
+            return 0.0
+        due = instance.last_used + timedelta(seconds=config.CLIENT_PING_INTERVAL)
+        if config.CLIENT_SESSION_MAX_AGE > 0:
+            due = min(
+                due,
+                instance.created + timedelta(seconds=config.CLIENT_SESSION_MAX_AGE),
+            )
+        return (due - datetime.now()).total_seconds()
 
-            # Use common method to return client (and replace it on error)
-            self.logger.debug(
-                f"Completed {platform} client instance maintenance "
-                f'{"with" if encountered_error else "without"} errors, returning client instance'
+    @staticmethod
+    def is_account_out_of_rotation(instance: ClientInstance) -> bool:
+        return instance.account is not None and AccountPool().should_move(
+            instance.account
+        )
+
+    async def wait_for_maintenance(self, platform: ApiPlatform) -> ClientInstance:
+        """Wait until the platform's client instance is due for maintenance and not in use"""
+        async with self.instances_changed:
+            with POOL_WAITING.labels(self.name, platform).track_inprogress():
+                while True:
+                    instance = self.instances[platform]
+                    delay = self.get_maintenance_delay(instance)
+                    if delay <= 0 and not instance.busy:
+                        return instance
+                    try:
+                        # Using the client instance (or replacing it) will change when it is due, so re-check once
+                        # it is returned (without a timeout if it is in use now)
+                        async with asyncio.timeout(delay if delay > 0 else None):
+                            await self.instances_changed.wait()
+                    except TimeoutError:
+                        pass
+
+    async def maintain_instance(
+        self, platform: ApiPlatform, instance: ClientInstance
+    ) -> None:
+        if instance.retired:
+            await self.replace_instance(platform, instance, "error")
+        elif instance.health < config.CLIENT_MIN_HEALTH:
+            await self.replace_instance(platform, instance, "health")
+        elif self.is_account_out_of_rotation(instance):
+            await self.replace_instance(platform, instance, "account")
+        elif (
+            config.CLIENT_SESSION_MAX_AGE > 0
+            and datetime.now() - instance.created
+            >= timedelta(seconds=config.CLIENT_SESSION_MAX_AGE)
+        ):
+            await self.replace_instance(platform, instance, "age")
+        else:
+            await self.keepalive_instance(platform, instance)
+
+    async def keepalive_instance(
+        self, platform: ApiPlatform, instance: ClientInstance
+    ) -> None:
+        # Only keep the instance alive once there is spare capacity
+        scheduler = self.schedulers[platform]
+        await scheduler.acquire(Priority.background)
+        if (
+            not instance.available
+            or self.instances[platform] is not instance
+            or self.get_maintenance_delay(instance) > 0
+        ):
+            # Instance was used (or replaced) in the meantime, maintenance will re-check it
+            scheduler.release(Priority.background)
+            return
+
+        # Mark client as busy (any request arriving in the meantime will use a temporary instance instead of waiting)
+        self.logger.debug(f"Marking {platform} client instance as busy")
+        instance.busy = True
+        POOL_BUSY_INSTANCES.labels(self.name, platform).inc()
+        instance.acquired = time.perf_counter()
+        instance.priority = Priority.background
+
+        # Run client's keepalive method
+        self.logger.debug(f"Running {platform} client instance's keepalive method")
+        encountered_error = False
+        try:
+            await self.instance_keepalive(instance, platform)
+        except pybfbc2stats.Error as e:
+            self.logger.warning(
+                f"Encountered an error during {platform} client instance maintenance keepalive"
             )
-            await self.return_instance(instance, encountered_error)
+            self.logger.debug(e)
+            encountered_error = True
+        except Exception as e:
+            # Log to error since pybfbc2stats should handle all errors
+            self.logger.error(
+                f"Encountered an error during {platform} client instance maintenance keepalive",
+                e,
+            )
+            encountered_error = True
+
+        # Use common method to return client (and have it replaced on error)
+        self.logger.debug(
+            f"Completed {platform} client instance maintenance "
+            f'{"with" if encountered_error else "without"} errors, returning client instance'
+        )
+        await self.return_instance(instance, encountered_error)
+
+    async def replace_instance(
+        self, platform: ApiPlatform, instance: ClientInstance, reason: str
+    ) -> None:
+        self.logger.warning(
+            f"Creating new permanent {platform} client instance to replace existing one ({reason})"
+        )
+        # Set up the new session completely before swapping it in, so requests never have to wait for a login
+        replacement = await self.take_standby_instance(platform)
+        if replacement is None:
+            async with self.schedulers[platform].slot(Priority.background):
+                replacement = await self.create_warm_instance(platform)
+
+        replacement.permanent = True
+        instance.retired = True
+        self.instances[platform] = replacement
+        POOL_INSTANCES_REPLACED.labels(self.name, platform, reason).inc()
+        POOL_INSTANCE_HEALTH.labels(self.name, platform).set(replacement.health)
+        if not instance.busy:
+            # Otherwise, the instance is shut down once returned
+            self.shutdown_instance_in_background(instance)
+
+    async def create_warm_instance(self, platform: ApiPlatform) -> ClientInstance:
+        instance = await self.create_instance(platform)
+        try:
+            await self.instance_warmup(instance)
+        except BaseException as e:
+            if isinstance(e, pybfbc2stats.AuthError):
+                self.record_auth_error(instance)
+            self.shutdown_instance_in_background(instance)
+            raise
+        return instance
+
+    def is_standby_fresh(self, instance: ClientInstance) -> bool:
+        # Standby instances are not kept alive, so they are only used as long as the connection would not be pinged
+        return datetime.now() - instance.created < timedelta(
+            seconds=config.CLIENT_PING_INTERVAL
+        )
+
+    async def take_standby_instance(
+        self, platform: ApiPlatform
+    ) -> Optional[ClientInstance]:
+        standby = self.standby[platform]
+        instance = None
+        while len(standby) > 0 and instance is None:
+            candidate = standby.popleft()
+            if self.is_standby_fresh(candidate):
+                instance = candidate
+            else:
+                self.shutdown_instance_in_background(candidate)
+        POOL_STANDBY_INSTANCES.labels(self.name, platform).set(len(standby))
+
+        if self.standby_size > 0:
+            # Have maintenance refill the standby instances
+            async with self.instances_changed:
+                self.instances_changed.notify_all()
+        return instance
+
+    async def maintain_standby_instances(self, platform: ApiPlatform) -> None:
+        standby = self.standby[platform]
+        async with self.instances_changed:
+            while True:
+                # Discard instances which are no longer fresh (oldest first)
+                while len(standby) > 0 and not self.is_standby_fresh(standby[0]):
+                    self.shutdown_instance_in_background(standby.popleft())
+                if len(standby) < self.standby_size:
+                    break
+                # Wait until the oldest instance needs to be replaced or an instance is taken
+                delay = (
+                    standby[0].created
+                    + timedelta(seconds=config.CLIENT_PING_INTERVAL)
+                    - datetime.now()
+                ).total_seconds()
+                try:
+                    async with asyncio.timeout(max(delay, 0)):
+                        await self.instances_changed.wait()
+                except TimeoutError:
+                    pass
+
+        self.logger.debug(f"Creating new standby {platform} client instance")
+        async with self.schedulers[platform].slot(Priority.background):
+            standby.append(await self.create_warm_instance(platform))
+        POOL_STANDBY_INSTANCES.labels(self.name, platform).set(len(standby))
+
+    @staticmethod
+    async def instance_warmup(instance: ClientInstance) -> None:
+        pass
 
     @staticmethod
     async def instance_keepalive(
@@ -204,23 +555,33 @@ class FeslApiClient(EaApiClient):
         )
 
     async def create_instance(self, platform: ApiPlatform) -> FeslClientInstance:
-        return FeslClientInstance(
-            pybfbc2stats.AsyncFeslClient(
-                CLIENT_USERNAME,
-                CLIENT_PASSWORD,
-                pybfbc2stats.Platform[platform],
-                timeout=self.timeout,
-            )
+        account = AccountPool().acquire()
+        client = pybfbc2stats.AsyncFeslClient(
+            account.username,
+            account.password,
+            pybfbc2stats.Platform[platform],
+            timeout=self.timeout,
         )
+        if config.FESL_HOST is not None:
+            # Connection is only opened on first use, so the address can still be changed
+            client.connection.host = config.FESL_HOST
+            client.connection.port = config.FESL_PORT
+        setup_transport(client, self.name, platform)
+
+        return FeslClientInstance(client, platform, account=account)
 
     async def shutdown_instance(self, instance: FeslClientInstance) -> None:
         await instance.client.logout()
         await instance.client.connection.close()
 
     async def get_instance(
-        self, platform: ApiPlatform, replace_permanent: bool = False
+        self, platform: ApiPlatform, dedicated: bool = False
     ) -> FeslClientInstance:
-        return await super().get_instance(platform, replace_permanent)
+        return await super().get_instance(platform, dedicated)
+
+    @staticmethod
+    async def instance_warmup(instance: FeslClientInstance) -> None:
+        await instance.client.login()
 
     @staticmethod
     async def instance_keepalive(
@@ -228,48 +589,75 @@ class FeslApiClient(EaApiClient):
     ) -> None:
         await instance.client.get_stats(MAINTAIN_PLAYER_IDS[platform], [b"kills"])
 
+    @brokered
     async def get_json(
-        self, platform: ApiPlatform, packet: Packet, list_entry_prefix: bytes
+        self,
+        platform: Optional[ApiPlatform],
+        packet: Packet,
+        list_entry_prefix: bytes,
+        operation: str = "query",
     ) -> List[dict]:
-        data = None
-        attempt = 0
-        while data is None and attempt < CLIENT_MAX_RETRIES:
-            instance = await self.get_instance(platform)
-            # Set correct transaction id on packet
-            tid = instance.client.get_transaction_id()
-            packet.set_tid(tid)
-            encountered_error = False
-            try:
+        if platform is None:
+            # Use whichever platform has a client instance available (defaulting to pc if all are busy)
+            platform = next(
+                (p for (p, instance) in self.instances.items() if instance.available),
+                FeslPlatform.pc,
+            )
+        return await call_upstream(
+            self.name,
+            platform,
+            operation,
+            lambda: self.query_json(platform, packet, list_entry_prefix, operation),
+        )
+
+    async def query_json(
+        self,
+        platform: ApiPlatform,
+        packet: Packet,
+        list_entry_prefix: bytes,
+        operation: str,
+    ) -> List[dict]:
+        # Don't take up (or create) a client instance for a request the circuit breaker would reject anyway
+        check_upstream(self.name, platform, operation)
+        instance = await self.get_instance(platform)
+        # Set correct transaction id on (a copy of the) packet, since hedged queries send it concurrently
+        tid = instance.client.get_transaction_id()
+        packet = packet.__class__(packet.header, packet.body)
+        packet.set_tid(tid)
+        encountered_error = False
+        try:
+            async with guard_upstream(self.name, platform, operation):
                 # Will either send login or do nothing if client instance is a permanent one
                 await instance.client.login()
                 await instance.client.connection.write(packet)
                 raw_response = await instance.client.get_complex_response(tid)
+            with timed("parse"):
                 data, *_ = instance.client.parse_list_response(
                     raw_response, list_entry_prefix
                 )
-            except pybfbc2stats.ConnectionError as e:
-                # Set error flag
-                encountered_error = True
-                # Increase attempt counter
-                attempt += 1
-            finally:
-                # Return client instance (and replace it on error)
-                await self.return_instance(instance, encountered_error)
-
-        if data is None:
-            raise DataSourceException(
-                "All attempts to retrieve data from source failed"
-            )
-
-        return data
+            return data
+        except pybfbc2stats.AuthError:
+            # Session could not log in, take its account out of rotation and have it replaced
+            self.record_auth_error(instance)
+            encountered_error = True
+            raise
+        except CONNECTION_BREAKING_ERRORS:
+            # Connection may be broken or left with a partial response, so do not hand it out again
+            encountered_error = True
+            raise
+        finally:
+            # Return client instance (and replace it on error)
+            await self.return_instance(instance, encountered_error)
 
     async def get_json_cached(
         self,
-        platform: ApiPlatform,
+        platform: Optional[ApiPlatform],
         packet: Packet,
         list_parse_prefix: bytes,
         ttl: int = config.CACHE_TTL_DEFAULT,
         additional_cache_key_elements: List[str] = None,
+        operation: str = "query",
+        serve_stale: bool = True,
     ) -> List[dict]:
         sha256_hash = hashlib.sha256()
         sha256_hash.update(bytes(packet))
@@ -279,14 +667,32 @@ class FeslApiClient(EaApiClient):
             cache_key += ":" + ":".join(additional_cache_key_elements)
 
         redis_client = RedisClient()
-        cached_data = await redis_client.get_from_cache(cache_key)
-        if cached_data is not None:
-            data = json.loads(cached_data)
+
+        async def fetch() -> List[dict]:
+            fetched = await self.get_json(
+                platform, packet, list_parse_prefix, operation
+            )
+            await redis_client.set_to_cache(
+                cache_key, json.dumps(fetched), ttl, keep_stale=serve_stale
+            )
+            return fetched
+
+        refresh_ahead = RefreshAhead()
+        cached_data, remaining = await redis_client.get_from_cache_with_ttl(cache_key)
+        if cached_data is None:
+            try:
+                return await refresh_ahead.fetch(cache_key, fetch)
+            except UPSTREAM_FAILURES:
+                if not serve_stale:
+                    raise
+                cached_data = await redis_client.get_stale_from_cache(cache_key)
+                if cached_data is None:
+                    raise
         else:
-            data = await self.get_json(platform, packet, list_parse_prefix)
+            refresh_ahead.observe(cache_key, ttl, remaining, fetch)
 
-            cacheable_data = json.dumps(data)
-            await redis_client.set_to_cache(cache_key, cacheable_data, ttl)
+        with timed("parse"):
+            data = json.loads(cached_data)
 
         return data
 
@@ -303,12 +709,11 @@ class FeslApiClient(EaApiClient):
         packet = pybfbc2stats.AsyncFeslClient.build_user_lookup_packet(
             DUMMY_TID, quoted, bytes(fesl_namespace), LookupType[identifier_type]
         )
-        # Use whichever platform has a client available (defaulting to pc if all are busy)
-        platform = next(
-            (key for (key, instance) in self.instances.items() if not instance.busy),
-            FeslPlatform.pc,
+        # Lookups can be sent via any platform (get_json will pick one with a client instance available),
+        # results are cached per persona by the caller, which also falls back to stale copies of those
+        results = await self.get_json_cached(
+            None, packet, b"userInfo.", operation="lookup", serve_stale=False
         )
-        results = await self.get_json_cached(platform, packet, b"userInfo.")
 
         relevant_results = [
             r
@@ -338,13 +743,13 @@ class FeslApiClient(EaApiClient):
         packet = pybfbc2stats.AsyncFeslClient.build_search_packet(
             DUMMY_TID, quote(name), bytes(fesl_namespace)
         )
-        # Use whichever platform has a client instance available (defaulting to pc if all are busy)
-        platform = next(
-            (key for (key, instance) in self.instances.items() if not instance.busy),
-            FeslPlatform.pc,
-        )
+        # Searches can be sent via any platform as well
         results = await self.get_json_cached(
-            platform, packet, b"users.", ttl=config.CACHE_TTL_PERSONA_SEARCH
+            None,
+            packet,
+            b"users.",
+            ttl=config.CACHE_TTL_PERSONA_SEARCH,
+            operation="search",
         )
 
         if len(results) > 0:
@@ -359,39 +764,108 @@ class FeslApiClient(EaApiClient):
 
     async def get_persona_stats(
         self, player_id: int, platform: FeslPlatform, key_set: StatsKeySet
-    ) -> dict:
+    ) -> Tuple[dict, int]:
+        """Get stats along with the number of seconds they remain cached for"""
         cache_key = f"stats:{player_id}:{platform}:{key_set}"
+        ttl_key = get_stats_ttl_key(cache_key)
 
         redis_client = RedisClient()
-        cached_data = await redis_client.get_from_cache(cache_key)
-        if cached_data is not None:
-            data = json.loads(cached_data)
+        (
+            cached_data,
+            remaining,
+            cached_ttl,
+        ) = await redis_client.get_from_cache_with_ttl_and_related(cache_key, ttl_key)
+        previous = StatsTtl.loads(cached_ttl)
+        ttl = previous.ttl if previous is not None else config.CACHE_TTL_DEFAULT
+
+        async def fetch() -> Tuple[dict, int]:
+            fetched = await self.fetch_persona_stats(player_id, platform, key_set)
+            activity = get_activity(fetched)
+            online = await self.is_player_online(platform, player_id)
+            next_ttl = get_next_stats_ttl(previous, activity, online)
+            await redis_client.set_to_cache(
+                cache_key, json.dumps(fetched), next_ttl, keep_stale=True
+            )
+            # Keep ttl beyond the stats' expiry, so the next fetch can build on it
+            await redis_client.set_to_cache(
+                ttl_key,
+                StatsTtl(next_ttl, activity).dumps(),
+                next_ttl + config.CACHE_TTL_STATS_MAX,
+            )
+            return fetched, next_ttl
+
+        # Stats of players seen on a server are likely to change soon, even if they were cached with a long ttl
+        outdated = (
+            cached_data is not None
+            and remaining is not None
+            and ttl - remaining >= config.CACHE_TTL_STATS_ONLINE
+            and await self.is_player_online(platform, player_id)
+        )
+
+        refresh_ahead = RefreshAhead()
+        if cached_data is None or outdated:
+            try:
+                return await refresh_ahead.fetch(cache_key, fetch)
+            except UPSTREAM_FAILURES:
+                if cached_data is None:
+                    cached_data = await redis_client.get_stale_from_cache(cache_key)
+                    if cached_data is None:
+                        raise
+                    remaining = None
         else:
-            data = None
-            attempt = 0
-            while data is None and attempt < CLIENT_MAX_RETRIES:
-                instance = await self.get_instance(platform)
-                encountered_error = False
-                try:
-                    # Will either send login or do nothing if client instance is a permanent one
-                    await instance.client.login()
-                    data = await instance.client.get_stats(
-                        player_id, STATS_KEY_SETS[key_set]
-                    )
-                except pybfbc2stats.ConnectionError as e:
-                    encountered_error = True
-                finally:
-                    await self.return_instance(instance, encountered_error)
-
-            if data is None:
-                raise DataSourceException(
-                    "All attempts to retrieve data from source failed"
-                )
+            refresh_ahead.observe(cache_key, ttl, remaining, fetch)
 
-            cacheable_data = json.dumps(data)
-            await redis_client.set_to_cache(cache_key, cacheable_data)
+        with timed("parse"):
+            data = json.loads(cached_data)
 
-        return data
+        # Stale copies are marked as such (and not cached for long) regardless
+        max_age = math.ceil(remaining) if remaining is not None else ttl
+        return data, max_age
+
+    async def is_player_online(self, platform: FeslPlatform, player_id: int) -> bool:
+        if platform is FeslPlatform.xbox360:
+            # Xbox 360 servers cannot be listed via theater
+            return False
+        theater_client = TheaterApiClient()
+        return await theater_client.is_player_online(
+            TheaterPlatform(platform.value), player_id
+        )
+
+    @brokered
+    async def fetch_persona_stats(
+        self, player_id: int, platform: FeslPlatform, key_set: StatsKeySet
+    ) -> dict:
+        return await call_upstream(
+            self.name,
+            platform,
+            "stats",
+            lambda: self.query_persona_stats(player_id, platform, key_set),
+        )
+
+    async def query_persona_stats(
+        self, player_id: int, platform: FeslPlatform, key_set: StatsKeySet
+    ) -> dict:
+        check_upstream(self.name, platform, "stats")
+        instance = await self.get_instance(platform)
+        encountered_error = False
+        try:
+            async with guard_upstream(self.name, platform, "stats"):
+                # Will either send login or do nothing if client instance is a permanent one
+                await instance.client.login()
+                return await instance.client.get_stats(
+                    player_id, STATS_KEY_SETS[key_set]
+                )
+        except pybfbc2stats.AuthError:
+            # Session could not log in, take its account out of rotation and have it replaced
+            self.record_auth_error(instance)
+            encountered_error = True
+            raise
+        except CONNECTION_BREAKING_ERRORS:
+            # Connection may be broken or left with a partial response, so do not hand it out again
+            encountered_error = True
+            raise
+        finally:
+            await self.return_instance(instance, encountered_error)
 
     async def get_leaderboard(
         self,
@@ -409,51 +883,76 @@ class FeslApiClient(EaApiClient):
         )
         # Leaderboard packets do not reference the platform => add platform as additional cache key
         parsed_response = await self.get_json_cached(
-            platform, packet, b"stats.", additional_cache_key_elements=[str(platform)]
+            platform,
+            packet,
+            b"stats.",
+            additional_cache_key_elements=[str(platform)],
+            operation="leaderboard",
         )
-        # Turn sub lists into dicts and return result
-        leaderboard = [
-            {
-                key: pybfbc2stats.AsyncFeslClient.dict_list_to_dict(value)
-                if isinstance(value, list)
-                else value
-                for (key, value) in persona.items()
-            }
-            for persona in parsed_response
-        ]
-
-        # Cleanup usernames
-        for persona in leaderboard:
-            persona["name"] = clean_string_value(persona["name"])
-
-        return leaderboard
+        with timed("parse"):
+            return format_leaderboard(parsed_response)
 
 
 class TheaterApiClient(EaApiClient):
     instances: Dict[ApiPlatform, TheaterClientInstance]
 
+    crawls: Dict[ApiPlatform, asyncio.Task]
+    # Indexes by cache key, along with the data (or snapshot ETag) they were built from
+    server_list_indexes: Dict[str, Tuple[Union[bytes, str], ServerListIndex]]
+    # Ids of players on a server by platform, along with when they were looked up
+    online_players: Dict[ApiPlatform, Tuple[float, Set[int]]]
+
     def __init__(self, timeout: float = 5.0):
-        super().__init__([TheaterPlatform.pc, TheaterPlatform.ps3], timeout)
+        super().__init__(
+            [TheaterPlatform.pc, TheaterPlatform.ps3],
+            timeout,
+            config.THEATER_STANDBY_INSTANCES,
+        )
+        self.crawls = {}
+        self.server_list_indexes = {}
+        self.online_players = {}
 
     async def create_instance(self, platform: ApiPlatform) -> TheaterClientInstance:
         # Get theater details from FESL (not using existing client instance, since the lkey needs to be "fresh")
         fesl_instance = await FeslApiClient().create_instance(platform)
-        host, port = await fesl_instance.client.get_theater_details()
-        lkey = await fesl_instance.client.get_lkey()
-
-        return TheaterClientInstance(
-            pybfbc2stats.AsyncTheaterClient(
-                host, port, lkey, pybfbc2stats.Platform[platform], timeout=self.timeout
-            )
+        account = fesl_instance.account
+        try:
+            host, port = await fesl_instance.client.get_theater_details()
+            lkey = await fesl_instance.client.get_lkey()
+        except BaseException as e:
+            if isinstance(e, pybfbc2stats.AuthError):
+                AccountPool().record_auth_error(account)
+            AccountPool().release(account)
+            raise
+        finally:
+            # FESL connection is only needed to get the lkey, the theater instance keeps the account reservation
+            await self.close_connection(fesl_instance)
+
+        client = pybfbc2stats.AsyncTheaterClient(
+            host, port, lkey, pybfbc2stats.Platform[platform], timeout=self.timeout
         )
+        setup_transport(client, self.name, platform)
+
+        return TheaterClientInstance(client, platform, account=account)
 
     async def shutdown_instance(self, instance: TheaterClientInstance) -> None:
         await instance.client.connection.close()
 
+    async def close_connection(self, instance: ClientInstance) -> None:
+        try:
+            await instance.client.connection.close()
+        except (pybfbc2stats.Error, OSError) as e:
+            # Connection is not used any further either way
+            self.logger.debug(f"Failed to close {instance.platform} connection: {e}")
+
     async def get_instance(
-        self, platform: ApiPlatform, replace_permanent: bool = False
+        self, platform: ApiPlatform, dedicated: bool = False
     ) -> TheaterClientInstance:
-        return await super().get_instance(platform, replace_permanent)
+        return await super().get_instance(platform, dedicated)
+
+    @staticmethod
+    async def instance_warmup(instance: TheaterClientInstance) -> None:
+        await instance.client.authenticate()
 
     @staticmethod
     async def instance_keepalive(
@@ -465,53 +964,227 @@ class TheaterApiClient(EaApiClient):
         cache_key = f"servers:{platform}"
 
         redis_client = RedisClient()
-        cached_data = await redis_client.get_from_cache(cache_key)
-        if cached_data is not None:
-            servers = json.loads(cached_data)
+        refresh_ahead = RefreshAhead()
+        cached_data, remaining = await redis_client.get_from_cache_with_ttl(cache_key)
+        if cached_data is None:
+            try:
+                return await refresh_ahead.fetch(
+                    cache_key, lambda: self.refresh_servers(platform)
+                )
+            except UPSTREAM_FAILURES:
+                cached_data = await redis_client.get_stale_from_cache(cache_key)
+                if cached_data is None:
+                    raise
         else:
-            servers = None
-            attempt = 0
-            while servers is None and attempt < CLIENT_MAX_RETRIES:
-                instance = await self.get_instance(platform)
-                encountered_error = False
-                try:
-                    lobbies = await instance.client.get_lobbies()
+            refresh_ahead.observe(
+                cache_key,
+                config.CACHE_TTL_SERVERS,
+                remaining,
+                lambda: self.refresh_servers(platform),
+            )
 
-                    # Fetch server ids from lobbies
-                    servers = []
-                    for lobby in lobbies:
-                        lobby_servers = await instance.client.get_servers(
-                            int(lobby["LID"])
-                        )
-                        servers.extend(lobby_servers)
-                except pybfbc2stats.ConnectionError as e:
-                    self.logger.error(
-                        f"Failed to retrieve server list from theater "
-                        f"(attempt {attempt + 1}/{CLIENT_MAX_RETRIES})"
-                    )
-                    self.logger.debug(e)
-                    encountered_error = True
-                    attempt += 1
-                finally:
-                    await self.return_instance(instance, encountered_error)
+        with timed("parse"):
+            servers = json.loads(cached_data)
 
-            if servers is None:
-                raise DataSourceException("Failed to retrieve server list from theater")
+        return servers
 
-            # Clean up server entries (clean up strings, remove obsolete details, ...)
-            servers = [clean_server_details(server) for server in servers]
+    async def refresh_servers(self, platform: TheaterPlatform) -> List[dict]:
+        """Fetch server list from the source, updating caches, snapshot and change feed"""
+        cache_key = f"servers:{platform}"
+        servers = await self.fetch_servers(platform)
 
-            # Sort server list by lobby and game id
-            servers.sort(key=lambda x: x["LID"] + x["GID"])
+        # Cache server list
+        redis_client = RedisClient()
+        cacheable_data = json.dumps(servers)
+        await redis_client.set_to_cache(
+            cache_key, cacheable_data, config.CACHE_TTL_SERVERS, keep_stale=True
+        )
+        publish_server_snapshot(cache_key, cacheable_data, len(servers))
 
-            # Cache server list
-            cacheable_data = json.dumps(servers)
-            await redis_client.set_to_cache(
-                cache_key, cacheable_data, config.CACHE_TTL_SERVERS
+        # Retain a versioned copy of the list for change feeds
+        version = await redis_client.increment(f"{cache_key}:version")
+        if version is not None:
+            await redis_client.set_multiple_to_cache(
+                {
+                    f"{cache_key}:history:{version}": cacheable_data,
+                    f"{cache_key}:latest-version": str(version),
+                },
+                config.CACHE_TTL_SERVER_HISTORY,
             )
+            await redis_client.publish(f"{cache_key}:updates", str(version))
 
         return servers
 
+    @brokered
+    async def fetch_servers(self, platform: TheaterPlatform) -> List[dict]:
+        # Server lists are too large to be worth hedging
+        servers = await call_upstream(
+            self.name,
+            platform,
+            "servers",
+            lambda: self.query_servers(platform),
+            hedge=False,
+        )
+
+        # Clean up server entries (clean up strings, remove obsolete details, ...)
+        with timed("parse"):
+            servers = [clean_server_details(server) for server in servers]
+
+        # Sort server list by lobby and game id
+        servers.sort(key=lambda x: x["LID"] + x["GID"])
+
+        return servers
+
+    async def query_servers(self, platform: TheaterPlatform) -> List[dict]:
+        check_upstream(self.name, platform, "servers")
+        instance = await self.get_instance(platform)
+        encountered_error = False
+        try:
+            async with guard_upstream(self.name, platform, "servers"):
+                lobbies = await instance.client.get_lobbies()
+
+                # Fetch server ids from lobbies
+                servers = []
+                for lobby in lobbies:
+                    lobby_servers = await instance.client.get_servers(int(lobby["LID"]))
+                    servers.extend(lobby_servers)
+            return servers
+        except CONNECTION_BREAKING_ERRORS:
+            # Connection may be broken or left with a partial response, so do not hand it out again
+            encountered_error = True
+            raise
+        finally:
+            await self.return_instance(instance, encountered_error)
+
+    async def get_servers_with_details(self, platform: TheaterPlatform) -> List[dict]:
+        cache_key = f"servers:{platform}:details"
+
+        redis_client = RedisClient()
+        cached_data = await redis_client.get_from_cache(cache_key)
+        if cached_data is None:
+            try:
+                return await self.crawl_server_details(platform)
+            except UPSTREAM_FAILURES:
+                cached_data = await redis_client.get_stale_from_cache(cache_key)
+                if cached_data is None:
+                    raise
+
+        with timed("parse"):
+            servers = json.loads(cached_data)
+
+        return servers
+
+    @brokered
+    async def crawl_server_details(self, platform: TheaterPlatform) -> List[dict]:
+        # Join any crawl that is already running instead of starting another one
+        crawl = self.crawls.get(platform)
+        if crawl is None or crawl.done():
+            # Crawl is shared, so it must not be bound to the deadline of the request which started it
+            crawl = create_background_task(self.run_server_details_crawl(platform))
+            self.crawls[platform] = crawl
+        try:
+            return await asyncio.wait_for(asyncio.shield(crawl), get_remaining_time())
+        except asyncio.TimeoutError:
+            raise DeadlineExceededException(
+                "Request deadline exceeded while waiting for crawl"
+            ) from None
+
+    async def run_server_details_crawl(self, platform: TheaterPlatform) -> List[dict]:
+        # Runs in its own context (see crawl_server_details)
+        upstream_priority.set(Priority.batch)
+        servers = await self.get_servers(platform)
+
+        # Work through the server list with a bounded number of workers, each using a single client instance
+        queue = asyncio.Queue()
+        for server in servers:
+            queue.put_nowait(server)
+        details = {}
+        worker_count = min(config.SERVER_DETAILS_CONCURRENCY, len(servers))
+        await asyncio.gather(
+            *[
+                self.crawl_server_details_worker(platform, queue, details)
+                for _ in range(worker_count)
+            ]
+        )
+
+        # Drop servers which disappeared since the list was fetched,
+        # keep the lobby-level entry of servers whose details could not be retrieved
+        detailed_servers = []
+        for server in servers:
+            key = (server["LID"], server["GID"])
+            if key not in details:
+                detailed_servers.append(server)
+            elif details[key] is not None:
+                detailed_servers.append(details[key])
+
+        self.logger.debug(
+            f"Crawled details of {len(details)}/{len(servers)} {platform} servers"
+        )
+
+        # Cache details of individual servers, then the complete snapshot
+        redis_client = RedisClient()
+        await redis_client.set_multiple_to_cache(
+            {
+                f"server:{platform}:{lid}:{gid}": json.dumps(server)
+                for ((lid, gid), server) in details.items()
+                if server is not None
+            },
+            config.CACHE_TTL_SERVERS,
+            keep_stale=True,
+        )
+        cacheable_data = json.dumps(detailed_servers)
+        await redis_client.set_to_cache(
+            f"servers:{platform}:details",
+            cacheable_data,
+            config.CACHE_TTL_SERVER_DETAILS,
+            keep_stale=True,
+        )
+        publish_server_snapshot(
+            f"servers:{platform}:details", cacheable_data, len(detailed_servers)
+        )
+
+        return detailed_servers
+
+    async def crawl_server_details_worker(
+        self, platform: TheaterPlatform, queue: asyncio.Queue, details: dict
+    ) -> None:
+        # Instance is held for the entire crawl, so leave the permanent one to interactive requests
+        instance = None
+        encountered_error = False
+        try:
+            check_upstream(self.name, platform, "gdat")
+            instance = await self.get_instance(platform, dedicated=True)
+            while not queue.empty():
+                server = queue.get_nowait()
+                key = (server["LID"], server["GID"])
+                # Add some jitter to avoid workers sending requests in lockstep
+                await asyncio.sleep(random.uniform(0, config.SERVER_CRAWL_JITTER))
+                # Only judge the latest request's duration
+                instance.acquired = time.perf_counter()
+                try:
+                    async with guard_upstream(self.name, platform, "gdat"):
+                        general, detailed, players = await instance.client.get_gdat(
+                            lid=key[0].encode("utf8"), gid=key[1].encode("utf8")
+                        )
+                except pybfbc2stats.ServerNotFoundError:
+                    details[key] = None
+                    continue
+
+                details[key] = clean_server_details(
+                    {**general, **detailed, "D-Players": players}
+                )
+        except CircuitOpenException as e:
+            # Theater is unhealthy, keep lobby-level entries for the remaining servers
+            self.logger.warning(f"Stopped crawling {platform} server details: {e}")
+        except pybfbc2stats.Error as e:
+            # Other workers will pick up the remaining servers
+            self.logger.error(f"Failed to crawl {platform} server details from theater")
+            self.logger.debug(e)
+            encountered_error = True
+        finally:
+            if instance is not None:
+                await self.return_instance(instance, encountered_error)
+
     async def get_server(
         self, platform: TheaterPlatform, lobby_id: int, game_id: int
     ) -> dict:
@@ -523,6 +1196,187 @@ class TheaterApiClient(EaApiClient):
             gid=str(game_id).encode("utf8"),
         )
 
+    async def get_server_changes(self, platform: TheaterPlatform, since: int) -> dict:
+        # Make sure the latest version is current
+        servers = await self.get_servers(platform)
+
+        changes = await self.get_retained_server_changes(platform, since)
+        if changes["full"]:
+            changes["servers"] = servers
+        return changes
+
+    async def get_retained_server_changes(
+        self, platform: TheaterPlatform, since: int
+    ) -> dict:
+        """
+        Changes between a given and the latest retained version of the server list (only reads retained versions,
+        never fetches from the source); "full" indicates either version is no longer retained
+        """
+        cache_key = f"servers:{platform}"
+        redis_client = RedisClient()
+        cached_version = await redis_client.get_from_cache(
+            f"{cache_key}:latest-version"
+        )
+        version = int(cached_version) if cached_version is not None else 0
+
+        if since == version and version > 0:
+            return {
+                "version": version,
+                "since": since,
+                "full": False,
+                "added": [],
+                "removed": [],
+                "changed": {},
+            }
+
+        # Diff against retained versions (fall back to a full list if either version is no longer retained)
+        current_data, since_data = None, None
+        if 0 < since < version:
+            current_data, since_data = await redis_client.get_multiple_from_cache(
+                [f"{cache_key}:history:{version}", f"{cache_key}:history:{since}"]
+            )
+        if current_data is None or since_data is None:
+            return {"version": version, "since": since, "full": True}
+
+        changes = diff_server_lists(json.loads(since_data), json.loads(current_data))
+        return {"version": version, "since": since, "full": False, **changes}
+
+    async def get_server_list_index(
+        self, platform: TheaterPlatform, details: bool = False
+    ) -> ServerListIndex:
+        index = await self.get_cached_server_list_index(platform, details)
+        if index is not None:
+            return index
+
+        # Refresh snapshot, index will be rebuilt from cache on next request
+        if details:
+            servers = await self.get_servers_with_details(platform)
+        else:
+            servers = await self.get_servers(platform)
+        return ServerListIndex(servers)
+
+    async def get_cached_server_list_index(
+        self, platform: TheaterPlatform, details: bool = False
+    ) -> Optional[ServerListIndex]:
+        """Index of the current server list snapshot (None if there is no current snapshot, without fetching one)"""
+        cache_key = f"servers:{platform}:details" if details else f"servers:{platform}"
+
+        snapshot = self.get_server_snapshot(platform, details)
+        if snapshot is not None:
+            # Only (re-)build index if another snapshot was published
+            if cache_key in self.server_list_indexes:
+                indexed_etag, index = self.server_list_indexes[cache_key]
+                if indexed_etag == snapshot.etag:
+                    return index
+            with timed("parse"):
+                index = ServerListIndex(json.loads(snapshot.body.tobytes()))
+            self.server_list_indexes[cache_key] = (snapshot.etag, index)
+            return index
+
+        redis_client = RedisClient()
+        cached_data, remaining = await redis_client.get_from_cache_with_ttl(cache_key)
+        if cached_data is None:
+            return None
+
+        if not details:
+            # Detailed lists are refreshed by the crawl
+            RefreshAhead().observe(
+                cache_key,
+                config.CACHE_TTL_SERVERS,
+                remaining,
+                lambda: self.refresh_servers(platform),
+            )
+
+        # Only (re-)build index if the snapshot changed
+        if cache_key in self.server_list_indexes:
+            indexed_data, index = self.server_list_indexes[cache_key]
+            if indexed_data == cached_data:
+                return index
+
+        index = ServerListIndex(json.loads(cached_data))
+        self.server_list_indexes[cache_key] = (cached_data, index)
+
+        return index
+
+    async def is_player_online(self, platform: TheaterPlatform, player_id: int) -> bool:
+        """Whether the player is on any server according to the current server details (never starts a crawl)"""
+        looked_up, player_ids = self.online_players.get(platform, (0.0, set()))
+        if time.monotonic() - looked_up >= ONLINE_PLAYERS_LOOKUP_INTERVAL:
+            index = await self.get_cached_server_list_index(platform, details=True)
+            player_ids = index.player_ids if index is not None else set()
+            self.online_players[platform] = (time.monotonic(), player_ids)
+        return player_id in player_ids
+
+    @staticmethod
+    def get_server_snapshot(
+        platform: TheaterPlatform, details: bool = False
+    ) -> Optional[ServerSnapshot]:
+        if details:
+            return ServerSnapshotStore().get(
+                f"servers:{platform}:details", config.CACHE_TTL_SERVER_DETAILS
+            )
+        return ServerSnapshotStore().get(
+            f"servers:{platform}", config.CACHE_TTL_SERVERS
+        )
+
+    async def get_servers_by_ids(
+        self, platform: TheaterPlatform, server_ids: List[Tuple[int, int]]
+    ) -> Tuple[Dict[str, dict], Dict[str, str]]:
+        if len(server_ids) == 0:
+            raise NoServersException("No lobby/game ids to look up")
+        elif len(server_ids) > config.MULTI_LOOKUP_MAX_SERVERS:
+            raise TooManyServersException("Too many lobby/game ids to look up")
+
+        # Attempt to fetch all servers from cache at once
+        redis_client = RedisClient()
+        cache_keys = [
+            f"server:{platform}:{lobby_id}:{game_id}"
+            for (lobby_id, game_id) in server_ids
+        ]
+        cached_servers = await redis_client.get_multiple_from_cache(cache_keys)
+
+        servers = {}
+        misses = []
+        for (lobby_id, game_id), cache_key, cached_data in zip(
+            server_ids, cache_keys, cached_servers
+        ):
+            if cached_data is not None:
+                servers[f"{lobby_id}:{game_id}"] = json.loads(cached_data)
+            else:
+                misses.append((lobby_id, game_id, cache_key))
+
+        # Fetch any servers missing from cache concurrently (but not all at once)
+        semaphore = asyncio.Semaphore(config.SERVER_DETAILS_CONCURRENCY)
+
+        async def fetch(lobby_id: int, game_id: int, cache_key: str) -> dict:
+            async with semaphore:
+                return await self.get_gdat(
+                    cache_key,
+                    platform,
+                    lid=str(lobby_id).encode("utf8"),
+                    gid=str(game_id).encode("utf8"),
+                )
+
+        results = await asyncio.gather(
+            *[fetch(*miss) for miss in misses], return_exceptions=True
+        )
+
+        errors = {}
+        for (lobby_id, game_id, _), result in zip(misses, results):
+            key = f"{lobby_id}:{game_id}"
+            if isinstance(result, pybfbc2stats.ServerNotFoundError):
+                errors[key] = "Server not found"
+            elif isinstance(result, pybfbc2stats.TimeoutError):
+                errors[key] = "Timed out fetching data from source"
+            elif isinstance(result, (pybfbc2stats.Error, DataSourceException)):
+                errors[key] = "Failed to fetch data from source"
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                servers[key] = result
+
+        return servers, errors
+
     async def get_current_server(
         self,
         platform: TheaterPlatform,
@@ -538,7 +1392,8 @@ class TheaterApiClient(EaApiClient):
             namespace = ApiNamespace.psn
 
         if persona_id is None:
-            personas = await get_personas(namespace, [persona_name])
+            with timed("persona"):
+                personas = await get_personas(namespace, [persona_name])
             persona = personas.pop()
         else:
             persona = {"pid": persona_id}
@@ -553,44 +1408,49 @@ class TheaterApiClient(EaApiClient):
     ) -> dict:
         redis_client = RedisClient()
         cached_data = await redis_client.get_from_cache(cache_key)
-        if cached_data is not None:
-            server = json.loads(cached_data)
-        else:
-            server = None
-            attempt = 0
-            while server is None and attempt < CLIENT_MAX_RETRIES:
-                instance = await self.get_instance(platform)
-                encountered_error = False
-                try:
-                    general, detailed, players = await instance.client.get_gdat(
-                        **kwargs
-                    )
-                    server = {**general, **detailed, "D-Players": players}
-                except pybfbc2stats.ConnectionError as e:
-                    self.logger.error(
-                        f"Failed to retrieve server details from theater"
-                        f"(attempt {attempt + 1}/{CLIENT_MAX_RETRIES})"
-                    )
-                    self.logger.debug(e)
-                    encountered_error = True
-                    attempt += 1
-                finally:
-                    await self.return_instance(instance, encountered_error)
-
-            if server is None:
-                raise DataSourceException(
-                    "Failed to retrieve server details from theater"
+        if cached_data is None:
+            try:
+                server = await self.fetch_gdat(platform, **kwargs)
+            except UPSTREAM_FAILURES:
+                cached_data = await redis_client.get_stale_from_cache(cache_key)
+                if cached_data is None:
+                    raise
+            else:
+                cacheable_data = json.dumps(server)
+                await redis_client.set_to_cache(
+                    cache_key, cacheable_data, config.CACHE_TTL_SERVERS, keep_stale=True
                 )
+                return server
 
-            server = clean_server_details(server)
-
-            cacheable_data = json.dumps(server)
-            await redis_client.set_to_cache(
-                cache_key, cacheable_data, config.CACHE_TTL_SERVERS
-            )
+        with timed("parse"):
+            server = json.loads(cached_data)
 
         return server
 
+    @brokered
+    async def fetch_gdat(self, platform: TheaterPlatform, **kwargs: bytes) -> dict:
+        server = await call_upstream(
+            self.name, platform, "gdat", lambda: self.query_gdat(platform, **kwargs)
+        )
+
+        with timed("parse"):
+            return clean_server_details(server)
+
+    async def query_gdat(self, platform: TheaterPlatform, **kwargs: bytes) -> dict:
+        check_upstream(self.name, platform, "gdat")
+        instance = await self.get_instance(platform)
+        encountered_error = False
+        try:
+            async with guard_upstream(self.name, platform, "gdat"):
+                general, detailed, players = await instance.client.get_gdat(**kwargs)
+            return {**general, **detailed, "D-Players": players}
+        except CONNECTION_BREAKING_ERRORS:
+            # Connection may be broken or left with a partial response, so do not hand it out again
+            encountered_error = True
+            raise
+        finally:
+            await self.return_instance(instance, encountered_error)
+
 
 async def get_personas(
     namespace: ApiNamespace,
@@ -621,54 +1481,46 @@ async def get_personas(
     cached_personas = await redis_client.get_multiple_from_cache(cache_keys)
 
     # Check whether we need look up any personas or we can serve entirely from cache
-    identifiers_to_lookup = []
     personas_from_cache = [json.loads(cp) for cp in cached_personas if cp is not None]
-    if 0 < len(personas_from_cache) < len(identifiers):
-        # Some personas were found in cache, determine which identifiers still need to be looked up
-        if identifier_type == IdentifierType.playerName:
-            identifiers_to_lookup = list(
-                set(identifiers)
-                - set([fc["name"].lower() for fc in personas_from_cache])
-            )
-        else:
-            identifiers_to_lookup = list(
-                set(identifiers) - set([str(fc["pid"]) for fc in personas_from_cache])
-            )
-    elif len(personas_from_cache) == 0:
-        # None of the personas was found in cache, look all up now
-        identifiers_to_lookup = identifiers
+    identifiers_to_lookup = get_identifiers_to_lookup(
+        identifiers, identifier_type, personas_from_cache
+    )
 
     # Look up any missing personas
     personas_from_fesl = []
     if len(identifiers_to_lookup) > 0:
-        results = await client.find_persona_by_identifiers(
-            identifiers_to_lookup, identifier_type, namespace
-        )
+        try:
+            results = await client.find_persona_by_identifiers(
+                identifiers_to_lookup, identifier_type, namespace
+            )
+        except UPSTREAM_FAILURES:
+            stale_personas = await redis_client.get_multiple_stale_from_cache(
+                [
+                    f"persona:{namespace}:{identifier_type}:{identifier}"
+                    for identifier in identifiers_to_lookup
+                ]
+            )
+            personas_from_fesl = [
+                json.loads(sp) for sp in stale_personas if sp is not None
+            ]
+            if len(personas_from_fesl) == 0:
+                raise
+            return sorted(
+                [*personas_from_cache, *personas_from_fesl], key=lambda d: d["name"]
+            )
 
         if results is None and len(personas_from_cache) == 0:
             # Raise exception if no personas could be retrieved via FESL and none were found in cache
             raise PlayerNotFoundException("No persona found with given persona name/id")
         elif results is not None:
-            # Create cacheable mapping dicts
-            name_keyed_mapping = {
-                f'persona:{persona["namespace"]}:{IdentifierType.playerName}:{persona["name"].lower()}': json.dumps(
-                    persona
-                )
-                for persona in results
-            }
-            id_keyed_mapping = {
-                f'persona:{persona["namespace"]}:{IdentifierType.playerId}:{persona["pid"]}': json.dumps(
-                    persona
-                )
-                for persona in results
-            }
+            name_keyed_mapping, id_keyed_mapping = get_persona_cache_mappings(results)
 
             await redis_client.set_multiple_to_cache(
-                name_keyed_mapping, CACHE_TTL_PERSONAS_BY_NAME
+                name_keyed_mapping, CACHE_TTL_PERSONAS_BY_NAME, keep_stale=True
             )
             # Don't cache personas by their id as long to allow player name changes to be reflected earlier
             await redis_client.set_multiple_to_cache(
-                id_keyed_mapping, CACHE_TTL_PERSONAS_BY_ID
+                id_keyed_mapping, CACHE_TTL_PERSONAS_BY_ID, keep_stale=True
             )
 
             personas_from_fesl = results
@@ -686,7 +1538,7 @@ async def get_stats(
     key_set: StatsKeySet,
     persona_name: str = None,
     persona_id: int = None,
-) -> dict:
+) -> Tuple[dict, int]:
     if persona_name is None and persona_id is None:
         raise ValueError("Either a persona name or persona id must be provided")
 
@@ -700,14 +1552,13 @@ async def get_stats(
         namespace = ApiNamespace.xbl
 
     if persona_id is None:
-        personas = await get_personas(namespace, [persona_name])
+        with timed("persona"):
+            personas = await get_personas(namespace, [persona_name])
         persona = personas.pop()
     else:
         persona = {"pid": persona_id}
 
-    stats = await client.get_persona_stats(persona["pid"], platform, key_set)
-
-    return stats
+    return await client.get_persona_stats(persona["pid"], platform, key_set)
 
 
 async def get_leaderboard(
@@ -724,11 +1575,42 @@ async def get_servers(platform: TheaterPlatform) -> List[dict]:
     return await theater_client.get_servers(platform)
 
 
+async def get_servers_with_details(platform: TheaterPlatform) -> List[dict]:
+    theater_client = TheaterApiClient()
+    return await theater_client.get_servers_with_details(platform)
+
+
+async def get_server_list_index(
+    platform: TheaterPlatform, details: bool = False
+) -> ServerListIndex:
+    theater_client = TheaterApiClient()
+    return await theater_client.get_server_list_index(platform, details)
+
+
+def get_server_snapshot(
+    platform: TheaterPlatform, details: bool = False
+) -> Optional[ServerSnapshot]:
+    theater_client = TheaterApiClient()
+    return theater_client.get_server_snapshot(platform, details)
+
+
+async def get_server_changes(platform: TheaterPlatform, since: int) -> dict:
+    theater_client = TheaterApiClient()
+    return await theater_client.get_server_changes(platform, since)
+
+
 async def get_server(platform: TheaterPlatform, lobby_id: int, game_id: int) -> dict:
     theater_client = TheaterApiClient()
     return await theater_client.get_server(platform, lobby_id, game_id)
 
 
+async def get_servers_by_ids(
+    platform: TheaterPlatform, server_ids: List[Tuple[int, int]]
+) -> Tuple[Dict[str, dict], Dict[str, str]]:
+    theater_client = TheaterApiClient()
+    return await theater_client.get_servers_by_ids(platform, server_ids)
+
+
 async def get_current_server(
     platform: TheaterPlatform, persona_name: str = None, persona_id: int = None
 ) -> dict:
@@ -1,21 +1,39 @@
+import asyncio
+import json
+import logging
+import math
+import time
+
 import pybfbc2stats
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi_utils.tasks import repeat_every
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.responses import RedirectResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from app import config
-from app.cache import RedisClient
+from app.admission import client_address
+from app.broker import SessionBrokerClient
+from app.cache import RedisClient, stale_keys
+from app.constants import TheaterPlatform
 from app.exceptions import (
     PlayerNotFoundException,
     DataSourceException,
     NoPersonasException,
     TooManyPersonasException,
+    NoServersException,
+    TooManyServersException,
+    CircuitOpenException,
+    DeadlineExceededException,
+    OverloadedException,
+    RateLimitedException,
 )
 from app.fetch import FeslApiClient, TheaterApiClient
+from app.metrics import REQUEST_LATENCY
+from app.timing import RequestTimings, request_timings, create_background_task
 from app.router import router
 
 app = FastAPI(
@@ -47,11 +65,89 @@ app.add_middleware(
     ],
 )
 app.include_router(router)
+slow_request_logger = logging.getLogger("SlowRequests")
+startup_logger = logging.getLogger("Startup")
+# Set once all clients are logged in/connected (and caches are warmed, if enabled)
+warmed_up = asyncio.Event()
 # Anyone requesting .../[endpoint]/ instead of just .../[endpoint] would get redirected to .../[endpoint],
 # potentially leaking a CDN origin domain in the 307 redirect header => disable slash redirects
 app.router.redirect_slashes = False
 
 
+@app.middleware("http")
+async def observe_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Use route template as label to keep the number of label values bounded
+    route = request.scope.get("route")
+    REQUEST_LATENCY.labels(
+        request.method,
+        route.path if route is not None else "unmatched",
+        response.status_code,
+    ).observe(time.perf_counter() - start)
+    return response
+
+
+@app.middleware("http")
+async def add_server_timing(request: Request, call_next):
+    timings = RequestTimings()
+    request_timings.set(timings)
+    response = await call_next(request)
+    response.headers["Server-Timing"] = timings.to_header()
+    if 0 < config.SLOW_REQUEST_THRESHOLD < timings.total:
+        slow_request_logger.warning(
+            json.dumps(
+                {
+                    "method": request.method,
+                    "path": request.url.path,
+                    "query": request.url.query,
+                    "status": response.status_code,
+                    "total": round(timings.total * 1000, 1),
+                    "phases": {
+                        phase: round(duration * 1000, 1)
+                        for (phase, duration) in timings.phases.items()
+                    },
+                }
+            )
+        )
+    return response
+
+
+@app.middleware("http")
+async def set_client_address(request: Request, call_next):
+    # Lets admission control limit upstream work per client
+    client_address.set(request.client.host if request.client is not None else None)
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def add_stale_warning(request: Request, call_next):
+    keys = []
+    stale_keys.set(keys)
+    response = await call_next(request)
+    if len(keys) > 0:
+        # Data source failed and (some) data was served from stale copies, make sure these are not cached for long
+        response.headers["Warning"] = '110 - "Response is Stale"'
+        response.headers[
+            "Cache-Control"
+        ] = f"public, max-age={config.CACHE_MAX_AGE_STALE}"
+    return response
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    # Lets orchestrators hold back traffic until the replica is warmed up
+    headers = {"Cache-Control": "no-cache"}
+    if not warmed_up.is_set():
+        return JSONResponse(content={"ready": False}, headers=headers, status_code=503)
+    return JSONResponse(content={"ready": True}, headers=headers)
+
+
 @app.get("/", include_in_schema=False)
 async def read_root():
     response = RedirectResponse(url="/docs")
@@ -88,7 +184,9 @@ async def server_not_found_exception_handler(request, exc):
 
 @app.exception_handler(NoPersonasException)
 @app.exception_handler(TooManyPersonasException)
-async def multi_persona_exception_handler(request, exc):
+@app.exception_handler(NoServersException)
+@app.exception_handler(TooManyServersException)
+async def multi_lookup_exception_handler(request, exc):
     headers = {"Cache-Control": "no-cache"}
     return JSONResponse(
         content={"errors": [str(exc)]}, headers=headers, status_code=422
@@ -105,7 +203,47 @@ async def search_exception_handler(request, exc):
     )
 
 
+@app.exception_handler(CircuitOpenException)
+async def circuit_open_exception_handler(request, exc):
+    headers = {
+        "Cache-Control": "no-cache",
+        "Retry-After": str(math.ceil(exc.retry_after)),
+    }
+    return JSONResponse(
+        content={"errors": "Source is temporarily unavailable"},
+        headers=headers,
+        status_code=503,
+    )
+
+
+@app.exception_handler(OverloadedException)
+async def overloaded_exception_handler(request, exc):
+    headers = {
+        "Cache-Control": "no-cache",
+        "Retry-After": str(math.ceil(exc.retry_after)),
+    }
+    return JSONResponse(
+        content={"errors": "Source is temporarily overloaded"},
+        headers=headers,
+        status_code=503,
+    )
+
+
+@app.exception_handler(RateLimitedException)
+async def rate_limited_exception_handler(request, exc):
+    headers = {
+        "Cache-Control": "no-cache",
+        "Retry-After": str(math.ceil(exc.retry_after)),
+    }
+    return JSONResponse(
+        content={"errors": "Too many requests"},
+        headers=headers,
+        status_code=429,
+    )
+
+
 @app.exception_handler(pybfbc2stats.TimeoutError)
+@app.exception_handler(DeadlineExceededException)
 async def timeout_exception_handler(request, exc):
     headers = {"Cache-Control": "no-cache"}
     return JSONResponse(
@@ -131,20 +269,70 @@ async def client_exception_handler(request, exc):
 async def on_startup():
     redis_client = RedisClient()
     await redis_client.redis_connect()
-    await maintain_fesl_instances()
-    await maintain_theater_instances()
+    if config.SESSION_BROKER_SOCKET is not None:
+        # Upstream sessions (and crawls) are owned by the session broker
+        app.state.warm_up = create_background_task(wait_for_session_broker())
+        return
+    # Warm up in the background, readiness is reported via /ready
+    app.state.warm_up = create_background_task(warm_up())
+    await crawl_server_details()
+
+
+async def warm_up():
+    clients = [
+        FeslApiClient(config.CLIENT_TIMEOUT),
+        TheaterApiClient(config.CLIENT_TIMEOUT),
+    ]
+    failures = 0
+    while True:
+        try:
+            # Log in to FESL and connect to Theater on all platforms concurrently
+            await asyncio.gather(*[client.initialize() for client in clients])
+            break
+        except Exception as e:
+            # Keep trying no matter what went wrong, nobody would notice this task failing (and never becoming ready)
+            failures += 1
+            delay = min(2**failures, config.CLIENT_PING_INTERVAL)
+            startup_logger.warning(
+                f"Failed to initialize clients, retrying in {delay} seconds: {e}"
+            )
+            await asyncio.sleep(delay)
+
+    for client in clients:
+        client.start_maintenance()
+
+    if config.STARTUP_WARM_CACHES:
+        # Joins the crawl started on startup (the crawl logs its own errors)
+        theater_client = TheaterApiClient(config.CLIENT_TIMEOUT)
+        await asyncio.gather(
+            *[
+                theater_client.crawl_server_details(platform)
+                for platform in TheaterPlatform
+            ],
+            return_exceptions=True,
+        )
+
+    warmed_up.set()
+    startup_logger.info("Warmed up, ready to serve requests")
+
 
+async def wait_for_session_broker():
+    broker_client = SessionBrokerClient()
+    while not await broker_client.is_ready():
+        await asyncio.sleep(1)
 
-@repeat_every(seconds=10)
-async def maintain_fesl_instances():
-    client = FeslApiClient(config.CLIENT_TIMEOUT)
-    await client.maintain_instances()
+    warmed_up.set()
+    startup_logger.info("Session broker is ready, ready to serve requests")
 
 
-@repeat_every(seconds=10)
-async def maintain_theater_instances():
+@repeat_every(seconds=config.SERVER_CRAWL_INTERVAL)
+async def crawl_server_details():
     client = TheaterApiClient(config.CLIENT_TIMEOUT)
-    await client.maintain_instances()
+    for platform in TheaterPlatform:
+        try:
+            await client.crawl_server_details(platform)
+        except (pybfbc2stats.Error, DataSourceException) as e:
+            client.logger.error(f"Failed to crawl {platform} server details: {e}")
 
 
 if __name__ == "__main__":
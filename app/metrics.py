@@ -0,0 +1,162 @@
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from app.timing import timed
+
+REQUEST_LATENCY = Histogram(
+    "api_request_duration_seconds",
+    "Time taken to handle API requests",
+    ["method", "route", "status"],
+)
+CACHE_REQUESTS = Counter(
+    "api_cache_requests_total",
+    "Cache lookups by key family and result",
+    ["family", "result"],
+)
+CACHE_REFRESHES = Counter(
+    "api_cache_refreshes_total",
+    "Background refreshes of cached data before expiry by key family, reason (hot/early) and result",
+    ["family", "reason", "result"],
+)
+CACHE_STATS_TTLS = Histogram(
+    "api_cache_stats_ttl_seconds",
+    "Ttl of cached stats by reason (unchanged/changed/online)",
+    ["reason"],
+    buckets=(60, 120, 300, 600, 1200, 2400, 4800, 9600, 19200, 38400, 86400, 172800),
+)
+POOL_BUSY_INSTANCES = Gauge(
+    "api_client_pool_busy_instances",
+    "Permanent client instances currently in use",
+    ["client", "platform"],
+)
+POOL_WAITING = Gauge(
+    "api_client_pool_waiting",
+    "Maintenance tasks currently waiting for a client instance to become due/available",
+    ["client", "platform"],
+)
+POOL_INSTANCE_HEALTH = Gauge(
+    "api_client_pool_instance_health",
+    "Health score of permanent client instances (weighted share of recent requests which succeeded in time)",
+    ["client", "platform"],
+)
+POOL_INSTANCES_REPLACED = Counter(
+    "api_client_pool_instances_replaced_total",
+    "Permanent client instances replaced by maintenance",
+    ["client", "platform", "reason"],
+)
+POOL_STANDBY_INSTANCES = Gauge(
+    "api_client_pool_standby_instances",
+    "Connected client instances ready to replace permanent ones or serve requests when all are busy",
+    ["client", "platform"],
+)
+POOL_TEMPORARY_INSTANCES = Gauge(
+    "api_client_pool_temporary_instances",
+    "Temporary client instances currently in use",
+    ["client", "platform"],
+)
+POOL_TEMPORARY_INSTANCES_CREATED = Counter(
+    "api_client_pool_temporary_instances_created_total",
+    "Temporary client instances created because all permanent instances were busy",
+    ["client", "platform"],
+)
+POOL_DEDICATED_INSTANCES = Counter(
+    "api_client_pool_dedicated_instances_total",
+    "Standby/temporary client instances checked out for long-running work (e.g. crawls)",
+    ["client", "platform"],
+)
+ACCOUNT_SESSIONS = Gauge(
+    "api_account_sessions",
+    "FESL/Theater sessions currently open using the account (default or position in CLIENT_ACCOUNTS)",
+    ["account"],
+)
+ACCOUNT_HEALTH = Gauge(
+    "api_account_health",
+    "Health score of the account (weighted share of recent requests which succeeded in time)",
+    ["account"],
+)
+ACCOUNT_COOLDOWNS = Counter(
+    "api_account_cooldowns_total",
+    "Times the account was taken out of rotation",
+    ["account", "reason"],
+)
+UPSTREAM_LATENCY = Histogram(
+    "api_upstream_request_duration_seconds",
+    "Round trip time of requests to FESL/Theater",
+    ["client", "platform", "operation"],
+)
+UPSTREAM_ERRORS = Counter(
+    "api_upstream_errors_total",
+    "Failed requests to FESL/Theater",
+    ["client", "platform", "operation", "error"],
+)
+UPSTREAM_RETRIES = Counter(
+    "api_upstream_retries_total",
+    "Retried requests to FESL/Theater",
+    ["client", "platform", "operation"],
+)
+UPSTREAM_TIMEOUT = Gauge(
+    "api_upstream_timeout_seconds",
+    "Current adaptive timeout of requests to FESL/Theater (0 = none)",
+    ["client", "platform", "operation"],
+)
+UPSTREAM_HEDGES = Counter(
+    "api_upstream_hedges_total",
+    "Duplicate requests sent to FESL/Theater because the original was slow, by which request completed first",
+    ["client", "platform", "operation", "winner"],
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "api_upstream_in_flight",
+    "Upstream operations admitted by the scheduler and currently running, by priority class",
+    ["client", "platform", "priority"],
+)
+UPSTREAM_QUEUED = Gauge(
+    "api_upstream_queued",
+    "Upstream operations waiting to be admitted by the scheduler, by priority class",
+    ["client", "platform", "priority"],
+)
+UPSTREAM_QUEUE_TIME = Histogram(
+    "api_upstream_queue_seconds",
+    "Time upstream operations waited to be admitted by the scheduler, by priority class",
+    ["client", "platform", "priority"],
+)
+ADMISSION_REJECTED = Counter(
+    "api_admission_rejected_total",
+    "Upstream operations rejected by admission control, by reason",
+    ["reason"],
+)
+CIRCUIT_STATE = Gauge(
+    "api_circuit_state",
+    "State of upstream circuit breakers (0 = closed, 1 = half-open, 2 = open)",
+    ["client", "platform", "operation"],
+)
+CIRCUIT_REJECTED = Counter(
+    "api_circuit_rejected_total",
+    "Requests to FESL/Theater rejected by an open circuit",
+    ["client", "platform", "operation"],
+)
+
+
+def get_cache_key_family(key: str) -> str:
+    return key.split(":", 1)[0]
+
+
+def count_cache_lookup(key: str, hit: bool) -> None:
+    CACHE_REQUESTS.labels(get_cache_key_family(key), "hit" if hit else "miss").inc()
+
+
+@contextmanager
+def observe_upstream(client: str, platform: str, operation: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        with timed("upstream"):
+            yield
+    except Exception as e:
+        UPSTREAM_ERRORS.labels(client, platform, operation, e.__class__.__name__).inc()
+        raise
+    finally:
+        UPSTREAM_LATENCY.labels(client, platform, operation).observe(
+            time.perf_counter() - start
+        )
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import math
+import random
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional, Set, TypeVar
+
+from app import config
+from app.circuit import RequestBudget
+from app.metrics import CACHE_REFRESHES, get_cache_key_family
+from app.scheduler import Priority, upstream_priority
+from app.singleton import Singleton
+from app.timing import create_background_task
+
+# Weight of the most recent fetch duration in a key family's estimated fetch time
+FETCH_TIME_WEIGHT = 0.2
+# Maximum number of refreshes which can be started in a row
+REFRESH_BURST = 5.0
+
+T = TypeVar("T")
+
+
+@dataclass
+class KeyActivity:
+    # Exponentially decaying number of accesses, approximates accesses per REFRESH_AHEAD_ACTIVITY_WINDOW
+    accesses: float = 0.0
+    updated: float = 0.0
+
+    def add(self, now: float, weight: float) -> None:
+        self.decay(now)
+        self.accesses += weight
+
+    def decay(self, now: float) -> None:
+        self.accesses *= math.exp(
+            -(now - self.updated) / config.REFRESH_AHEAD_ACTIVITY_WINDOW
+        )
+        self.updated = now
+
+
+class RefreshBudget(RequestBudget, metaclass=Singleton):
+    def __init__(self):
+        super().__init__(config.REFRESH_AHEAD_BUDGET_RATIO, REFRESH_BURST)
+
+
+class RefreshAhead(metaclass=Singleton):
+    """
+    Refreshes cached data in the background before it expires, so requests do not have to wait for the source. Hot
+    keys (based on sampled accesses) are refreshed once they enter the last share of their ttl, other keys are
+    refreshed early with a probability rising towards expiry (probabilistic early expiration, "XFetch").
+    Refreshes are limited to a share of cache hits and a number of concurrent refreshes.
+    """
+
+    activity: "OrderedDict[str, KeyActivity]"
+    # Estimated time it takes to fetch data of a key family from the source
+    fetch_times: Dict[str, float]
+    refreshing: Set[str]
+    tasks: Set[asyncio.Task]
+    logger: logging.Logger
+
+    def __init__(self):
+        self.activity = OrderedDict()
+        self.fetch_times = {}
+        self.refreshing = set()
+        self.tasks = set()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @staticmethod
+    def is_enabled() -> bool:
+        return config.REFRESH_AHEAD_CONCURRENCY > 0
+
+    async def fetch(self, key: str, fetch: Callable[[], Awaitable[T]]) -> T:
+        """Fetch data (and cache it) via the given function, tracking how long fetching takes"""
+        start = time.perf_counter()
+        result = await fetch()
+        family = get_cache_key_family(key)
+        duration = time.perf_counter() - start
+        previous = self.fetch_times.get(family, duration)
+        self.fetch_times[family] = previous + FETCH_TIME_WEIGHT * (duration - previous)
+        return result
+
+    def observe(
+        self,
+        key: str,
+        ttl: int,
+        remaining: Optional[float],
+        fetch: Callable[[], Awaitable[T]],
+    ) -> None:
+        """Record cache hit, refreshing the data in the background if it is (about to be) due"""
+        if not self.is_enabled() or remaining is None:
+            return
+
+        now = time.monotonic()
+        activity = self.activity.get(key)
+        if random.random() < config.REFRESH_AHEAD_SAMPLE_RATE:
+            if activity is None:
+                activity = self.activity[key] = KeyActivity(updated=now)
+                if len(self.activity) > config.REFRESH_AHEAD_MAX_KEYS:
+                    # Forget about the least recently sampled key
+                    self.activity.popitem(last=False)
+            self.activity.move_to_end(key)
+            # Every sampled access stands in for all accesses which were not sampled
+            activity.add(now, 1 / config.REFRESH_AHEAD_SAMPLE_RATE)
+        elif activity is not None:
+            activity.decay(now)
+
+        family = get_cache_key_family(key)
+        budget = RefreshBudget()
+        budget.add_request((family,))
+        reason = self.get_refresh_reason(key, ttl, remaining, activity)
+        if reason is None or key in self.refreshing:
+            return
+        at_capacity = len(self.refreshing) >= config.REFRESH_AHEAD_CONCURRENCY
+        if at_capacity or not budget.acquire((family,)):
+            CACHE_REFRESHES.labels(family, reason, "skipped").inc()
+            return
+
+        self.refreshing.add(key)
+        # Run without the current request's deadline/timings
+        task = create_background_task(self.refresh(key, family, reason, fetch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def get_refresh_reason(
+        self,
+        key: str,
+        ttl: int,
+        remaining: float,
+        activity: Optional[KeyActivity],
+    ) -> Optional[str]:
+        if (
+            activity is not None
+            and activity.accesses >= config.REFRESH_AHEAD_HOT_ACCESSES
+            and remaining <= ttl * config.REFRESH_AHEAD_WINDOW
+        ):
+            return "hot"
+
+        # Refresh with a probability that rises the closer the data is to expiry and the longer fetching it takes
+        fetch_time = self.fetch_times.get(get_cache_key_family(key))
+        if (
+            fetch_time is not None
+            and -fetch_time * config.REFRESH_AHEAD_BETA * math.log(1 - random.random())
+            >= remaining
+        ):
+            return "early"
+
+        return None
+
+    async def refresh(
+        self,
+        key: str,
+        family: str,
+        reason: str,
+        fetch: Callable[[], Awaitable[T]],
+    ) -> None:
+        # Runs in its own context (see observe)
+        upstream_priority.set(Priority.background)
+        try:
+            await self.fetch(key, fetch)
+            CACHE_REFRESHES.labels(family, reason, "refreshed").inc()
+        except Exception as e:
+            # Cached data is still valid, the next request to find it expired will try again
+            CACHE_REFRESHES.labels(family, reason, "failed").inc()
+            self.logger.debug(f"Failed to refresh {key}: {e}")
+        finally:
+            self.refreshing.discard(key)
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import random
+from typing import Awaitable, Callable, TypeVar
+
+import pybfbc2stats
+
+from app import config
+from app.admission import admit_client
+from app.circuit import RequestBudget, hedge_upstream
+from app.exceptions import DataSourceException, DeadlineExceededException
+from app.metrics import UPSTREAM_RETRIES
+from app.singleton import Singleton
+from app.timing import get_remaining_time
+
+# Maximum number of retries which can be sent in a row
+RETRY_BURST = 10.0
+
+T = TypeVar("T")
+
+
+class RetryBudget(RequestBudget, metaclass=Singleton):
+    def __init__(self):
+        super().__init__(config.CLIENT_RETRY_BUDGET_RATIO, RETRY_BURST)
+
+
+def get_retry_backoff(retry: int) -> float:
+    # Exponential backoff with "full" jitter, so retries of concurrent requests are spread out
+    return random.uniform(
+        0,
+        min(
+            config.CLIENT_RETRY_BACKOFF_BASE * 2 ** (retry - 1),
+            config.CLIENT_RETRY_BACKOFF_MAX,
+        ),
+    )
+
+
+async def call_upstream(
+    client: str,
+    platform: str,
+    operation: str,
+    attempt: Callable[[], Awaitable[T]],
+    hedge: bool = True,
+) -> T:
+    """
+    Run an upstream request attempt (optionally hedged), retrying it after connection (or login) errors with backoff
+    until either an attempt succeeds, CLIENT_MAX_RETRIES attempts were made, the retry budget is exhausted or a retry
+    would run past the request's deadline
+    """
+    # Turn away clients exceeding their rate before doing any work on their behalf
+    await admit_client()
+
+    key = (client, platform, operation)
+    logger = logging.getLogger(client)
+    budget = RetryBudget()
+    budget.add_request(key)
+    retry = 0
+    while True:
+        remaining = get_remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceededException("Request deadline exceeded")
+
+        try:
+            if hedge:
+                return await hedge_upstream(client, platform, operation, attempt)
+            return await attempt()
+        # A rejected login is worth retrying, since the next attempt uses another account's session
+        except (pybfbc2stats.ConnectionError, pybfbc2stats.AuthError) as e:
+            logger.warning(
+                f"Failed to retrieve {operation} data from {platform} source "
+                f"(attempt {retry + 1}/{config.CLIENT_MAX_RETRIES})"
+            )
+            logger.debug(e)
+            retry += 1
+            if retry >= config.CLIENT_MAX_RETRIES:
+                raise DataSourceException(
+                    "All attempts to retrieve data from source failed"
+                ) from e
+
+            backoff = get_retry_backoff(retry)
+            remaining = get_remaining_time()
+            if remaining is not None and remaining <= backoff:
+                raise DeadlineExceededException(
+                    "Request deadline exceeded before data could be retrieved"
+                ) from e
+            if not budget.acquire(key):
+                raise DataSourceException("Retry budget exhausted") from e
+
+        UPSTREAM_RETRIES.labels(*key).inc()
+        await asyncio.sleep(backoff)
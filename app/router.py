@@ -1,6 +1,7 @@
-from typing import List
+from typing import List, Tuple, Optional
 
-from fastapi import APIRouter, Path, Query, Body
+from fastapi import APIRouter, Path, Query, Body, Request
+from fastapi.responses import StreamingResponse
 
 from app import config
 from app.constants import (
@@ -10,17 +11,24 @@ from app.constants import (
     LeaderboardSortKey,
     FeslPlatform,
     TheaterPlatform,
+    ServerSortKey,
+    SortOrder,
 )
 from app.fetch import (
     get_personas,
     get_stats,
     get_leaderboard,
     search_persona_name,
-    get_servers,
+    get_server_list_index,
+    get_server_snapshot,
+    get_server_changes,
     get_server,
+    get_servers_by_ids,
     get_current_server,
 )
-from app.utility import CacheableJSONResponse
+from app.exceptions import TooManyServersException
+from app.subscriptions import ServerUpdateBroker, Subscription
+from app.utility import CacheableJSONResponse, SnapshotResponse
 
 # Anyone requesting .../[endpoint]/ instead of just .../[endpoint] would get redirected to .../[endpoint],
 # potentially leaking a CDN origin domain in the 307 redirect header => disable slash redirects
@@ -149,8 +157,8 @@ async def r_get_stats_by_name(
         StatsKeySet.default, description="Set of data keys/points to fetch"
     ),
 ):
-    stats = await get_stats(platform, key_set, persona_name=persona_name)
-    return CacheableJSONResponse(content=stats)
+    stats, max_age = await get_stats(platform, key_set, persona_name=persona_name)
+    return CacheableJSONResponse(content=stats, max_age=max_age)
 
 
 @router.get(
@@ -167,8 +175,8 @@ async def r_get_stats_by_id(
         StatsKeySet.default, description="Set of data keys/points to fetch"
     ),
 ):
-    stats = await get_stats(platform, key_set, persona_id=persona_id)
-    return CacheableJSONResponse(content=stats)
+    stats, max_age = await get_stats(platform, key_set, persona_id=persona_id)
+    return CacheableJSONResponse(content=stats, max_age=max_age)
 
 
 @router.get(
@@ -198,10 +206,138 @@ async def r_get_leaderboard(
     tags=["Battlefield: Bad Company 2 servers"],
 )
 async def r_get_servers(
-    platform: TheaterPlatform = Path(..., description="Platform to get server list for")
+    request: Request,
+    platform: TheaterPlatform = Path(
+        ..., description="Platform to get server list for"
+    ),
+    details: bool = Query(
+        False,
+        description="Include server details and players (served from a periodically refreshed snapshot)",
+    ),
+    map_name: Optional[str] = Query(
+        None, alias="map", description="Only include servers running the given map"
+    ),
+    game_mode: Optional[str] = Query(
+        None,
+        alias="mode",
+        description="Only include servers running the given game mode",
+    ),
+    name: Optional[str] = Query(
+        None,
+        description="Only include servers with names containing words starting with the given words",
+    ),
+    min_players: Optional[int] = Query(
+        None, ge=0, description="Only include servers with at least this many players"
+    ),
+    max_players: Optional[int] = Query(
+        None, ge=0, description="Only include servers with at most this many players"
+    ),
+    sort_by: Optional[ServerSortKey] = Query(
+        None, description="Attribute to sort servers by (default: lobby and game id)"
+    ),
+    order: SortOrder = Query(SortOrder.asc, description="Sort order"),
+    fields: Optional[str] = Query(
+        None,
+        description="Comma-separated list of keys to include for each server (default: all)",
+        example="LID,GID,N,AP,MP",
+    ),
+    offset: int = Query(0, ge=0, description="Number of matching servers to skip"),
+    limit: Optional[int] = Query(
+        None, ge=1, description="Maximum number of servers to return"
+    ),
+):
+    if all(
+        value is None
+        for value in [
+            map_name,
+            game_mode,
+            name,
+            min_players,
+            max_players,
+            sort_by,
+            fields,
+            limit,
+        ]
+    ) and (offset == 0 and order is SortOrder.asc):
+        # Serve complete list straight from the shared snapshot (if available)
+        snapshot = get_server_snapshot(platform, details)
+        if snapshot is not None:
+            return SnapshotResponse(
+                snapshot.body,
+                snapshot.etag,
+                headers={"X-Total-Count": str(snapshot.count)},
+                max_age=config.CACHE_MAX_AGE_SERVERS,
+                not_modified=request.headers.get("If-None-Match") == snapshot.etag,
+            )
+
+    index = await get_server_list_index(platform, details)
+    total, servers = index.query(
+        map_name,
+        game_mode,
+        name,
+        min_players,
+        max_players,
+        sort_by,
+        order,
+        fields.split(",") if fields is not None else None,
+        offset,
+        limit,
+    )
+    return CacheableJSONResponse(
+        content=servers,
+        headers={"X-Total-Count": str(total)},
+        max_age=config.CACHE_MAX_AGE_SERVERS,
+    )
+
+
+@router.get(
+    "/servers/{platform}/changes",
+    summary="Get changes to the server list for a given platform since a given version",
+    description="Returns servers added to and removed from the list as well as changed fields of all other "
+    "servers (removed fields are set to null). If the given version is no longer retained, the full server list "
+    "is returned instead (with full set to true). Use a version of 0 to get the initial list.",
+    tags=["Battlefield: Bad Company 2 servers"],
+)
+async def r_get_server_changes(
+    platform: TheaterPlatform = Path(
+        ..., description="Platform to get server list changes for"
+    ),
+    since: int = Query(
+        0, ge=0, description="Server list version previously retrieved by the client"
+    ),
+):
+    changes = await get_server_changes(platform, since)
+    return CacheableJSONResponse(content=changes, max_age=config.CACHE_MAX_AGE_SERVERS)
+
+
+@router.get(
+    "/servers/{platform}/updates",
+    summary="Subscribe to server list changes for a given platform (Server-Sent Events)",
+    description="Streams a <code>changes</code> event (same format as the server list changes endpoint) whenever "
+    "the server list is refreshed. If servers are given, a <code>server</code> event is sent per added, changed "
+    "or removed server instead. Events only cover fields of the server list, not server details or players "
+    "(use the server details endpoint for those). Clients which do not keep up receive a <code>resync</code> "
+    "event and should re-fetch the server list.",
+    tags=["Battlefield: Bad Company 2 servers"],
+)
+async def r_get_server_updates(
+    platform: TheaterPlatform = Path(..., description="Platform to subscribe to"),
+    servers: Optional[List[str]] = Query(
+        None,
+        description=f"Only subscribe to up to {config.MULTI_LOOKUP_MAX_SERVERS} servers "
+        f"given by their lobby and game id (LID:GID)",
+        example=["257:119168"],
+    ),
 ):
-    servers = await get_servers(platform)
-    return CacheableJSONResponse(content=servers, max_age=config.CACHE_MAX_AGE_SERVERS)
+    if servers is not None and len(servers) > config.MULTI_LOOKUP_MAX_SERVERS:
+        raise TooManyServersException("Too many servers to subscribe to")
+
+    subscription = Subscription(platform, set(servers) if servers else None)
+    return StreamingResponse(
+        ServerUpdateBroker().stream(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.get(
@@ -220,6 +356,30 @@ async def r_get_server(
     return CacheableJSONResponse(content=server, max_age=config.CACHE_MAX_AGE_SERVERS)
 
 
+@router.post(
+    "/servers/{platform}/details",
+    summary=f"Get details and currently active players for multiple game (server) ids from their lobby ids "
+    f"(min: 1, max: {config.MULTI_LOOKUP_MAX_SERVERS})",
+    description="Returns a map of servers keyed by lobby and game id (LID:GID). Servers which could not be "
+    "retrieved are listed under errors with the reason instead of failing the entire request.",
+    tags=["Battlefield: Bad Company 2 servers"],
+)
+async def r_post_servers_details(
+    platform: TheaterPlatform = Path(..., description="Platform of the game servers"),
+    server_ids: List[Tuple[int, int]] = Body(
+        ...,
+        description=f"JSON list of 1-{config.MULTI_LOOKUP_MAX_SERVERS} pairs of lobby id (LID) and game id (GID)",
+        example=[[257, 119168], [257, 119169]],
+    ),
+):
+    servers, errors = await get_servers_by_ids(
+        platform, list(dict.fromkeys(server_ids))
+    )
+    content = {"servers": servers, "errors": errors}
+    # Responses to POST requests are not cacheable by (shared) caches anyway
+    return CacheableJSONResponse(content=content, headers={"Cache-Control": "no-cache"})
+
+
 @router.get(
     "/servers/{platform}/current/by-name/{persona_name}",
     summary="Get details and currently active players for a given persona's/player's current server "
@@ -0,0 +1,183 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from app import config
+from app.exceptions import DeadlineExceededException, OverloadedException
+from app.metrics import (
+    ADMISSION_REJECTED,
+    UPSTREAM_IN_FLIGHT,
+    UPSTREAM_QUEUED,
+    UPSTREAM_QUEUE_TIME,
+)
+from app.timing import timed, get_remaining_time
+
+
+class Priority(IntEnum):
+    # Requests someone is waiting for
+    interactive = 0
+    # Bulk work done on behalf of many requests (e.g. server detail crawls)
+    batch = 1
+    # Work which can be put off (e.g. keepalives, refreshing cached data ahead of expiry)
+    background = 2
+
+
+# Priority of upstream operations started in the current context, background tasks need to set their own
+upstream_priority: ContextVar[Priority] = ContextVar(
+    "upstream_priority", default=Priority.interactive
+)
+
+
+def get_concurrency_limit(priority: Priority) -> int:
+    if priority == Priority.batch:
+        return config.UPSTREAM_CONCURRENCY_BATCH
+    if priority == Priority.background:
+        return config.UPSTREAM_CONCURRENCY_BACKGROUND
+    return config.UPSTREAM_CONCURRENCY
+
+
+class UpstreamScheduler:
+    """
+    Admits upstream operations of a single client and platform by priority class. Every class is limited to its own
+    number of concurrent operations, lower classes are only admitted while no higher class operation is waiting and
+    there is spare capacity (leaving UPSTREAM_CONCURRENCY_RESERVED operations to interactive requests). Interactive
+    operations are rejected once too many of them are waiting or they waited for too long, so overload is answered
+    quickly instead of with timeouts for everyone.
+    """
+
+    labels: Tuple[str, str]
+    in_flight: Dict[Priority, int]
+    # Waiting operations by priority, then order of arrival
+    waiting: List[Tuple[Priority, int, asyncio.Future]]
+    arrivals: itertools.count
+
+    def __init__(self, client: str, platform: str):
+        self.labels = (client, platform)
+        self.in_flight = {priority: 0 for priority in Priority}
+        self.waiting = []
+        self.arrivals = itertools.count()
+
+    def can_admit(self, priority: Priority) -> bool:
+        limit = get_concurrency_limit(priority)
+        if 0 < limit <= self.in_flight[priority]:
+            return False
+        if config.UPSTREAM_CONCURRENCY <= 0:
+            return True
+        capacity = config.UPSTREAM_CONCURRENCY
+        if priority != Priority.interactive:
+            capacity -= config.UPSTREAM_CONCURRENCY_RESERVED
+        return sum(self.in_flight.values()) < capacity
+
+    def admit(self, priority: Priority) -> None:
+        self.in_flight[priority] += 1
+        UPSTREAM_IN_FLIGHT.labels(*self.labels, priority.name).set(
+            self.in_flight[priority]
+        )
+
+    def get_queue_timeout(self, priority: Priority) -> Optional[float]:
+        if priority != Priority.interactive or config.UPSTREAM_QUEUE_TIMEOUT <= 0:
+            return None
+        return config.UPSTREAM_QUEUE_TIMEOUT
+
+    def is_queue_full(self, priority: Priority) -> bool:
+        # Only interactive operations are shed, other work waits for as long as it takes
+        if priority != Priority.interactive or config.UPSTREAM_QUEUE_SIZE <= 0:
+            return False
+        queued = sum(1 for (p, _, f) in self.waiting if p == priority and not f.done())
+        return queued >= config.UPSTREAM_QUEUE_SIZE
+
+    def reject(self, reason: str) -> OverloadedException:
+        ADMISSION_REJECTED.labels(reason).inc()
+        return OverloadedException(
+            f"Source is overloaded ({' '.join(self.labels)})",
+            # Queued operations should have been admitted (or rejected) by then
+            max(config.UPSTREAM_QUEUE_TIMEOUT, 1.0),
+        )
+
+    async def acquire(self, priority: Priority) -> None:
+        """Wait until an operation of the given priority may be started (raising OverloadedException if the queue is
+        full or the operation waited too long, DeadlineExceededException if the current request's deadline passes
+        while waiting)"""
+        # Waiting operations cannot be admitted either (see dispatch), which also holds for any new operation of the
+        # same or a lower priority unless it is only held back by a class limit
+        if self.can_admit(priority):
+            self.admit(priority)
+            return
+        if self.is_queue_full(priority):
+            raise self.reject("queue_full")
+
+        # Stop waiting at whichever comes first, the queue timeout or the request's deadline
+        remaining = get_remaining_time()
+        queue_timeout = self.get_queue_timeout(priority)
+        limited_by_deadline = remaining is not None and (
+            queue_timeout is None or remaining < queue_timeout
+        )
+        timeout = max(remaining, 0) if limited_by_deadline else queue_timeout
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (priority, next(self.arrivals), future))
+        start = time.perf_counter()
+        try:
+            with UPSTREAM_QUEUED.labels(
+                *self.labels, priority.name
+            ).track_inprogress(), timed("queue"):
+                async with asyncio.timeout(timeout):
+                    # Slot is handed over once granted (see dispatch)
+                    await future
+        except TimeoutError:
+            self.abandon(future, priority)
+            if not limited_by_deadline:
+                raise self.reject("queue_timeout") from None
+            raise DeadlineExceededException(
+                "Request deadline exceeded while waiting for upstream capacity"
+            ) from None
+        except BaseException:
+            self.abandon(future, priority)
+            raise
+        finally:
+            UPSTREAM_QUEUE_TIME.labels(*self.labels, priority.name).observe(
+                time.perf_counter() - start
+            )
+
+    def abandon(self, future: asyncio.Future, priority: Priority) -> None:
+        if future.done() and not future.cancelled():
+            # Slot was granted just as the caller gave up, pass it on
+            self.release(priority)
+        else:
+            future.cancel()
+
+    def release(self, priority: Priority) -> None:
+        self.in_flight[priority] -= 1
+        UPSTREAM_IN_FLIGHT.labels(*self.labels, priority.name).set(
+            self.in_flight[priority]
+        )
+        self.dispatch()
+
+    def dispatch(self) -> None:
+        """Grant slots to waiting operations in order of priority (and arrival) for as long as there is capacity"""
+        still_waiting = []
+        for entry in sorted(self.waiting):
+            priority, _, future = entry
+            if future.done():
+                # Caller gave up
+                continue
+            if self.can_admit(priority):
+                self.admit(priority)
+                future.set_result(None)
+            else:
+                still_waiting.append(entry)
+        # A sorted list is a valid heap
+        self.waiting = still_waiting
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority) -> AsyncIterator[None]:
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release(priority)
@@ -0,0 +1,204 @@
+import re
+from bisect import bisect_left, bisect_right
+from typing import List, Dict, Set, Optional, Tuple
+
+from app.constants import (
+    ServerSortKey,
+    SortOrder,
+    THEATER_NAME_KEY,
+    THEATER_MAP_KEY,
+    THEATER_GAME_MODE_KEY,
+    THEATER_ACTIVE_PLAYERS_KEY,
+)
+
+NAME_TOKEN_REGEX = re.compile(r"[a-z0-9]+")
+
+
+def normalize_map(value: str) -> str:
+    # Maps are reported as level paths (e.g. levels/mp_005), allow filtering by either path or level name
+    return value.lower().rsplit("/", 1)[-1]
+
+
+def tokenize_name(value: str) -> List[str]:
+    return NAME_TOKEN_REGEX.findall(value.lower())
+
+
+def get_active_players(server: dict) -> int:
+    try:
+        return int(server.get(THEATER_ACTIVE_PLAYERS_KEY, 0))
+    except ValueError:
+        return 0
+
+
+class ServerListIndex:
+    """Lookup structures for a server list snapshot, built once per snapshot and shared by all queries"""
+
+    servers: List[dict]
+    by_map: Dict[str, Set[int]]
+    by_game_mode: Dict[str, Set[int]]
+    by_name_token: Dict[str, Set[int]]
+    name_tokens: List[str]
+    player_counts: List[int]
+    by_player_count: List[int]
+    orderings: Dict[ServerSortKey, List[int]]
+    # Ids of players on any of the servers (only known for servers with details)
+    player_ids: Set[int]
+
+    def __init__(self, servers: List[dict]):
+        self.servers = servers
+        self.by_map = {}
+        self.by_game_mode = {}
+        self.by_name_token = {}
+        for position, server in enumerate(servers):
+            self.by_map.setdefault(
+                normalize_map(server.get(THEATER_MAP_KEY, "")), set()
+            ).add(position)
+            self.by_game_mode.setdefault(
+                server.get(THEATER_GAME_MODE_KEY, "").lower(), set()
+            ).add(position)
+            for token in tokenize_name(server.get(THEATER_NAME_KEY, "")):
+                self.by_name_token.setdefault(token, set()).add(position)
+        self.name_tokens = sorted(self.by_name_token)
+        self.player_ids = {
+            player["pid"]
+            for server in servers
+            for player in server.get("D-Players", [])
+        }
+
+        active_players = [get_active_players(server) for server in servers]
+        self.by_player_count = sorted(
+            range(len(servers)), key=lambda p: active_players[p]
+        )
+        self.player_counts = [active_players[p] for p in self.by_player_count]
+
+        self.orderings = {
+            ServerSortKey.name: sorted(
+                range(len(servers)),
+                key=lambda p: servers[p].get(THEATER_NAME_KEY, "").lower(),
+            ),
+            ServerSortKey.map: sorted(
+                range(len(servers)),
+                key=lambda p: normalize_map(servers[p].get(THEATER_MAP_KEY, "")),
+            ),
+            ServerSortKey.mode: sorted(
+                range(len(servers)),
+                key=lambda p: servers[p].get(THEATER_GAME_MODE_KEY, "").lower(),
+            ),
+            ServerSortKey.players: self.by_player_count,
+        }
+
+    def filter(
+        self,
+        map_name: Optional[str] = None,
+        game_mode: Optional[str] = None,
+        name: Optional[str] = None,
+        min_players: Optional[int] = None,
+        max_players: Optional[int] = None,
+    ) -> Optional[Set[int]]:
+        """Get positions of servers matching all given filters (None if no filters were given)"""
+        candidate_sets = []
+        if map_name is not None:
+            candidate_sets.append(self.by_map.get(normalize_map(map_name), set()))
+        if game_mode is not None:
+            candidate_sets.append(self.by_game_mode.get(game_mode.lower(), set()))
+        if name is not None:
+            query_tokens = tokenize_name(name)
+            if len(query_tokens) == 0:
+                # Names without any words (e.g. only punctuation) cannot match any server
+                candidate_sets.append(set())
+            # Every token of the query needs to match the start of any token of the server name
+            for query_token in query_tokens:
+                start = bisect_left(self.name_tokens, query_token)
+                matches = set()
+                for token in self.name_tokens[start:]:
+                    if not token.startswith(query_token):
+                        break
+                    matches.update(self.by_name_token[token])
+                candidate_sets.append(matches)
+        if min_players is not None or max_players is not None:
+            start = (
+                bisect_left(self.player_counts, min_players)
+                if min_players is not None
+                else 0
+            )
+            end = (
+                bisect_right(self.player_counts, max_players)
+                if max_players is not None
+                else len(self.player_counts)
+            )
+            candidate_sets.append(set(self.by_player_count[start:end]))
+
+        if len(candidate_sets) == 0:
+            return None
+
+        # Intersect starting with the smallest set
+        candidate_sets.sort(key=len)
+        return set.intersection(*candidate_sets)
+
+    def query(
+        self,
+        map_name: Optional[str] = None,
+        game_mode: Optional[str] = None,
+        name: Optional[str] = None,
+        min_players: Optional[int] = None,
+        max_players: Optional[int] = None,
+        sort_by: Optional[ServerSortKey] = None,
+        order: SortOrder = SortOrder.asc,
+        fields: Optional[List[str]] = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> Tuple[int, List[dict]]:
+        """Get total number of matching servers and requested page of (projected) servers"""
+        candidates = self.filter(map_name, game_mode, name, min_players, max_players)
+
+        if sort_by is not None:
+            ordering = self.orderings[sort_by]
+        else:
+            ordering = range(len(self.servers))
+        if order is SortOrder.desc:
+            ordering = reversed(ordering)
+
+        if candidates is not None:
+            positions = [p for p in ordering if p in candidates]
+        else:
+            positions = list(ordering)
+
+        total = len(positions)
+        end = offset + limit if limit is not None else None
+        page = [self.servers[p] for p in positions[offset:end]]
+
+        if fields is not None:
+            page = [
+                {key: server[key] for key in fields if key in server} for server in page
+            ]
+
+        return total, page
+
+
+def get_server_id(server: dict) -> str:
+    return f'{server["LID"]}:{server["GID"]}'
+
+
+def diff_server_lists(old_servers: List[dict], new_servers: List[dict]) -> dict:
+    """Get servers added to/removed from the list and changed fields of all other servers"""
+    old = {get_server_id(server): server for server in old_servers}
+    new = {get_server_id(server): server for server in new_servers}
+
+    added = [server for (server_id, server) in new.items() if server_id not in old]
+    removed = [server_id for server_id in old if server_id not in new]
+    changed = {}
+    for server_id, server in new.items():
+        if server_id not in old:
+            continue
+        old_server = old[server_id]
+        # Removed keys are reported with a value of None
+        fields = {
+            key: value
+            for (key, value) in server.items()
+            if old_server.get(key) != value
+        }
+        fields.update({key: None for key in old_server if key not in server})
+        if len(fields) > 0:
+            changed[server_id] = fields
+
+    return {"added": added, "removed": removed, "changed": changed}
@@ -0,0 +1,100 @@
+import hashlib
+import logging
+import mmap
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Union
+
+from app import config
+from app.singleton import Singleton
+
+# Snapshot files start with a header line containing the snapshot's ETag and number of servers
+HEADER_END = b"\n"
+
+
+@dataclass
+class ServerSnapshot:
+    """Serialized server list shared by all worker processes on a host via a memory-mapped file"""
+
+    etag: str
+    count: int
+    # Identifies the file the snapshot was loaded from (files are replaced, never changed)
+    version: tuple
+    mapping: mmap.mmap
+    body: memoryview
+
+
+def get_snapshot_path(key: str) -> str:
+    return os.path.join(config.SERVER_SNAPSHOT_DIR, f'{key.replace(":", "-")}.snapshot')
+
+
+def publish_server_snapshot(key: str, data: Union[str, bytes], count: int) -> None:
+    """Publish serialized server list for other worker processes (does nothing unless snapshots are enabled)"""
+    if config.SERVER_SNAPSHOT_DIR is None:
+        return
+
+    if isinstance(data, str):
+        data = data.encode("utf8")
+    etag = f'"{hashlib.sha1(data).hexdigest()}"'
+    path = get_snapshot_path(key)
+    # Write to a temporary file first, so readers never see a partially written snapshot
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(config.SERVER_SNAPSHOT_DIR, exist_ok=True)
+        with open(temporary_path, "wb") as snapshot_file:
+            snapshot_file.write(f"{etag} {count}".encode("utf8") + HEADER_END + data)
+        os.replace(temporary_path, path)
+    except OSError as e:
+        logging.getLogger(ServerSnapshotStore.__name__).error(
+            f"Failed to publish {key} snapshot: {e}"
+        )
+
+
+class ServerSnapshotStore(metaclass=Singleton):
+    """Memory-mapped server list snapshots, re-mapped only once another process publishes a new one"""
+
+    snapshots: Dict[str, ServerSnapshot]
+
+    def __init__(self):
+        self.snapshots = {}
+
+    def get(self, key: str, ttl: int) -> Optional[ServerSnapshot]:
+        """Get current snapshot for given key (None if snapshots are disabled or there is no fresh snapshot)"""
+        if config.SERVER_SNAPSHOT_DIR is None:
+            return None
+
+        path = get_snapshot_path(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if time.time() - stat.st_mtime > ttl:
+            return None
+
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        snapshot = self.snapshots.get(key)
+        if snapshot is None or snapshot.version != version:
+            snapshot = self.load(path, version)
+            if snapshot is None:
+                return None
+            # Previous mapping is unmapped once the last response using it has been sent
+            self.snapshots[key] = snapshot
+
+        return snapshot
+
+    @staticmethod
+    def load(path: str, version: tuple) -> Optional[ServerSnapshot]:
+        try:
+            with open(path, "rb") as snapshot_file:
+                # Mapping stays valid after the file is closed (or replaced by a newer snapshot)
+                mapping = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # Snapshot was removed or is empty
+            return None
+
+        header_end = mapping.find(HEADER_END)
+        etag, count = mapping[:header_end].decode("utf8").split(" ")
+        return ServerSnapshot(
+            etag, int(count), version, mapping, memoryview(mapping)[header_end + 1 :]
+        )
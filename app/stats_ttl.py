@@ -0,0 +1,62 @@
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Optional, Union
+
+from app import config
+from app.metrics import CACHE_STATS_TTLS
+
+# Stats which only change by playing, compared to tell whether a player has been active since stats were last fetched
+ACTIVITY_KEYS = ("games", "time")
+
+
+@dataclass
+class StatsTtl:
+    """Ttl of a player's cached stats, along with their activity when the stats were last fetched"""
+
+    ttl: int
+    activity: str
+
+    def dumps(self) -> str:
+        return json.dumps({"ttl": self.ttl, "activity": self.activity})
+
+    @classmethod
+    def loads(cls, value: Optional[Union[bytes, str]]) -> Optional["StatsTtl"]:
+        if value is None:
+            return None
+        try:
+            parsed = json.loads(value)
+            return cls(int(parsed["ttl"]), str(parsed["activity"]))
+        except (ValueError, KeyError, TypeError):
+            return None
+
+
+def get_stats_ttl_key(stats_key: str) -> str:
+    return f"stats-ttl:{stats_key.split(':', 1)[1]}"
+
+
+def get_activity(stats: dict) -> str:
+    """Get marker which changes whenever the player was active (all stats if the key set lacks games/time played)"""
+    if all(key in stats for key in ACTIVITY_KEYS):
+        values = [stats[key] for key in ACTIVITY_KEYS]
+    else:
+        values = stats
+    return hashlib.sha1(json.dumps(values, sort_keys=True).encode("utf8")).hexdigest()
+
+
+def get_next_stats_ttl(
+    previous: Optional[StatsTtl], activity: str, online: bool
+) -> int:
+    """Get ttl for freshly fetched stats"""
+    if online:
+        ttl, reason = config.CACHE_TTL_STATS_ONLINE, "online"
+    elif previous is not None and previous.activity == activity:
+        # Player was not active since the last fetch, each time they are not makes it less likely they will be soon
+        ttl = (
+            max(previous.ttl, config.CACHE_TTL_DEFAULT) * config.CACHE_TTL_STATS_GROWTH
+        )
+        ttl, reason = int(min(ttl, config.CACHE_TTL_STATS_MAX)), "unchanged"
+    else:
+        ttl, reason = config.CACHE_TTL_DEFAULT, "changed"
+    CACHE_STATS_TTLS.labels(reason).observe(ttl)
+    return ttl
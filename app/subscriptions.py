@@ -0,0 +1,175 @@
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Set, Optional, AsyncIterator
+
+from app import config
+from app.cache import RedisClient
+from app.constants import TheaterPlatform
+from app.fetch import TheaterApiClient
+from app.servers import get_server_id
+from app.singleton import Singleton
+from app.timing import create_background_task
+
+
+def format_event(event: str, data: dict, event_id: Optional[int] = None) -> bytes:
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return ("\n".join(lines) + "\n\n").encode("utf8")
+
+
+@dataclass(eq=False)
+class Subscription:
+    platform: TheaterPlatform
+    # Subscribe to the entire server list if no specific servers are given
+    server_ids: Optional[Set[str]] = None
+    queue: asyncio.Queue = field(
+        default_factory=lambda: asyncio.Queue(config.SUBSCRIPTION_BUFFER_SIZE)
+    )
+
+    def push(self, message: bytes, version: int) -> None:
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Subscriber is not keeping up, drop anything buffered and tell it to start over
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(format_event("resync", {"version": version}, version))
+
+
+class ServerUpdateBroker(metaclass=Singleton):
+    subscriptions: Dict[TheaterPlatform, Set[Subscription]]
+    versions: Dict[TheaterPlatform, int]
+    listener: Optional[asyncio.Task]
+    logger: logging.Logger
+
+    def __init__(self):
+        self.subscriptions = {platform: set() for platform in TheaterPlatform}
+        self.versions = {}
+        self.listener = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    async def stream(self, subscription: Subscription) -> AsyncIterator[bytes]:
+        self.subscribe(subscription)
+        try:
+            # Tell subscriber which version updates will be based on
+            cached_version = await RedisClient().get_from_cache(
+                f"servers:{subscription.platform}:latest-version"
+            )
+            version = int(cached_version) if cached_version is not None else None
+            yield format_event("version", {"version": version})
+            while True:
+                try:
+                    yield await asyncio.wait_for(
+                        subscription.queue.get(), config.SUBSCRIPTION_KEEPALIVE_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    # Send a comment line to keep the connection from being closed by proxies
+                    yield b": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+    def subscribe(self, subscription: Subscription) -> None:
+        self.subscriptions[subscription.platform].add(subscription)
+        if self.listener is None or self.listener.done():
+            self.listener = create_background_task(self.listen())
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self.subscriptions[subscription.platform].discard(subscription)
+
+    async def listen(self) -> None:
+        channels = {
+            f"{config.REDIS_KEY_PREFIX}servers:{platform}:updates".encode(
+                "utf8"
+            ): platform
+            for platform in TheaterPlatform
+        }
+        redis_client = RedisClient()
+        while True:
+            try:
+                pubsub = await redis_client.subscribe(
+                    *[f"servers:{platform}:updates" for platform in TheaterPlatform]
+                )
+                async for message in pubsub.listen():
+                    platform = channels.get(message["channel"])
+                    if platform is not None and message["type"] == "message":
+                        await self.publish(platform, int(message["data"]))
+            except Exception as e:
+                self.logger.error(f"Failed to listen for server list updates: {e}")
+                await asyncio.sleep(1)
+
+    async def publish(self, platform: TheaterPlatform, version: int) -> None:
+        since = self.versions.get(platform, version - 1)
+        if version <= since:
+            return
+
+        # Nothing to diff against for the very first version
+        subscriptions = list(self.subscriptions[platform])
+        if len(subscriptions) == 0 or since < 1:
+            self.versions[platform] = version
+            return
+
+        try:
+            # Only read retained versions, fetching from the source here would hold up updates for every subscriber
+            changes = await TheaterApiClient().get_retained_server_changes(
+                platform, since
+            )
+        except Exception as e:
+            self.logger.error(
+                f"Failed to determine {platform} server list changes: {e}"
+            )
+            return
+
+        # Changes cover any later versions as well (if refreshes happened in quick succession),
+        # so label them accordingly and skip updates for versions which are already covered
+        version = max(changes["version"], version)
+        self.versions[platform] = version
+
+        if changes["full"]:
+            # Version to diff against is gone, subscribers need to re-fetch the list
+            message = format_event("resync", {"version": version}, version)
+            for subscription in subscriptions:
+                subscription.push(message, version)
+            return
+
+        # Serialize every message once, no matter how many subscribers receive it
+        list_message = None
+        server_messages = {}
+        for subscription in subscriptions:
+            if subscription.server_ids is None:
+                if list_message is None:
+                    list_message = format_event("changes", changes, version)
+                subscription.push(list_message, version)
+                continue
+
+            for server_id in subscription.server_ids:
+                if server_id not in server_messages:
+                    server_messages[server_id] = self.format_server_event(
+                        changes, server_id, version
+                    )
+                if server_messages[server_id] is not None:
+                    subscription.push(server_messages[server_id], version)
+
+    @staticmethod
+    def format_server_event(
+        changes: dict, server_id: str, version: int
+    ) -> Optional[bytes]:
+        # Based on the (lobby-level) server list, so changes to server details/players are not included
+        if server_id in changes["changed"]:
+            data = {"changed": changes["changed"][server_id]}
+        elif server_id in changes["removed"]:
+            data = {"removed": True}
+        else:
+            added = next(
+                (s for s in changes["added"] if get_server_id(s) == server_id), None
+            )
+            if added is None:
+                return None
+            data = {"added": added}
+
+        return format_event(
+            "server", {"version": version, "id": server_id, **data}, version
+        )
@@ -0,0 +1,65 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import Context, ContextVar
+from typing import Coroutine, Dict, Iterator, Optional
+
+from app import config
+
+
+class RequestTimings:
+    start: float
+    phases: Dict[str, float]
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+
+    def add(self, phase: str, duration: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration
+
+    @property
+    def total(self) -> float:
+        return time.perf_counter() - self.start
+
+    def to_header(self) -> str:
+        # Phases may overlap (e.g. persona resolution includes cache lookups), durations are in milliseconds
+        entries = [
+            f"{phase};dur={duration * 1000:.1f}"
+            for (phase, duration) in self.phases.items()
+        ]
+        entries.append(f"total;dur={self.total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+request_timings: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    timings = request_timings.get()
+    if timings is None:
+        # Not handling a request (e.g. background task)
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - start)
+
+
+def get_remaining_time() -> Optional[float]:
+    """Get time left until the current request's deadline (None = not handling a request or no deadline)"""
+    timings = request_timings.get()
+    if timings is None or config.REQUEST_DEADLINE <= 0:
+        return None
+    return timings.start + config.REQUEST_DEADLINE - time.perf_counter()
+
+
+def create_background_task(coro: Coroutine) -> asyncio.Task:
+    """Create a task which is not tied to the current request (timings, deadline, ...), e.g. for shared work"""
+    return asyncio.create_task(coro, context=Context())
@@ -0,0 +1,309 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import struct
+import time
+from collections import deque
+from typing import Deque, Dict, Iterator, List, Optional, Tuple, Type
+
+import pybfbc2stats
+from pybfbc2stats.asyncio_client import AsyncClient
+from pybfbc2stats.asyncio_connection import AsyncConnection
+from pybfbc2stats.packet import Packet, FeslPacket, TheaterPacket
+
+from app import config
+from app.singleton import Singleton
+
+# record type, connection id, seconds since capture start, payload length
+RECORD_HEADER = struct.Struct(">BIdI")
+RECORD_OPEN = 0
+RECORD_WRITE = 1
+RECORD_READ = 2
+# Lines which differ between sessions (or contain credentials) and are thus ignored when matching requests
+VOLATILE_REQUEST_LINES = (b"TID=", b"LKEY=", b"name=", b"password=")
+
+# (delay since previous packet, raw response packet)
+RecordedResponse = Tuple[float, bytes]
+
+
+def is_auto_response(packet: Packet) -> bool:
+    """Check whether a packet is a reply to a memcheck/ping prompt (which does not get a response)"""
+    return (
+        packet.header.startswith(b"PING")
+        or b"TXN=MemCheck" in packet.body
+        or b"TXN=Ping" in packet.body
+    )
+
+
+def get_request_digest(packets: List[Packet]) -> str:
+    request = hashlib.sha1()
+    for packet in packets:
+        # Ignore transaction id and length indicators in header
+        request.update(
+            packet.header[:5] if isinstance(packet, FeslPacket) else packet.header[:8]
+        )
+        for line in packet.get_data_lines():
+            if not line.startswith(VOLATILE_REQUEST_LINES):
+                request.update(line + b"\n")
+    return request.hexdigest()
+
+
+def set_response_tid(packet: Packet, tid: int) -> Packet:
+    if isinstance(packet, FeslPacket):
+        # Memcheck/ping prompts are always sent with a tid of 0
+        if packet.get_tid() != 0:
+            packet.set_tid(tid)
+        return packet
+
+    lines = packet.get_data_lines()
+    if not any(line.startswith(b"TID=") for line in lines):
+        return packet
+    packet.body = (
+        b"\n".join(
+            b"TID=" + str(tid).encode("utf8") if line.startswith(b"TID=") else line
+            for line in lines
+        )
+        + b"\x00"
+    )
+    packet.set_length_indicators()
+    return packet
+
+
+def redact_packet(packet: Packet) -> bytes:
+    """Get raw packet with any credentials removed"""
+    if b"password=" not in packet.body:
+        return bytes(packet)
+
+    redacted = packet.__class__(
+        packet.header,
+        b"\n".join(
+            b"password=" if line.startswith(b"password=") else line
+            for line in packet.get_data_lines()
+        )
+        + b"\x00",
+    )
+    redacted.set_length_indicators()
+    return bytes(redacted)
+
+
+def read_records(path: str) -> Iterator[Tuple[int, int, float, bytes]]:
+    with gzip.open(path, "rb") as capture:
+        try:
+            while header := capture.read(RECORD_HEADER.size):
+                record_type, connection_id, timestamp, length = RECORD_HEADER.unpack(
+                    header
+                )
+                yield record_type, connection_id, timestamp, capture.read(length)
+        except EOFError:
+            # Capture file was not closed properly (recording process was killed), all flushed records are complete
+            return
+
+
+class CaptureWriter(metaclass=Singleton):
+    """Appends raw upstream packets (with timestamps) to a gzip compressed capture file"""
+
+    path: str
+    start: float
+    connection_count: int
+    file: Optional[gzip.GzipFile]
+
+    def __init__(self, path: str = config.UPSTREAM_CAPTURE_FILE):
+        self.path = path
+        self.start = time.perf_counter()
+        self.connection_count = 0
+        self.file = None
+
+    def open_connection(self, client: str, platform: str) -> int:
+        self.connection_count += 1
+        meta = json.dumps({"client": client, "platform": platform}).encode("utf8")
+        self.write(RECORD_OPEN, self.connection_count, meta)
+        return self.connection_count
+
+    def write(self, record_type: int, connection_id: int, payload: bytes) -> None:
+        if self.file is None:
+            # Multiple runs can be appended to the same file, since gzip supports multiple members
+            self.file = gzip.open(self.path, "ab")
+        timestamp = time.perf_counter() - self.start
+        self.file.write(
+            RECORD_HEADER.pack(record_type, connection_id, timestamp, len(payload))
+            + payload
+        )
+        # Flush every record, captures are usually taken from processes which are killed rather than shut down
+        self.file.flush()
+
+
+class RecordingConnection:
+    """Wraps a real connection, writing all packets sent/received to the capture file"""
+
+    def __init__(self, connection: AsyncConnection, client: str, platform: str):
+        self.connection = connection
+        self.client = client
+        self.platform = platform
+        self.connection_id = None
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    async def write(self, packet: Packet) -> None:
+        await self.connection.write(packet)
+        self.record(RECORD_WRITE, packet)
+
+    async def read(self) -> Packet:
+        packet = await self.connection.read()
+        self.record(RECORD_READ, packet)
+        return packet
+
+    def record(self, record_type: int, packet: Packet) -> None:
+        writer = CaptureWriter()
+        if self.connection_id is None:
+            self.connection_id = writer.open_connection(self.client, self.platform)
+        writer.write(record_type, self.connection_id, redact_packet(packet))
+
+
+class ReplayIndex(metaclass=Singleton):
+    """Recorded request/response exchanges by client, platform and request"""
+
+    exchanges: Dict[Tuple[str, Optional[str], str], List[List[RecordedResponse]]]
+    positions: Dict[Tuple[str, Optional[str], str], int]
+
+    def __init__(self, path: str = config.UPSTREAM_CAPTURE_FILE):
+        self.exchanges = {}
+        self.positions = {}
+        self.load(path)
+
+    def load(self, path: str) -> None:
+        connections = {}
+        for record_type, connection_id, timestamp, payload in read_records(path):
+            if record_type == RECORD_OPEN:
+                meta = json.loads(payload)
+                packet_type = (
+                    FeslPacket if meta["client"] == "FeslApiClient" else TheaterPacket
+                )
+                connections[connection_id] = {
+                    **meta,
+                    "packet_type": packet_type,
+                    "pending": [],
+                    "responses": None,
+                    "last": timestamp,
+                }
+                continue
+
+            connection = connections[connection_id]
+            packet = connection["packet_type"](payload[:12], payload[12:])
+            if record_type == RECORD_WRITE:
+                if not is_auto_response(packet):
+                    connection["pending"].append(packet)
+            elif len(connection["pending"]) > 0:
+                # First packet read after sending a request starts a new exchange
+                digest = get_request_digest(connection["pending"])
+                connection["responses"] = []
+                # Also index exchange without platform, since some requests (e.g. lookups) are sent via any platform
+                for platform in [connection["platform"], None]:
+                    self.exchanges.setdefault(
+                        (connection["client"], platform, digest), []
+                    ).append(connection["responses"])
+                connection["pending"] = []
+                connection["responses"].append(
+                    (timestamp - connection["last"], payload)
+                )
+            elif connection["responses"] is not None:
+                # Further packets belong to the current exchange (multi-packet responses, prompts)
+                connection["responses"].append(
+                    (timestamp - connection["last"], payload)
+                )
+            connection["last"] = timestamp
+
+    def get_responses(
+        self, client: str, platform: str, request: List[Packet]
+    ) -> Optional[List[RecordedResponse]]:
+        digest = get_request_digest(request)
+        key = (client, platform, digest)
+        if key not in self.exchanges:
+            key = (client, None, digest)
+        exchanges = self.exchanges.get(key)
+        if exchanges is None:
+            return None
+
+        # Cycle through all recordings of a request, so (e.g.) server list changes are replayed as well
+        position = self.positions.get(key, 0)
+        self.positions[key] = position + 1
+        return exchanges[position % len(exchanges)]
+
+
+class ReplayConnection:
+    """Stands in for a real connection, serving responses from a capture file"""
+
+    def __init__(
+        self,
+        client: str,
+        platform: str,
+        packet_type: Type[Packet],
+        host: str,
+        port: int,
+        timeout: float,
+    ):
+        self.client = client
+        self.platform = platform
+        self.packet_type = packet_type
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.is_connected = False
+        self.pending: List[Packet] = []
+        self.responses: Deque[RecordedResponse] = deque()
+
+    async def connect(self) -> None:
+        self.is_connected = True
+
+    async def write(self, packet: Packet) -> None:
+        self.is_connected = True
+        if not is_auto_response(packet):
+            self.pending.append(packet)
+
+    async def read(self) -> Packet:
+        if len(self.pending) > 0:
+            tid = self.pending[-1].get_tid()
+            responses = ReplayIndex().get_responses(
+                self.client, self.platform, self.pending
+            )
+            self.pending = []
+            if responses is None:
+                raise pybfbc2stats.ConnectionError(
+                    "Capture does not contain a response to request"
+                )
+            self.responses = deque(
+                (delay, set_response_tid(self.packet_type(raw[:12], raw[12:]), tid))
+                for (delay, raw) in responses
+            )
+
+        if len(self.responses) == 0:
+            raise pybfbc2stats.TimeoutError("Capture does not contain any more data")
+
+        delay, packet = self.responses.popleft()
+        if config.UPSTREAM_REPLAY_SPEED > 0:
+            await asyncio.sleep(delay / config.UPSTREAM_REPLAY_SPEED)
+        return packet
+
+    async def close(self) -> bool:
+        self.is_connected = False
+        self.responses.clear()
+        return True
+
+
+def setup_transport(client: AsyncClient, client_name: str, platform: str) -> None:
+    """Set up connection of given client for recording/replaying upstream traffic (if enabled)"""
+    if config.UPSTREAM_CAPTURE_MODE == "record":
+        client.connection = RecordingConnection(
+            client.connection, client_name, platform
+        )
+    elif config.UPSTREAM_CAPTURE_MODE == "replay":
+        connection = client.connection
+        client.connection = ReplayConnection(
+            client_name,
+            platform,
+            connection.packet_type,
+            connection.host,
+            connection.port,
+            connection.timeout,
+        )
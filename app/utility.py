@@ -1,13 +1,26 @@
+import json
 import re
-from typing import Optional, Any
+from typing import Optional, Any, List, Tuple, Dict
 from urllib.parse import unquote
 
-from fastapi.responses import JSONResponse
+import pybfbc2stats
+from fastapi.responses import JSONResponse, Response
 
 from app import config
-from app.constants import THEATER_DIRTY_STR_KEYS
+from app.constants import THEATER_DIRTY_STR_KEYS, IdentifierType
+from app.timing import timed
 
 NO_INDEX_KEY_REGEX = re.compile(r"^(.*?)(?:\d+)?$")
+# Actions to take for keys of Theater server details, determined once per distinct key
+SERVER_KEY_DROP = 0
+SERVER_KEY_CLEAN = 1
+SERVER_KEY_KEEP = 2
+SERVER_KEY_ACTIONS: Dict[str, int] = {}
+# Keys to keep/clean by the (ordered) keys of a raw server, player data keys make the number of distinct shapes vary
+SERVER_CLEANING_PLANS: Dict[
+    Tuple[str, ...], Tuple[Tuple[str, ...], Tuple[str, ...]]
+] = {}
+SERVER_CLEANING_PLANS_MAX_SIZE = 1024
 
 
 class CacheableJSONResponse(JSONResponse):
@@ -25,26 +38,87 @@ class CacheableJSONResponse(JSONResponse):
 
         super().__init__(content=content, headers=response_headers)
 
+    def render(self, content: Any) -> bytes:
+        with timed("serialize"):
+            return super().render(content)
+
+
+class SnapshotResponse(Response):
+    """Serves an already serialized JSON body (e.g. a memory-mapped server snapshot) as is"""
+
+    media_type = "application/json"
+
+    def __init__(
+        self,
+        content: memoryview,
+        etag: str,
+        headers: Optional[Dict[str, str]] = None,
+        max_age: int = config.CACHE_MAX_AGE_DEFAULT,
+        not_modified: bool = False,
+    ):
+        response_headers = {"Cache-Control": f"public, max-age={max_age}", "ETag": etag}
+        if isinstance(headers, dict):
+            response_headers = {**response_headers, **headers}
+
+        if not_modified:
+            super().__init__(status_code=304, headers=response_headers)
+        else:
+            super().__init__(content=content, headers=response_headers)
+
+    def render(self, content: Any) -> bytes:
+        if content is None:
+            return b""
+        # The http middlewares only pass on bytes, so copy the body once (instead of parsing/serializing it)
+        return content.tobytes()
+
 
 def clean_string_value(persona_name: str) -> str:
     return unquote(persona_name.replace('"', ""))
 
 
+def classify_server_key(key: str) -> int:
+    action = SERVER_KEY_ACTIONS.get(key)
+    if action is None:
+        if key.startswith("D-pdat") or key in ["TID"]:
+            # Remove pdat entries (which seem to contain encoded player IPs) as well as irrelevant ids
+            action = SERVER_KEY_DROP
+        elif NO_INDEX_KEY_REGEX.sub("\\1", key) in THEATER_DIRTY_STR_KEYS:
+            # Some keys contain trailing index indicators (e.g. D-ServerDescription0)
+            # => remove index and check if key is in "dirty" list
+            action = SERVER_KEY_CLEAN
+        else:
+            action = SERVER_KEY_KEEP
+        SERVER_KEY_ACTIONS[key] = action
+
+    return action
+
+
+def get_server_cleaning_plan(
+    shape: Tuple[str, ...]
+) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """Get keys to keep and keys to clean up for servers with the given keys"""
+    plan = SERVER_CLEANING_PLANS.get(shape)
+    if plan is None:
+        if len(SERVER_CLEANING_PLANS) >= SERVER_CLEANING_PLANS_MAX_SIZE:
+            SERVER_CLEANING_PLANS.clear()
+        actions = [(key, classify_server_key(key)) for key in shape]
+        plan = (
+            tuple(key for (key, action) in actions if action != SERVER_KEY_DROP),
+            tuple(key for (key, action) in actions if action == SERVER_KEY_CLEAN),
+        )
+        SERVER_CLEANING_PLANS[shape] = plan
+
+    return plan
+
+
 def clean_server_details(raw_server: dict) -> dict:
-    # Remove pdat entries (which seem to contain encoded player IPs) as well as irrelevant ids
-    server = {
-        key: value
-        for (key, value) in raw_server.items()
-        if not key.startswith("D-pdat") and key not in ["TID"]
-    }
+    # Servers from the same source share the same keys, so the plan is usually taken from cache
+    keep, dirty = get_server_cleaning_plan(tuple(raw_server))
+    server = {key: raw_server[key] for key in keep}
 
     # Clean up "dirty" string values
-    for key, value in server.items():
-        # Some keys contain trailing index indicators (e.g. D-ServerDescription0)
-        # => remove index and check if key is in "dirty" list
-        non_index_key = NO_INDEX_KEY_REGEX.sub("\\1", key)
-        if non_index_key in THEATER_DIRTY_STR_KEYS:
-            server[key] = clean_string_value(value)
+    for key in dirty:
+        server[key] = clean_string_value(server[key])
 
     # Clean up player list (if present)
     if "D-Players" in server and isinstance(server["D-Players"], list):
@@ -54,3 +128,65 @@ def clean_server_details(raw_server: dict) -> dict:
         ]
 
     return server
+
+
+def format_leaderboard(parsed_response: List[dict]) -> List[dict]:
+    # Turn sub lists into dicts
+    leaderboard = [
+        {
+            key: pybfbc2stats.AsyncFeslClient.dict_list_to_dict(value)
+            if isinstance(value, list)
+            else value
+            for (key, value) in persona.items()
+        }
+        for persona in parsed_response
+    ]
+
+    # Cleanup usernames
+    for persona in leaderboard:
+        persona["name"] = clean_string_value(persona["name"])
+
+    return leaderboard
+
+
+def get_identifiers_to_lookup(
+    identifiers: List[str],
+    identifier_type: IdentifierType,
+    personas_from_cache: List[dict],
+) -> List[str]:
+    if 0 < len(personas_from_cache) < len(identifiers):
+        # Some personas were found in cache, determine which identifiers still need to be looked up
+        if identifier_type == IdentifierType.playerName:
+            return list(
+                set(identifiers)
+                - set([fc["name"].lower() for fc in personas_from_cache])
+            )
+        else:
+            return list(
+                set(identifiers) - set([str(fc["pid"]) for fc in personas_from_cache])
+            )
+    elif len(personas_from_cache) == 0:
+        # None of the personas was found in cache, look all up now
+        return identifiers
+
+    return []
+
+
+def get_persona_cache_mappings(
+    personas: List[dict],
+) -> Tuple[Dict[str, str], Dict[str, str]]:
+    # Create cacheable mapping dicts
+    name_keyed_mapping = {
+        f'persona:{persona["namespace"]}:{IdentifierType.playerName}:{persona["name"].lower()}': json.dumps(
+            persona
+        )
+        for persona in personas
+    }
+    id_keyed_mapping = {
+        f'persona:{persona["namespace"]}:{IdentifierType.playerId}:{persona["pid"]}': json.dumps(
+            persona
+        )
+        for persona in personas
+    }
+
+    return name_keyed_mapping, id_keyed_mapping
@@ -0,0 +1,909 @@
+"""
+Local stand-in for the FESL and Theater backends, implementing the packets pybfbc2stats sends on behalf of the API
+(hello/login, persona lookups and search, stats, leaderboards, lobby and server lists as well as server details).
+
+Personas are taken from tests/players/bfbc2.json, stats and servers are generated deterministically. Players are
+re-distributed across servers every --rotation-interval seconds, so server lists change like they do in production.
+
+Run from the repository root and point the API at the fake FESL backend (Theater details are provided by FESL):
+    python tests/fake_backend.py --latency 0.05 --jitter 0.02 --error-rate 0.01
+    FESL_HOST=127.0.0.1 FESL_PORT=18321 CLIENT_USERNAME=fake CLIENT_PASSWORD=fake uvicorn app.main:app
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import ssl
+import subprocess
+import tempfile
+import time
+import zlib
+from base64 import b64decode, b64encode
+from typing import Dict, List, Optional, Tuple, Type
+from urllib.parse import quote, unquote, unquote_to_bytes, quote_from_bytes
+
+from pybfbc2stats import Error
+from pybfbc2stats.constants import (
+    HEADER_LENGTH,
+    FeslTransmissionType,
+    TheaterTransmissionType,
+)
+from pybfbc2stats.packet import Packet, FeslPacket, TheaterPacket
+
+PLAYERS_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "players", "bfbc2.json"
+)
+# FESL identifies the platform by the client string sent with the hello packet
+CLIENT_STRING_NAMESPACES = {
+    "bfbc2-pc": "battlefield",
+    "bfbc2-ps3": "ps3",
+    "bfbc2-360": "xbox",
+}
+LOBBY_ID = 257
+FIRST_GAME_ID = 100000
+MAPS = [
+    "levels/mp_001",
+    "levels/mp_002",
+    "levels/mp_003",
+    "levels/mp_004",
+    "levels/mp_005",
+    "levels/mp_006",
+    "levels/mp_007",
+    "levels/mp_008",
+    "levels/mp_009gr",
+    "levels/mp_012gr",
+    "levels/bc1_oasis_gr",
+    "levels/nelson_bay",
+    "levels/mp_sp_002gr",
+    "levels/mp_sp_005",
+]
+GAME_MODES = ["CONQUEST", "RUSH", "SQRUSH", "SQDM"]
+SERVER_NAME_WORDS = [
+    "Hardcore",
+    "Rush",
+    "Conquest",
+    "Clan",
+    "Noob",
+    "Friendly",
+    "Vehicles",
+    "Infantry",
+    "Only",
+    "No",
+    "Rules",
+    "EU",
+    "US",
+    "Fast",
+    "Respawn",
+    "Server",
+    "Community",
+    "Tactical",
+    "Snipers",
+]
+# NuSearchOwners fails with error 104 if a search matches no or too many personas
+SEARCH_MAX_RESULTS = 50
+# Size of raw data per packet of a multi-packet response (multiple of 3 to avoid base64 padding)
+RESPONSE_CHUNK_SIZE = 6144
+
+
+class Faults:
+    """Latency and error injection applied before answering any request"""
+
+    latency: float
+    jitter: float
+    error_rate: float
+    stall_rate: float
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        stall_rate: float = 0.0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+
+    async def apply(self) -> Optional[str]:
+        """Wait for configured latency, returns the fault to inject (if any)"""
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        roll = random.random()
+        if roll < self.error_rate:
+            # Close the connection without responding
+            return "drop"
+        elif roll < self.error_rate + self.stall_rate:
+            # Swallow the request, leaving the client to run into a timeout
+            return "stall"
+
+
+class BackendData:
+    """Deterministic personas, stats and servers shared by all connections"""
+
+    personas: Dict[str, List[dict]]
+    by_name: Dict[Tuple[str, str], dict]
+    by_id: Dict[Tuple[str, int], dict]
+    leaderboards: Dict[Tuple[str, str], List[dict]]
+    servers: Dict[str, List[dict]]
+    rotation_interval: float
+    population: Dict[str, Tuple[int, Dict[str, List[dict]], Dict[int, str]]]
+
+    def __init__(
+        self, players: List[dict], server_count: int, rotation_interval: float
+    ):
+        self.personas = {
+            namespace: [] for namespace in CLIENT_STRING_NAMESPACES.values()
+        }
+        self.by_name = {}
+        self.by_id = {}
+        for player in players:
+            persona = {
+                "pid": player["pid"],
+                "name": player["name"],
+                "namespace": player["namespace"],
+                "oid": zlib.crc32(player["name"].encode("utf8")) % 1000000000
+                + 1000000000,
+            }
+            self.personas.setdefault(persona["namespace"], []).append(persona)
+            self.by_name[(persona["namespace"], persona["name"].lower())] = persona
+            self.by_id[(persona["namespace"], persona["pid"])] = persona
+        self.leaderboards = {}
+        self.servers = {
+            namespace: self.generate_servers(namespace, server_count)
+            for namespace in ["battlefield", "ps3"]
+        }
+        self.rotation_interval = rotation_interval
+        self.population = {}
+
+    @staticmethod
+    def generate_servers(namespace: str, server_count: int) -> List[dict]:
+        rng = random.Random(namespace)
+        servers = []
+        for i in range(server_count):
+            name = " ".join(rng.sample(SERVER_NAME_WORDS, rng.randint(2, 5)))
+            servers.append(
+                {
+                    "LID": str(LOBBY_ID),
+                    "GID": str(FIRST_GAME_ID + i),
+                    "HN": f"bfbc2.server.p{i}",
+                    "HU": str(rng.randint(1000000, 9999999)),
+                    "N": f'"[FAKE] {name} #{i}"',
+                    "I": f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}",
+                    "P": str(19567 + i % 10),
+                    "JP": "0",
+                    "QP": "0",
+                    "MP": str(rng.choice([16, 24, 32])),
+                    "PL": "PC" if namespace == "battlefield" else "PS3",
+                    "PW": "0",
+                    "TYPE": "G",
+                    "J": "O",
+                    "B-version": "ROMEPC795745",
+                    "B-numObservers": "0",
+                    "B-maxObservers": "0",
+                    "B-U-level": rng.choice(MAPS),
+                    "B-U-gamemode": rng.choice(GAME_MODES),
+                    "B-U-Hardcore": str(rng.randint(0, 1)),
+                    "B-U-HasPassword": "0",
+                    "B-U-Punkbuster": "1",
+                    "B-U-EA": "0",
+                    "B-U-Softcore": "0",
+                    "B-U-public": "1",
+                    "B-U-region": rng.choice(["EU", "NA", "AS"]),
+                    "B-U-elo": str(rng.randint(1000, 2000)),
+                    "B-U-Provider": '"Fake"',
+                    "B-U-PunkBusterVersion": '"v1.905 | A1386 C2.279"',
+                    "B-U-Time": '"T%3a0.00 S%3a 9.81 L%3a 0.00"',
+                    "B-U-QueueLength": "0",
+                    "D-AutoBalance": "1",
+                    "D-Crosshair": "1",
+                    "D-FriendlyFire": "0.0000",
+                    "D-KillCam": "1",
+                    "D-Minimap": "1",
+                    "D-MinimapSpotting": "1",
+                    "D-ServerDescriptionCount": "1",
+                    "D-ServerDescription0": f'"Fake server {i} for local benchmarks"',
+                    "D-BannerUrl": '"http%3a//example.com/banner.png"',
+                    "D-ThirdPersonVehicleCameras": "1",
+                    "D-ThreeDSpotting": "1",
+                    "UGID": f"{rng.getrandbits(64):016x}",
+                }
+            )
+
+        return servers
+
+    @staticmethod
+    def get_stat_value(pid: int, key: str) -> str:
+        return f'{zlib.crc32(f"{pid}:{key}".encode("utf8")) % 100000}.0'
+
+    def get_leaderboard(self, namespace: str, key: str) -> List[dict]:
+        if (namespace, key) not in self.leaderboards:
+            self.leaderboards[(namespace, key)] = sorted(
+                self.personas.get(namespace, []),
+                key=lambda p: float(self.get_stat_value(p["pid"], key)),
+                reverse=True,
+            )
+
+        return self.leaderboards[(namespace, key)]
+
+    def search(self, namespace: str, screen_name: str) -> List[dict]:
+        # Only trailing wildcards are supported by FESL
+        prefix = screen_name.rstrip("*").lower()
+        return [
+            p
+            for p in self.personas.get(namespace, [])
+            if p["name"].lower().startswith(prefix)
+        ]
+
+    def get_population(
+        self, namespace: str
+    ) -> Tuple[Dict[str, List[dict]], Dict[int, str]]:
+        """Get players per server (by game id) and server per player (by persona id) for the current rotation"""
+        rotation = (
+            int(time.time() // self.rotation_interval)
+            if self.rotation_interval > 0
+            else 0
+        )
+        if (
+            namespace not in self.population
+            or self.population[namespace][0] != rotation
+        ):
+            rng = random.Random(f"{namespace}:{rotation}")
+            available = list(self.personas.get(namespace, []))
+            rng.shuffle(available)
+            players, servers = {}, {}
+            for server in self.servers[namespace]:
+                count = min(rng.randint(0, int(server["MP"])), len(available))
+                players[server["GID"]] = [available.pop() for _ in range(count)]
+                servers.update(
+                    {p["pid"]: server["GID"] for p in players[server["GID"]]}
+                )
+            self.population[namespace] = (rotation, players, servers)
+
+        _, players, servers = self.population[namespace]
+        return players, servers
+
+
+def parse_fields(data: bytes) -> Dict[str, str]:
+    fields = {}
+    for line in data.split(b"\n"):
+        key, sep, value = line.partition(b"=")
+        if sep:
+            fields[key.decode("utf8", "replace")] = value.decode("utf8", "replace")
+
+    return fields
+
+
+def parse_list(fields: Dict[str, str], prefix: str) -> List[Dict[str, str]]:
+    count = int(fields.get(f"{prefix}.[]", 0))
+    entries = [{} for _ in range(count)]
+    for key, value in fields.items():
+        if not key.startswith(f"{prefix}.") or key.endswith(".[]"):
+            continue
+        index, _, entry_key = key[len(prefix) + 1 :].partition(".")
+        if index.isdigit() and int(index) < count:
+            entries[int(index)][entry_key] = value
+
+    return entries
+
+
+def parse_list_values(fields: Dict[str, str], prefix: str) -> List[str]:
+    count = int(fields.get(f"{prefix}.[]", 0))
+    return [fields[f"{prefix}.{i}"] for i in range(count) if f"{prefix}.{i}" in fields]
+
+
+def build_body(fields: List[Tuple[str, object]]) -> bytes:
+    return "\n".join(f"{key}={value}" for (key, value) in fields).encode("utf8")
+
+
+def build_list(
+    prefix: str, entries: List[List[Tuple[str, object]]]
+) -> List[Tuple[str, object]]:
+    fields = []
+    for index, entry in enumerate(entries):
+        fields.extend((f"{prefix}.{index}.{key}", value) for (key, value) in entry)
+    fields.append((f"{prefix}.[]", len(entries)))
+    return fields
+
+
+async def read_packet(
+    reader: asyncio.StreamReader, packet_type: Type[Packet]
+) -> Optional[Packet]:
+    try:
+        packet = packet_type(await reader.readexactly(HEADER_LENGTH))
+        packet.body = await reader.readexactly(packet.indicated_body_length())
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    packet.validate()
+    return packet
+
+
+class FeslHandler:
+    data: BackendData
+    faults: Faults
+    theater_host: str
+    theater_port: int
+    rejected_accounts: List[str]
+
+    def __init__(
+        self,
+        data: BackendData,
+        faults: Faults,
+        theater_host: str,
+        theater_port: int,
+        rejected_accounts: Optional[List[str]] = None,
+    ):
+        self.data = data
+        self.faults = faults
+        self.rejected_accounts = rejected_accounts or []
+        self.theater_host = theater_host
+        self.theater_port = theater_port
+
+    async def __call__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        namespace = "battlefield"
+        chunks: Dict[int, bytes] = {}
+        try:
+            while (packet := await read_packet(reader, FeslPacket)) is not None:
+                transmission_type = packet.get_transmission_type()
+                if transmission_type is FeslTransmissionType.MultiPacketRequest:
+                    # Re-assemble chunked (stats) queries before handling them
+                    chunk = parse_fields(packet.get_data())
+                    tid = packet.get_tid()
+                    chunks[tid] = chunks.get(tid, b"") + unquote_to_bytes(chunk["data"])
+                    if len(chunks[tid]) < int(chunk["size"]):
+                        continue
+                    fields = parse_fields(b64decode(chunks.pop(tid)))
+                elif transmission_type is FeslTransmissionType.SinglePacketRequest:
+                    fields = parse_fields(packet.get_data())
+                else:
+                    # Memcheck/ping replies do not require a response
+                    continue
+
+                txn = fields.get("TXN")
+                if txn == "Hello":
+                    namespace = CLIENT_STRING_NAMESPACES.get(
+                        fields.get("clientString"), namespace
+                    )
+
+                fault = await self.faults.apply()
+                if fault == "drop":
+                    break
+                elif fault == "stall":
+                    continue
+
+                for response in self.handle(
+                    packet.header[:4], packet.get_tid(), txn, fields, namespace
+                ):
+                    writer.write(bytes(response))
+                await writer.drain()
+
+                if txn == "Goodbye":
+                    break
+        except (Error, ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
+
+    def handle(
+        self, stub: bytes, tid: int, txn: str, fields: Dict[str, str], namespace: str
+    ) -> List[FeslPacket]:
+        if txn == "Hello":
+            body = build_body(
+                [
+                    ("TXN", "Hello"),
+                    ("domainPartition.domain", "eagames"),
+                    ("domainPartition.subDomain", "BFBC2"),
+                    ("messengerIp", "messaging.ea.com"),
+                    ("messengerPort", 13505),
+                    ("theaterIp", self.theater_host),
+                    ("theaterPort", self.theater_port),
+                    ("activityTimeoutSecs", 3600),
+                    ("curTime", f'"{time.strftime("%b-%d-%Y %H%%3a%M%%3a%S UTC")}"'),
+                ]
+            )
+            return [
+                self.build(stub, body, tid),
+                # Hello is followed by an initial memcheck which the client has to reply to
+                FeslPacket.build(
+                    b"fsys",
+                    b"TXN=MemCheck\nmemcheck.[]=0\ntype=0\nsalt=5",
+                    FeslTransmissionType.SinglePacketRequest,
+                ),
+            ]
+        elif txn == "Login" and fields.get("name") in self.rejected_accounts:
+            body = build_body(
+                [
+                    ("TXN", "Login"),
+                    ("errorCode", 122),
+                    (
+                        "localizedMessage",
+                        '"The password the user specified is incorrect"',
+                    ),
+                ]
+            )
+            return [self.build(stub, body, tid)]
+        elif txn == "Login":
+            body = build_body(
+                [
+                    ("TXN", "Login"),
+                    ("lkey", f"{random.getrandbits(96):024x}."),
+                    ("nuid", fields.get("name", "")),
+                    ("profileId", 1),
+                    ("userId", 1),
+                    ("displayName", fields.get("name", "")),
+                ]
+            )
+            return [self.build(stub, body, tid)]
+        elif txn == "Goodbye":
+            return [self.build(stub, b"TXN=Goodbye", tid)]
+        elif txn == "NuLookupUserInfo":
+            return [self.build(stub, self.lookup(fields), tid)]
+        elif txn == "NuSearchOwners":
+            return [self.build(stub, self.search(fields), tid)]
+        elif txn == "GetStats":
+            return self.build_multi(stub, self.get_stats(fields), tid)
+        elif txn == "GetTopNAndStats":
+            return self.build_multi(stub, self.get_leaderboard(fields, namespace), tid)
+
+        return [self.build(stub, build_body([("TXN", txn), ("errorCode", 21)]), tid)]
+
+    def lookup(self, fields: Dict[str, str]) -> bytes:
+        entries = []
+        for query in parse_list(fields, "userInfo"):
+            namespace = query.get("namespace", "")
+            if "userName" in query:
+                persona = self.data.by_name.get(
+                    (namespace, unquote(query["userName"]).lower())
+                )
+            else:
+                persona = self.data.by_id.get((namespace, int(query.get("userId", 0))))
+
+            if persona is None:
+                # Unknown personas are echoed back without any ids
+                entries.append([(key, value) for (key, value) in query.items()])
+                continue
+
+            entry = [
+                ("userName", quote(persona["name"])),
+                ("userId", persona["pid"]),
+                ("masterUserId", persona["oid"]),
+                ("namespace", namespace),
+            ]
+            if namespace == "xbox":
+                entry.append(("xuid", persona["pid"] + 2533274790395904))
+            entries.append(entry)
+
+        return build_body(
+            [("TXN", "NuLookupUserInfo"), *build_list("userInfo", entries)]
+        )
+
+    def search(self, fields: Dict[str, str]) -> bytes:
+        namespace = fields.get("nameSpaceId", "")
+        results = self.data.search(namespace, unquote(fields.get("screenName", "")))
+        if len(results) == 0 or len(results) > SEARCH_MAX_RESULTS:
+            return build_body(
+                [
+                    ("TXN", "NuSearchOwners"),
+                    ("errorContainer.[]", 0),
+                    ("errorCode", 104),
+                    (
+                        "localizedMessage",
+                        '"The data necessary for this transaction was not found"',
+                    ),
+                ]
+            )
+
+        entries = [
+            [("id", p["pid"]), ("name", quote(p["name"])), ("type", 1)] for p in results
+        ]
+        return build_body(
+            [
+                ("TXN", "NuSearchOwners"),
+                *build_list("users", entries),
+                ("nameSpaceId", namespace),
+            ]
+        )
+
+    def get_stats(self, fields: Dict[str, str]) -> bytes:
+        owner = int(fields.get("owner", 0))
+        entries = [
+            [("key", key), ("value", self.data.get_stat_value(owner, key))]
+            for key in parse_list_values(fields, "keys")
+        ]
+        return build_body(
+            [
+                ("TXN", "GetStats"),
+                ("ownerId", owner),
+                ("ownerType", 1),
+                *build_list("stats", entries),
+            ]
+        )
+
+    def get_leaderboard(self, fields: Dict[str, str], namespace: str) -> bytes:
+        key = fields.get("key", "score")
+        min_rank, max_rank = int(fields.get("minRank", 1)), int(
+            fields.get("maxRank", 50)
+        )
+        add_keys = parse_list_values(fields, "keys")
+        leaderboard = self.data.get_leaderboard(namespace, key)
+
+        entries = []
+        for rank in range(max(min_rank, 1), min(max_rank, len(leaderboard)) + 1):
+            persona = leaderboard[rank - 1]
+            entry = [
+                ("owner", persona["pid"]),
+                ("name", quote(persona["name"])),
+                ("rank", rank),
+                ("value", self.data.get_stat_value(persona["pid"], key)),
+            ]
+            for index, add_key in enumerate(add_keys):
+                entry.append((f"addStats.{index}.key", add_key))
+                entry.append(
+                    (
+                        f"addStats.{index}.value",
+                        self.data.get_stat_value(persona["pid"], add_key),
+                    )
+                )
+            entry.append(("addStats.[]", len(add_keys)))
+            entries.append(entry)
+
+        return build_body([("TXN", "GetTopNAndStats"), *build_list("stats", entries)])
+
+    @staticmethod
+    def build(stub: bytes, body: bytes, tid: int) -> FeslPacket:
+        return FeslPacket.build(
+            stub, body, FeslTransmissionType.SinglePacketResponse, tid
+        )
+
+    @staticmethod
+    def build_multi(stub: bytes, body: bytes, tid: int) -> List[FeslPacket]:
+        # Last chunk is marked by a trailing null byte
+        data = body + b"\x00"
+        packets = []
+        for i in range(0, len(data), RESPONSE_CHUNK_SIZE):
+            chunk = b64encode(data[i : i + RESPONSE_CHUNK_SIZE])
+            packets.append(
+                FeslPacket.build(
+                    stub,
+                    b"size="
+                    + str(len(chunk)).encode("utf8")
+                    + b"\ndata="
+                    + quote_from_bytes(chunk).encode("utf8"),
+                    FeslTransmissionType.MultiPacketResponse,
+                    tid,
+                )
+            )
+
+        return packets
+
+
+class TheaterHandler:
+    data: BackendData
+    faults: Faults
+
+    def __init__(self, data: BackendData, faults: Faults):
+        self.data = data
+        self.faults = faults
+
+    async def __call__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        namespace = "battlefield"
+        try:
+            while (packet := await read_packet(reader, TheaterPacket)) is not None:
+                stub = packet.header[:4]
+                if stub == b"PING":
+                    continue
+
+                fields = parse_fields(packet.get_data())
+                if stub == b"CONN":
+                    namespace = CLIENT_STRING_NAMESPACES.get(
+                        fields.get("PROD"), namespace
+                    )
+                    # Theater does not host console servers other than ps3 ones
+                    namespace = (
+                        namespace if namespace in self.data.servers else "battlefield"
+                    )
+
+                fault = await self.faults.apply()
+                if fault == "drop":
+                    break
+                elif fault == "stall":
+                    continue
+
+                for response in self.handle(stub, packet.get_tid(), fields, namespace):
+                    writer.write(bytes(response))
+                await writer.drain()
+        except (Error, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def handle(
+        self, stub: bytes, tid: int, fields: Dict[str, str], namespace: str
+    ) -> List[TheaterPacket]:
+        if stub == b"CONN":
+            return [
+                self.build(
+                    b"CONN",
+                    [
+                        ("TIME", int(time.time())),
+                        ("activityTimeoutSecs", 240),
+                        ("PROT", 2),
+                    ],
+                    tid,
+                )
+            ]
+        elif stub == b"USER":
+            return [self.build(b"USER", [("NAME", "fake"), ("CID", "")], tid)]
+        elif stub == b"LLST":
+            return [
+                self.build(b"LLST", [("NUM-LOBBIES", 1)], tid),
+                self.build(
+                    b"LDAT",
+                    [
+                        ("FAVORITE-GAMES", 0),
+                        ("FAVORITE-PLAYERS", 0),
+                        ("LID", LOBBY_ID),
+                        ("LOCALE", "en_US"),
+                        ("MAX-GAMES", 10000),
+                        ("NAME", f'bfbc2{"PS3" if namespace == "ps3" else "PC"}01'),
+                        ("NUM-GAMES", len(self.data.servers[namespace])),
+                        ("PASSING", len(self.data.servers[namespace])),
+                    ],
+                    tid,
+                ),
+            ]
+        elif stub == b"GLST":
+            if fields.get("LID") != str(LOBBY_ID):
+                return [self.build(b"GLST", [], tid, b"nrom")]
+            players, _ = self.data.get_population(namespace)
+            servers = self.data.servers[namespace]
+            return [
+                self.build(
+                    b"GLST",
+                    [
+                        ("LID", LOBBY_ID),
+                        ("LOBBY-NUM-GAMES", len(servers)),
+                        ("LOBBY-MAX-GAMES", 10000),
+                        ("FAVORITE-GAMES", 0),
+                        ("FAVORITE-PLAYERS", 0),
+                        ("NUM-GAMES", len(servers)),
+                    ],
+                    tid,
+                ),
+                *[
+                    self.build(b"GDAT", self.get_gdat(server, players), tid)
+                    for server in servers
+                ],
+            ]
+        elif stub == b"GDAT":
+            return self.get_server_details(fields, tid, namespace)
+
+        return [self.build(stub, [], tid, b"bpar")]
+
+    def get_server_details(
+        self, fields: Dict[str, str], tid: int, namespace: str
+    ) -> List[TheaterPacket]:
+        players, player_servers = self.data.get_population(namespace)
+        if "UID" in fields:
+            game_id = (
+                player_servers.get(int(fields["UID"]))
+                if fields["UID"].isdigit()
+                else None
+            )
+            if game_id is None:
+                return [self.build(b"GDAT", [], tid, b"ntfn")]
+        elif fields.get("LID") == str(LOBBY_ID) and fields.get("GID", "").isdigit():
+            game_id = fields["GID"]
+        else:
+            game_id = None
+
+        index = int(game_id) - FIRST_GAME_ID if game_id is not None else -1
+        if not 0 <= index < len(self.data.servers[namespace]):
+            return [self.build(b"GDAT", [], tid, b"ngam")]
+
+        server = self.data.servers[namespace][index]
+        server_players = players[server["GID"]]
+        gdet = [
+            (key, value)
+            for (key, value) in server.items()
+            if key.startswith("D-") or key == "UGID"
+        ]
+        gdet.extend((f"D-pdat{i:02d}", "|0|0|0|0") for i in range(len(server_players)))
+        return [
+            self.build(b"GDAT", self.get_gdat(server, players), tid),
+            self.build(
+                b"GDET", [("LID", server["LID"]), ("GID", server["GID"]), *gdet], tid
+            ),
+            *[
+                self.build(
+                    b"PDAT",
+                    [
+                        ("NAME", quote(p["name"])),
+                        ("PID", i + 1),
+                        ("UID", p["pid"]),
+                        ("LID", server["LID"]),
+                        ("GID", server["GID"]),
+                    ],
+                    tid,
+                )
+                for (i, p) in enumerate(server_players)
+            ],
+        ]
+
+    @staticmethod
+    def get_gdat(
+        server: dict, players: Dict[str, List[dict]]
+    ) -> List[Tuple[str, object]]:
+        gdat = [
+            (key, value)
+            for (key, value) in server.items()
+            if not key.startswith("D-") and key != "UGID"
+        ]
+        gdat.append(("AP", len(players[server["GID"]])))
+        return gdat
+
+    @staticmethod
+    def build(
+        stub: bytes,
+        fields: List[Tuple[str, object]],
+        tid: int,
+        error: Optional[bytes] = None,
+    ) -> TheaterPacket:
+        packet = TheaterPacket.build(
+            stub, build_body(fields), TheaterTransmissionType.OKResponse, tid
+        )
+        if error is not None:
+            # Theater indicates errors in the header rather than the body
+            packet.header = stub + error + packet.header[8:]
+        return packet
+
+
+def create_ssl_context(
+    cert_file: Optional[str], key_file: Optional[str]
+) -> ssl.SSLContext:
+    if cert_file is None or key_file is None:
+        # Generate a throwaway self-signed certificate (clients do not verify the certificate anyway)
+        directory = tempfile.mkdtemp(prefix="fake-fesl-")
+        cert_file, key_file = os.path.join(directory, "cert.pem"), os.path.join(
+            directory, "key.pem"
+        )
+        subprocess.run(
+            [
+                "openssl",
+                "req",
+                "-x509",
+                "-newkey",
+                "rsa:2048",
+                "-nodes",
+                "-days",
+                "1",
+                "-subj",
+                "/CN=localhost",
+                "-keyout",
+                key_file,
+                "-out",
+                cert_file,
+            ],
+            check=True,
+            capture_output=True,
+        )
+
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_file, key_file)
+    return context
+
+
+async def serve(
+    host: str,
+    fesl_port: int,
+    theater_port: int,
+    data: BackendData,
+    faults: Faults,
+    rejected_accounts: List[str],
+    ssl_context: ssl.SSLContext,
+) -> None:
+    fesl_server = await asyncio.start_server(
+        FeslHandler(data, faults, host, theater_port, rejected_accounts),
+        host,
+        fesl_port,
+        ssl=ssl_context,
+    )
+    theater_server = await asyncio.start_server(
+        TheaterHandler(data, faults), host, theater_port
+    )
+    print(
+        f"FESL listening on {host}:{fesl_port}, Theater listening on {host}:{theater_port}",
+        flush=True,
+    )
+    async with fesl_server, theater_server:
+        await asyncio.gather(
+            fesl_server.serve_forever(), theater_server.serve_forever()
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser("Run a local fake FESL/Theater backend")
+    parser.add_argument("--host", help="Address to listen on", default="127.0.0.1")
+    parser.add_argument(
+        "--fesl-port",
+        help="Port to accept FESL (TLS) connections on",
+        type=int,
+        default=18321,
+    )
+    parser.add_argument(
+        "--theater-port",
+        help="Port to accept Theater connections on",
+        type=int,
+        default=18326,
+    )
+    parser.add_argument(
+        "--players", help="Player list to serve personas from", default=PLAYERS_FILE
+    )
+    parser.add_argument(
+        "--servers", help="Number of servers per platform", type=int, default=150
+    )
+    parser.add_argument(
+        "--rotation-interval",
+        help="Seconds after which players switch servers",
+        type=float,
+        default=60.0,
+    )
+    parser.add_argument(
+        "--latency", help="Seconds to wait before responding", type=float, default=0.0
+    )
+    parser.add_argument(
+        "--jitter",
+        help="Maximum random seconds added to latency",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--error-rate",
+        help="Share of requests answered by closing the connection",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--stall-rate", help="Share of requests never answered", type=float, default=0.0
+    )
+    parser.add_argument(
+        "--reject-accounts", help="Usernames to reject logins of", nargs="*", default=[]
+    )
+    parser.add_argument(
+        "--cert", help="TLS certificate to use for FESL (generated if not given)"
+    )
+    parser.add_argument(
+        "--key", help="TLS key to use for FESL (generated if not given)"
+    )
+    args = parser.parse_args()
+
+    with open(args.players, "r") as player_file:
+        players = [p for p in json.load(player_file) if p["game"] == "bfbc2"]
+
+    data = BackendData(players, args.servers, args.rotation_interval)
+    faults = Faults(args.latency, args.jitter, args.error_rate, args.stall_rate)
+    ssl_context = create_ssl_context(args.cert, args.key)
+    try:
+        asyncio.run(
+            serve(
+                args.host,
+                args.fesl_port,
+                args.theater_port,
+                data,
+                faults,
+                args.reject_accounts,
+                ssl_context,
+            )
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+"""
+Load benchmark driving the API with a realistic request mix generated from tests/players.
+
+Unless --base-url is given, the fake backend (tests/fake_backend.py) and the API (uvicorn) are started as subprocesses,
+with the API pointed at the fake backend. The API still needs a Redis instance, configured via the usual REDIS_* vars.
+Run from the repository root:
+    python tests/load_benchmark.py --concurrency 50 --duration 60 --latency 0.05 --error-rate 0.01
+    python tests/load_benchmark.py --base-url http://localhost:8000 --requests 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from statistics import quantiles
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import httpx
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PLAYERS_FILE = os.path.join(TESTS_DIR, "players", "bfbc2.json")
+NAMESPACE_PLATFORMS = {"battlefield": "pc", "ps3": "ps3"}
+# Share of persona lookups for names/ids that do not exist
+UNKNOWN_PERSONA_RATE = 0.05
+
+# (method, path, json body), path is used as is, endpoint is the route template it belongs to
+Request = Tuple[str, str, Optional[list]]
+
+
+@dataclass
+class EndpointResults:
+    latencies: List[float] = field(default_factory=list)
+    statuses: Dict[str, int] = field(default_factory=dict)
+    errors: int = 0
+
+    def add(self, latency: float, status: str, error: bool) -> None:
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if error:
+            self.errors += 1
+
+
+class RequestMix:
+    """Weighted random requests against all data endpoints"""
+
+    rng: random.Random
+    players: Dict[str, List[dict]]
+    server_count: int
+    scenarios: List[Tuple[str, Callable[[], Request]]]
+    weights: List[int]
+
+    def __init__(self, players: List[dict], seed: int, server_count: int):
+        self.rng = random.Random(seed)
+        self.players = {}
+        for player in players:
+            self.players.setdefault(player["namespace"], []).append(player)
+        self.server_count = server_count
+
+        scenarios = [
+            (25, "/stats/{platform}/by-name/{persona_name}", self.stats_by_name),
+            (20, "/stats/{platform}/by-id/{persona_id}", self.stats_by_id),
+            (10, "/persona/{namespace}/by-name/{persona_name}", self.persona_by_name),
+            (8, "/persona/{namespace}/by-id/{persona_id}", self.persona_by_id),
+            (4, "/personas/{namespace}/by-names", self.personas_by_names),
+            (4, "/personas/{namespace}/by-ids", self.personas_by_ids),
+            (5, "/persona/{namespace}/search-name/{persona_name}", self.search),
+            (5, "/leaderboard/{platform}/{sort_by}/{page}", self.leaderboard),
+            (10, "/servers/{platform}", self.servers),
+            (6, "/servers/{platform}/{lobby_id}/{game_id}", self.server),
+            (3, "/servers/{platform}/current/by-id/{persona_id}", self.current_server),
+        ]
+        self.weights = [weight for (weight, *_) in scenarios]
+        self.scenarios = [(endpoint, build) for (_, endpoint, build) in scenarios]
+
+    def next(self) -> Tuple[str, Request]:
+        endpoint, build = self.rng.choices(self.scenarios, self.weights)[0]
+        return endpoint, build()
+
+    def pick(self) -> dict:
+        namespace = self.rng.choice(list(self.players))
+        player = self.rng.choice(self.players[namespace])
+        if self.rng.random() < UNKNOWN_PERSONA_RATE:
+            player = {
+                **player,
+                "name": f'{player["name"]}-unknown',
+                "pid": player["pid"] + 1,
+            }
+        return player
+
+    def stats_by_name(self) -> Request:
+        player = self.pick()
+        platform = NAMESPACE_PLATFORMS[player["namespace"]]
+        return (
+            "GET",
+            f'/stats/{platform}/by-name/{quote(player["name"], safe="")}',
+            None,
+        )
+
+    def stats_by_id(self) -> Request:
+        player = self.pick()
+        platform = NAMESPACE_PLATFORMS[player["namespace"]]
+        return "GET", f'/stats/{platform}/by-id/{player["pid"]}', None
+
+    def persona_by_name(self) -> Request:
+        player = self.pick()
+        return (
+            "GET",
+            f'/persona/{player["namespace"]}/by-name/{quote(player["name"], safe="")}',
+            None,
+        )
+
+    def persona_by_id(self) -> Request:
+        player = self.pick()
+        return "GET", f'/persona/{player["namespace"]}/by-id/{player["pid"]}', None
+
+    def personas_by_names(self) -> Request:
+        namespace = self.rng.choice(list(self.players))
+        players = self.rng.sample(self.players[namespace], 30)
+        return "POST", f"/personas/{namespace}/by-names", [p["name"] for p in players]
+
+    def personas_by_ids(self) -> Request:
+        namespace = self.rng.choice(list(self.players))
+        players = self.rng.sample(self.players[namespace], 30)
+        return "POST", f"/personas/{namespace}/by-ids", [p["pid"] for p in players]
+
+    def search(self) -> Request:
+        player = self.pick()
+        prefix = player["name"][: self.rng.randint(3, max(3, len(player["name"])))]
+        return (
+            "GET",
+            f'/persona/{player["namespace"]}/search-name/{quote(prefix, safe="")}',
+            None,
+        )
+
+    def leaderboard(self) -> Request:
+        platform = self.rng.choice(list(NAMESPACE_PLATFORMS.values()))
+        sort_by = self.rng.choice(["score", "kills", "time", "deaths"])
+        return (
+            "GET",
+            f"/leaderboard/{platform}/{sort_by}/{self.rng.randint(1, 5)}",
+            None,
+        )
+
+    def servers(self) -> Request:
+        platform = self.rng.choice(list(NAMESPACE_PLATFORMS.values()))
+        params = self.rng.choice(
+            [
+                "",
+                "?details=true",
+                "?mode=RUSH&sort_by=players&order=desc&limit=20",
+                "?map=mp_005&min_players=1",
+                "?name=hardcore&fields=LID,GID,N,AP,MP",
+            ]
+        )
+        return "GET", f"/servers/{platform}{params}", None
+
+    def server(self) -> Request:
+        platform = self.rng.choice(list(NAMESPACE_PLATFORMS.values()))
+        return (
+            "GET",
+            f"/servers/{platform}/257/{100000 + self.rng.randrange(self.server_count)}",
+            None,
+        )
+
+    def current_server(self) -> Request:
+        player = self.pick()
+        platform = NAMESPACE_PLATFORMS[player["namespace"]]
+        return "GET", f'/servers/{platform}/current/by-id/{player["pid"]}', None
+
+
+async def run_worker(
+    client: httpx.AsyncClient,
+    mix: RequestMix,
+    results: Dict[str, EndpointResults],
+    should_continue: Callable[[], bool],
+) -> None:
+    while should_continue():
+        endpoint, (method, path, body) = mix.next()
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, path, json=body)
+            status, error = str(response.status_code), response.status_code >= 500
+        except httpx.HTTPError as e:
+            status, error = e.__class__.__name__, True
+        results.setdefault(endpoint, EndpointResults()).add(
+            time.perf_counter() - start, status, error
+        )
+
+
+async def run_benchmark(
+    base_url: str,
+    mix: RequestMix,
+    concurrency: int,
+    total_requests: Optional[int],
+    duration: Optional[float],
+    timeout: float,
+) -> Tuple[Dict[str, EndpointResults], float]:
+    results: Dict[str, EndpointResults] = {}
+    issued = 0
+    start = time.perf_counter()
+
+    def should_continue() -> bool:
+        nonlocal issued
+        if duration is not None and time.perf_counter() - start >= duration:
+            return False
+        if total_requests is not None and issued >= total_requests:
+            return False
+        issued += 1
+        return True
+
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+    async with httpx.AsyncClient(
+        base_url=base_url, timeout=timeout, limits=limits
+    ) as client:
+        await asyncio.gather(
+            *[
+                run_worker(client, mix, results, should_continue)
+                for _ in range(concurrency)
+            ]
+        )
+
+    return results, time.perf_counter() - start
+
+
+def print_report(results: Dict[str, EndpointResults], elapsed: float) -> None:
+    columns = f'{"endpoint":<50} {"requests":>8} {"req/s":>8} {"errors":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}'
+    print(columns)
+    print("-" * len(columns))
+    all_latencies, all_errors = [], 0
+    for endpoint, result in sorted(results.items()):
+        print(format_row(endpoint, result.latencies, result.errors, elapsed))
+        all_latencies.extend(result.latencies)
+        all_errors += result.errors
+    print("-" * len(columns))
+    print(format_row("total", all_latencies, all_errors, elapsed))
+    print()
+    for endpoint, result in sorted(results.items()):
+        statuses = ", ".join(
+            f"{status}: {count}" for (status, count) in sorted(result.statuses.items())
+        )
+        print(f"{endpoint:<50} {statuses}")
+
+
+def format_row(label: str, latencies: List[float], errors: int, elapsed: float) -> str:
+    if len(latencies) > 1:
+        percentiles = quantiles(latencies, n=100, method="inclusive")
+        p50, p95, p99 = percentiles[49], percentiles[94], percentiles[98]
+    else:
+        p50 = p95 = p99 = latencies[0] if len(latencies) == 1 else 0.0
+    return (
+        f"{label:<50} {len(latencies):>8} {len(latencies) / elapsed:>8.1f} {errors:>6} "
+        f"{p50 * 1000:>8.1f} {p95 * 1000:>8.1f} {p99 * 1000:>8.1f}"
+    )
+
+
+def start_processes(args: argparse.Namespace) -> Tuple[List[subprocess.Popen], str]:
+    repository_root = os.path.dirname(TESTS_DIR)
+    backend = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(TESTS_DIR, "fake_backend.py"),
+            "--fesl-port",
+            str(args.fesl_port),
+            "--theater-port",
+            str(args.theater_port),
+            "--servers",
+            str(args.servers),
+            "--latency",
+            str(args.latency),
+            "--jitter",
+            str(args.jitter),
+            "--error-rate",
+            str(args.error_rate),
+            "--stall-rate",
+            str(args.stall_rate),
+        ]
+    )
+    env = {
+        **os.environ,
+        "FESL_HOST": "127.0.0.1",
+        "FESL_PORT": str(args.fesl_port),
+        "CLIENT_USERNAME": os.getenv("CLIENT_USERNAME", "fake"),
+        "CLIENT_PASSWORD": os.getenv("CLIENT_PASSWORD", "fake"),
+    }
+    api = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--port",
+            str(args.api_port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=repository_root,
+        env=env,
+    )
+
+    return [api, backend], f"http://127.0.0.1:{args.api_port}"
+
+
+def wait_until_ready(
+    base_url: str, processes: List[subprocess.Popen], timeout: float = 60.0
+) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if any(process.poll() is not None for process in processes):
+            raise RuntimeError("Fake backend or API exited during startup")
+        try:
+            if httpx.get(f"{base_url}/metrics", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+
+    raise RuntimeError(f"API did not become ready within {timeout} seconds")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser("Benchmark the API using a realistic request mix")
+    parser.add_argument(
+        "--base-url",
+        help="Benchmark a running API instead of starting one against the fake backend",
+    )
+    parser.add_argument(
+        "--concurrency", help="Number of concurrent clients", type=int, default=20
+    )
+    parser.add_argument("--requests", help="Total number of requests to send", type=int)
+    parser.add_argument("--duration", help="Seconds to send requests for", type=float)
+    parser.add_argument(
+        "--timeout",
+        help="Seconds after which a request is considered failed",
+        type=float,
+        default=30.0,
+    )
+    parser.add_argument("--seed", help="Seed for the request mix", type=int, default=1)
+    parser.add_argument(
+        "--players", help="Player list to generate requests from", default=PLAYERS_FILE
+    )
+    parser.add_argument(
+        "--servers", help="Number of fake servers per platform", type=int, default=150
+    )
+    parser.add_argument("--api-port", type=int, default=18000)
+    parser.add_argument("--fesl-port", type=int, default=18321)
+    parser.add_argument("--theater-port", type=int, default=18326)
+    parser.add_argument(
+        "--latency", help="Fake backend latency (seconds)", type=float, default=0.05
+    )
+    parser.add_argument(
+        "--jitter",
+        help="Fake backend latency jitter (seconds)",
+        type=float,
+        default=0.02,
+    )
+    parser.add_argument(
+        "--error-rate",
+        help="Share of fake backend requests answered by disconnecting",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--stall-rate",
+        help="Share of fake backend requests never answered",
+        type=float,
+        default=0.0,
+    )
+    args = parser.parse_args()
+
+    if args.requests is None and args.duration is None:
+        args.requests = 1000
+
+    with open(args.players, "r") as player_file:
+        players = [
+            p for p in json.load(player_file) if p["namespace"] in NAMESPACE_PLATFORMS
+        ]
+    mix = RequestMix(players, args.seed, args.servers)
+
+    processes = []
+    base_url = args.base_url
+    try:
+        if base_url is None:
+            processes, base_url = start_processes(args)
+            wait_until_ready(base_url, processes)
+
+        results, elapsed = asyncio.run(
+            run_benchmark(
+                base_url,
+                mix,
+                args.concurrency,
+                args.requests,
+                args.duration,
+                args.timeout,
+            )
+        )
+        print_report(results, elapsed)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
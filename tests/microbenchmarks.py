@@ -0,0 +1,298 @@
+"""
+Microbenchmarks for the CPU-bound response transformations (server cleaning, leaderboard reshaping,
+persona cache merging and JSON (de)serialization of large payloads), reporting time and allocations per operation.
+
+Fixtures are built from the same packets tests/fake_backend.py sends, so they match the shape of real responses.
+Run from the repository root, optionally saving results and comparing them to a previous run:
+    PYTHONPATH=. python tests/microbenchmarks.py --save before.json
+    PYTHONPATH=. python tests/microbenchmarks.py --baseline before.json --threshold 0.1
+"""
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from statistics import mean
+from typing import Any, Callable, Dict, List
+
+import pybfbc2stats
+
+from app.constants import STATS_KEY_SETS, StatsKeySet, IdentifierType
+from app.utility import (
+    clean_server_details,
+    format_leaderboard,
+    get_identifiers_to_lookup,
+    get_persona_cache_mappings,
+)
+from fake_backend import (
+    PLAYERS_FILE,
+    LOBBY_ID,
+    FIRST_GAME_ID,
+    BackendData,
+    Faults,
+    FeslHandler,
+    TheaterHandler,
+)
+
+FeslClient = pybfbc2stats.AsyncFeslClient
+# Minimum duration of a single timing round, number of loops per round is calibrated to match
+MIN_ROUND_TIME = 0.05
+
+
+def build_fixtures(server_count: int) -> Dict[str, Any]:
+    with open(PLAYERS_FILE, "r") as player_file:
+        players = json.load(player_file)
+    # Disable player rotation, so fixtures are the same for every run
+    data = BackendData(players, server_count, 0)
+    fesl = FeslHandler(data, Faults(), "127.0.0.1", 18326, [])
+    theater = TheaterHandler(data, Faults())
+
+    # Full server list as returned by GLST (one GDAT packet per server)
+    glst = theater.handle(b"GLST", 1, {"LID": str(LOBBY_ID)}, "battlefield")
+    servers = [FeslClient.parse_simple_response(packet) for packet in glst[1:]]
+
+    # Server details of (one of) the most populated servers as well as details for all servers
+    players_by_server, _ = data.get_population("battlefield")
+    game_id = max(players_by_server, key=lambda gid: len(players_by_server[gid]))
+    server = get_server_details(theater, game_id)
+    servers_with_details = [
+        clean_server_details(get_server_details(theater, str(FIRST_GAME_ID + i)))
+        for i in range(server_count)
+    ]
+
+    # Leaderboard page (50 rows) and stats for the "all" key set, as received from FESL
+    leaderboard_fields = {
+        "key": "score",
+        "minRank": "1",
+        "maxRank": "50",
+        **{
+            f"keys.{i}": key.decode()
+            for (i, key) in enumerate(pybfbc2stats.DEFAULT_LEADERBOARD_KEYS)
+        },
+        "keys.[]": str(len(pybfbc2stats.DEFAULT_LEADERBOARD_KEYS)),
+    }
+    raw_leaderboard = get_complex_response(
+        fesl.handle(b"rank", 1, "GetTopNAndStats", leaderboard_fields, "battlefield")
+    )
+    stats_keys = STATS_KEY_SETS[StatsKeySet.all]
+    stats_fields = {
+        "owner": str(players[0]["pid"]),
+        **{f"keys.{i}": key.decode() for (i, key) in enumerate(stats_keys)},
+        "keys.[]": str(len(stats_keys)),
+    }
+    raw_stats = get_complex_response(
+        fesl.handle(b"rank", 1, "GetStats", stats_fields, "battlefield")
+    )
+    parsed_stats, *_ = FeslClient.parse_list_response(raw_stats, b"stats.")
+
+    # Bulk persona lookup (30 names) with half of the personas served from cache
+    personas = [
+        {
+            "pid": p["pid"],
+            "name": p["name"],
+            "namespace": p["namespace"],
+            "oid": p["pid"],
+            "xuid": None,
+        }
+        for p in players
+        if p["namespace"] == "battlefield"
+    ][:30]
+
+    return {
+        "servers": servers,
+        "server": server,
+        "servers_with_details": servers_with_details,
+        "raw_leaderboard": raw_leaderboard,
+        "leaderboard": FeslClient.parse_list_response(raw_leaderboard, b"stats.")[0],
+        "raw_stats": raw_stats,
+        "stats": FeslClient.dict_list_to_dict(parsed_stats),
+        "persona_names": [p["name"].lower() for p in personas],
+        "cached_personas": [json.dumps(p).encode("utf8") for p in personas[:15]]
+        + [None] * 15,
+        "fesl_personas": personas[15:],
+    }
+
+
+def get_server_details(theater: TheaterHandler, game_id: str) -> dict:
+    # Combine GDAT, GDET and PDATs the same way TheaterApiClient.get_gdat does
+    gdat, gdet, *pdat = [
+        FeslClient.parse_simple_response(packet)
+        for packet in theater.handle(
+            b"GDAT", 1, {"LID": str(LOBBY_ID), "GID": game_id}, "battlefield"
+        )
+    ]
+    return {**gdat, **gdet, "D-Players": pdat}
+
+
+def get_complex_response(packets: List[pybfbc2stats.packet.Packet]) -> bytes:
+    return b"".join(
+        FeslClient.process_complex_response_packet(packet)[0] for packet in packets
+    )
+
+
+def merge_personas(
+    names: List[str], cached: List[bytes], from_fesl: List[dict]
+) -> List[dict]:
+    # Mirrors the cache merge done by get_personas for a partial cache hit
+    personas_from_cache = [json.loads(cp) for cp in cached if cp is not None]
+    get_identifiers_to_lookup(names, IdentifierType.playerName, personas_from_cache)
+    get_persona_cache_mappings(from_fesl)
+    return sorted([*personas_from_cache, *from_fesl], key=lambda d: d["name"])
+
+
+def get_benchmarks(fixtures: Dict[str, Any]) -> Dict[str, Callable[[], Any]]:
+    servers_json = json.dumps(fixtures["servers_with_details"])
+    stats_json = json.dumps(fixtures["stats"])
+    return {
+        "clean_server_details[list]": lambda: [
+            clean_server_details(s) for s in fixtures["servers"]
+        ],
+        "clean_server_details[gdat]": lambda: clean_server_details(fixtures["server"]),
+        "parse_list_response[leaderboard]": lambda: FeslClient.parse_list_response(
+            fixtures["raw_leaderboard"], b"stats."
+        ),
+        "format_leaderboard[50 rows]": lambda: format_leaderboard(
+            fixtures["leaderboard"]
+        ),
+        "parse_list_response[stats all]": lambda: FeslClient.parse_list_response(
+            fixtures["raw_stats"], b"stats."
+        ),
+        "merge_personas[30, 50% cached]": lambda: merge_personas(
+            fixtures["persona_names"],
+            fixtures["cached_personas"],
+            fixtures["fesl_personas"],
+        ),
+        "json.dumps[stats all]": lambda: json.dumps(fixtures["stats"]),
+        "json.loads[stats all]": lambda: json.loads(stats_json),
+        "json.dumps[servers with details]": lambda: json.dumps(
+            fixtures["servers_with_details"]
+        ),
+        "json.loads[servers with details]": lambda: json.loads(servers_json),
+    }
+
+
+def time_loops(func: Callable[[], Any], loops: int) -> float:
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        return time.perf_counter() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def measure(func: Callable[[], Any], rounds: int) -> Dict[str, float]:
+    # Calibrate number of loops per round (also serves as warmup)
+    loops = 1
+    while (elapsed := time_loops(func, loops)) < MIN_ROUND_TIME:
+        loops = max(loops * 2, int(loops * MIN_ROUND_TIME / max(elapsed, 1e-9)))
+    timings = [time_loops(func, loops) / loops for _ in range(rounds)]
+
+    # Measure allocations of a single call separately, since tracing slows down execution considerably
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        # Blocks still allocated after the call (i.e. the result)
+        blocks = sum(
+            stat.count_diff
+            for stat in after.compare_to(before, "filename")
+            if stat.count_diff > 0
+        )
+        del result
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "loops": loops,
+        "mean_us": mean(timings) * 1e6,
+        "min_us": min(timings) * 1e6,
+        "peak_kib": (peak - baseline) / 1024,
+        "blocks": blocks,
+    }
+
+
+def print_results(
+    results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]]
+) -> None:
+    header = f'{"benchmark":<36} {"loops":>7} {"mean us":>10} {"min us":>10} {"peak KiB":>9} {"blocks":>7}'
+    if baseline:
+        header += f' {"vs base":>8}'
+    print(header)
+    print("-" * len(header))
+    for name, result in results.items():
+        row = (
+            f'{name:<36} {result["loops"]:>7} {result["mean_us"]:>10.1f} {result["min_us"]:>10.1f} '
+            f'{result["peak_kib"]:>9.1f} {result["blocks"]:>7}'
+        )
+        if name in baseline:
+            row += f' {result["min_us"] / baseline[name]["min_us"] - 1:>+8.1%}'
+        print(row)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser("Benchmark response transformation hot paths")
+    parser.add_argument(
+        "--filter", help="Only run benchmarks containing the given string"
+    )
+    parser.add_argument(
+        "--rounds", help="Number of timing rounds per benchmark", type=int, default=5
+    )
+    parser.add_argument(
+        "--servers",
+        help="Number of servers in server list fixtures",
+        type=int,
+        default=150,
+    )
+    parser.add_argument("--save", help="Save results as JSON to given file")
+    parser.add_argument("--baseline", help="Compare results to previously saved ones")
+    parser.add_argument(
+        "--threshold",
+        help="Relative slowdown (of min time) considered a regression",
+        type=float,
+        default=0.1,
+    )
+    args = parser.parse_args()
+
+    fixtures = build_fixtures(args.servers)
+    benchmarks = get_benchmarks(fixtures)
+    results = {
+        name: measure(func, args.rounds)
+        for (name, func) in benchmarks.items()
+        if args.filter is None or args.filter in name
+    }
+
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+
+    print_results(results, baseline)
+
+    if args.save is not None:
+        with open(args.save, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+
+    regressions = [
+        name
+        for (name, result) in results.items()
+        if name in baseline
+        and result["min_us"] > baseline[name]["min_us"] * (1 + args.threshold)
+    ]
+    if len(regressions) > 0:
+        print(
+            f'\nRegressions (>{args.threshold:.0%} slower than baseline): {", ".join(regressions)}'
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+from app.servers import ServerListIndex
+
+SERVERS = [
+    {"LID": "257", "GID": "1", "N": "Friendly Rush Server", "AP": "12"},
+    {"LID": "257", "GID": "2", "N": "[CLAN] Hardcore Conquest", "AP": "30"},
+    {"LID": "257", "GID": "3", "N": "rush 24/7", "AP": "0"},
+]
+
+
+def test_name_filter_matches_word_prefixes():
+    index = ServerListIndex(SERVERS)
+    total, servers = index.query(name="rus")
+    assert total == 2
+    assert [server["GID"] for server in servers] == ["1", "3"]
+
+
+def test_name_filter_without_words_matches_nothing():
+    index = ServerListIndex(SERVERS)
+    for name in ["!!!", "  ", "[]"]:
+        total, servers = index.query(name=name)
+        assert total == 0
+        assert servers == []
+
+
+def test_empty_name_filter_combined_with_other_filters_matches_nothing():
+    index = ServerListIndex(SERVERS)
+    total, _ = index.query(name="!!!", min_players=0)
+    assert total == 0